@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import sys, signal, time
+from pathlib import Path
 
 from PySide2.QtWidgets import QApplication, QWidget
 from PySide2.QtCore import QObject, Slot, Qt, QTimer, QPoint, QPointF, QMutex
@@ -17,7 +18,11 @@ from shared_tags import *
 from gaze_pointer import GazePointer
 from label_grid import *
 from status import *
+from calibration_profiles import CalibrationProfiles
+from diagnostics import Diagnostics
+from gaze_pipeline import GazePipeline, Subscription
 import external
+import latency
 from tiles import *
 
 from debug_gaze import DebugGaze
@@ -91,7 +96,15 @@ class App(QObject):
         self.gaze_calibration = Calibration(self.widget, get_screen_geometry())
         self.gaze_calibration.end_signal.connect(self.on_calibration_end)
         self.gaze_filter = GazeFilter(self.gaze_calibration)
+        self.gaze_filter.set_blink_timing(
+            BlinkTiming(Path("~/.cache/eyeput", "blink_timing.npz").expanduser())
+        )
+        self.gaze_pipeline = GazePipeline(self.gaze_filter)
 
+        # active blink tags -> (blink mapping, compiled automaton)
+        self.blink_cache = {}
+        # takes back the speculatively dispatched blink action
+        self.blink_undo = None
         # initialize blink patterns
         self.on_tag_changed("init", True)
 
@@ -111,55 +124,88 @@ class App(QObject):
             )
         )
         self.executor = self.bus.get_no_check("executor")
+        self.diagnostics = Diagnostics(self.bus, "eyeput.diagnostics", self.gaze_filter)
+        self.calibration_profiles = CalibrationProfiles(
+            self.bus, "eyeput.calibration", self.gaze_calibration
+        )
 
         # self.graph = Graph()
         # self.graph.setup()
 
-    def on_blink(self, blink, blink_position):
+    def on_blink(self, blink, blink_position, speculation):
+        if speculation:
+            match speculation.kind:
+                case "fire":
+                    command = self.blink_mapping[speculation.blink]
+                    self.blink_undo = self.undo_action(command)
+                    latency.mark("dispatch")
+                    self.on_action(command, speculation.position, False)
+                case "rollback":
+                    if self.blink_undo:
+                        self.blink_undo()
+                    self.blink_undo = None
+                case "confirm":
+                    # already dispatched
+                    self.blink_undo = None
+                    return
         if not blink:
             return
         assert blink in self.blink_mapping, blink
         command = self.blink_mapping[blink]
+        latency.mark("dispatch")
         self.on_action(command, blink_position, False)
 
+    # restores what a reversible action changes, see is_reversible
+    def undo_action(self, item: Action):
+        if type(item) is GridLayerAction:
+            if not self.tags.has("grid"):
+                return lambda: self.tags.unset_tag("grid")
+            layer = self.grid_widget.state.layer
+            modifiers = set(self.grid_widget.state.modifiers)
+            return lambda: self.grid_widget.activate(layer, modifiers)
+        elif type(item) is BlinkAction and item.id == "scroll_stop":
+            if self.scroll_timer.isActive():
+                return self.scroll_timer.start
+        return None
+
     @Slot(object)
-    def on_gaze(self, input_frame: InputFrame):
-        callbacks = {
-            "on_blink": [self.on_blink],
-            "on_position": [self.grid_widget.on_gaze],
-            # "on_position": [self.gaze_pointer.on_gaze],
-            # "on_variance": [self.status_widget.on_variance],
-        }
-        if self.tags.has("calibration"):
-            callbacks = {
-                "on_frame": [self.gaze_calibration.on_frame],
-                "on_blink": [self.on_blink],
-            }
-        position_callback = callbacks.get("on_position", [])
-        blink_callback = callbacks.get("on_blink", [])
-        variance_callback = callbacks.get("on_variance", [])
-        frame_callback = callbacks.get("on_frame", [])
-        if self.debug_gaze.isVisible():
-            frame_callback.append(self.debug_gaze.on_frame)
-        filtered_frame = self.gaze_filter.transform(
-            input_frame,
-            position=position_callback,
-            blink=blink_callback,
-            variance=variance_callback,
-        )
-        for callback in position_callback:
-            callback(
-                filtered_frame.screen_position[0], filtered_frame.screen_position[1]
+    def on_gaze(self, input_frame: InputFrame, render=True):
+        latency.begin(input_frame.received)
+        try:
+            latency.mark("queue")
+            filtered_frame = self.gaze_pipeline.process(input_frame, render)
+            if render:
+                latency.mark("done")
+        finally:
+            latency.end()
+        # alternative configuration, after the live frame is done
+        shadow_filter = self.diagnostics.shadow_filter
+        if shadow_filter:
+            shadow_filter.transform(
+                input_frame, filtered_frame, self.gaze_pipeline.stages
             )
-        for callback in blink_callback:
-            callback(filtered_frame.flips, filtered_frame.flip_position)
-        for callback in variance_callback:
-            callback(filtered_frame.l_variance, filtered_frame.r_variance)
-        for callback in frame_callback:
-            callback(filtered_frame)
         # self.graph.addPoint(t, l0, l1, r0, r1, x, y)
         # self.currPos = QPointF(x, y)
 
+    def on_gaze_events(self, events):
+        for event in events:
+            self.grid_widget.on_fixation(event)
+
+    @Slot(object)
+    def on_gaze_batch(self, input_frames: list[InputFrame]):
+        for input_frame in input_frames:
+            self.on_gaze(input_frame)
+
+    @Slot()
+    def on_gaze_ready(self):
+        frame_queue = self.gaze_thread.frame_queue
+        input_frames = frame_queue.drain()
+        for i, input_frame in enumerate(input_frames):
+            self.on_gaze(input_frame, render=i == len(input_frames) - 1)
+        self.status_widget.on_queue_stats(
+            frame_queue.depth, frame_queue.dropped, frame_queue.coalesced
+        )
+
     @Slot()
     def on_calibration_end(self):
         self.tags.unset_tag("calibration")
@@ -305,33 +351,106 @@ class App(QObject):
             else:
                 self.gaze_calibration.cancel()
 
-        self.blink_mapping = {}
+        key = self.get_blink_tags()
+        if key not in self.blink_cache:
+            mapping = self.get_blink_mapping()
+            speculative = [
+                b for (b, action) in mapping.items() if is_reversible(action)
+            ]
+            self.blink_cache[key] = (mapping, BlinkAutomaton(mapping, speculative))
+        (self.blink_mapping, automaton) = self.blink_cache[key]
+        self.gaze_filter.set_blink_automaton(automaton)
+        # switching the patterns commits a speculative action
+        if not self.gaze_filter.blink_filter.speculated:
+            self.blink_undo = None
+        self.gaze_pipeline.compile(self.get_gaze_subscriptions())
+        engine = self.gaze_filter.params.pointer_engine
+        for name in PointerFilter.engines:
+            if self.tags.has(f"pointer_{name}"):
+                engine = name
+        self.gaze_filter.pointer_filter.set_engine(engine)
+
+        if self.grid_widget.isVisible():
+            self.grid_widget.update_grid()
+
+    # called in order, position consumers come before blinks so that blink
+    # actions, e.g. select_0, act on the position of the same frame
+    def get_gaze_subscriptions(self):
+        blink = Subscription(("flips", "flip_position", "speculation"), self.on_blink)
+        if self.tags.has("calibration"):
+            subscriptions = [
+                blink,
+                Subscription(
+                    ("l0", "l1", "r0", "r1"), self.gaze_calibration.on_frame, frame=True
+                ),
+            ]
+        else:
+            hover = "predicted_position" if Gaze.predict else "screen_position"
+            subscriptions = [
+                Subscription(
+                    (hover,),
+                    lambda position: self.grid_widget.on_gaze(position[0], position[1]),
+                    latest_only=True,
+                ),
+                Subscription(("events",), self.on_gaze_events),
+                blink,
+                # Subscription(
+                #     ("l_variance", "r_variance"),
+                #     self.status_widget.on_variance,
+                #     latest_only=True,
+                # ),
+            ]
+        if self.tags.has("debug_gaze"):
+            subscriptions.append(
+                Subscription(
+                    ("l_screen_position", "r_screen_position", "predicted_position"),
+                    lambda frame: self.debug_gaze.on_frame(frame),
+                    frame=True,
+                    latest_only=True,
+                )
+            )
+        return subscriptions
+
+    # the active tags that get_blink_mapping depends on, other tags come and go
+    # without changing the blink patterns
+    def get_blink_tags(self):
+        return frozenset(
+            tag
+            for tag in self.tags
+            if tag in ["calibration", "pause", "grid"] or f"tag_{tag}" in blink_commands
+        )
+
+    def get_blink_mapping(self):
+        blink_mapping = {}
         if self.tags.has("calibration"):
             # exclusive
-            self.blink_mapping = blink_commands["tag_calibration"]
+            blink_mapping = blink_commands["tag_calibration"]
         elif self.tags.has("pause"):
             # exclusive
-            self.blink_mapping = blink_commands["tag_pause"]
+            blink_mapping = blink_commands["tag_pause"]
         else:
             for tag in blink_commands:
                 if tag[4:] in self.tags:
                     if tag[4:] == "scrolling" and self.tags.has("grid"):
                         continue
                     # prevent overwrite
-                    self.blink_mapping |= blink_commands[tag] | self.blink_mapping
-            self.blink_mapping |= blink_commands["default"] | self.blink_mapping
-        self.gaze_filter.set_blink_patterns(self.blink_mapping)
-
-        if self.grid_widget.isVisible():
-            self.grid_widget.update_grid()
+                    blink_mapping |= blink_commands[tag] | blink_mapping
+            blink_mapping |= blink_commands["default"] | blink_mapping
+        return blink_mapping
 
     def run(self):
         hotkey_thread = HotḱeyThread()
         hotkey_thread.hotkey_signal.connect(self.onHotkeyPressed, Qt.QueuedConnection)
 
-        gaze_thread = GazeThread(self.pause_lock)
-        gaze_thread.gaze_signal.connect(self.on_gaze, Qt.QueuedConnection)
+        self.gaze_thread = GazeThread(self.pause_lock)
+        self.gaze_thread.gaze_signal.connect(self.on_gaze, Qt.QueuedConnection)
+        self.gaze_thread.gaze_batch_signal.connect(
+            self.on_gaze_batch, Qt.QueuedConnection
+        )
+        self.gaze_thread.gaze_ready_signal.connect(
+            self.on_gaze_ready, Qt.QueuedConnection
+        )
 
         hotkey_thread.start()
-        gaze_thread.start()
+        self.gaze_thread.start()
         self.qapp.exec_()
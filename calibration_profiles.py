@@ -0,0 +1,46 @@
+from gaze_calibration import Calibration
+from session_bus import SessionBus
+from util import ThreadCall
+
+
+# list and switch calibration profiles over the session bus, the calls are run
+# in the gui thread that uses the calibration
+class CalibrationProfiles:
+    bus: SessionBus
+    register_name: str
+
+    def __init__(self, bus, register_name, calibration: Calibration):
+        self.bus = bus
+        self.register_name = register_name
+        self.calibration = calibration
+        self.gui_call = ThreadCall()
+        self.populate_future = None
+        self.bus.subscribe(self.bus_event)
+
+    async def populate_bus(self):
+        # register on bus
+        await self.bus.register(self.register_name, self)
+
+    def bus_event(self, event):
+        if event == "connect":
+            if self.populate_future:
+                self.populate_future.cancel()
+            self.populate_future = self.bus.schedule(self.populate_bus())
+
+    async def profiles(self):
+        return await self.gui_call(self.calibration.list_profiles)
+
+    async def current(self):
+        return await self.gui_call(lambda: self.calibration.profile_name)
+
+    # tracker, screen, created and points of a saved profile
+    async def info(self, name):
+        return await self.gui_call(lambda: self.calibration.profile_info(name))
+
+    # a new name is uncalibrated until the next calibration is saved to it
+    async def select(self, name):
+        return await self.gui_call(lambda: self._select(name))
+
+    def _select(self, name):
+        self.calibration.select_profile(name)
+        return self.calibration.profile_name
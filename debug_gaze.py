@@ -28,6 +28,7 @@ class DebugGaze(QWidget):
         self.left = Circle(self, Colors.eye_left)
         self.right = Circle(self, Colors.eye_right)
         self.center = Circle(self, Colors.eye_center)
+        self.predicted = Circle(self, Colors.eye_predicted)
 
     def on_frame(self, frame: FilteredFrame):
         if self.isVisible():
@@ -36,3 +37,5 @@ class DebugGaze(QWidget):
             self.center.move(
                 rel2abs(0.5 * (frame.l_screen_position + frame.r_screen_position))
             )
+            if frame.predicted_position is not None:
+                self.predicted.move(rel2abs(frame.predicted_position))
@@ -0,0 +1,82 @@
+from gaze_filter import GazeFilter, GazeFilterParams, ShadowGazeFilter
+from session_bus import SessionBus
+from util import ThreadCall
+import latency
+
+
+# inspect the running gaze pipeline over the session bus
+#
+# the methods are called on the bus thread, everything that the gui thread
+# changes while processing frames is read or replaced there
+class Diagnostics:
+    bus: SessionBus
+    register_name: str
+
+    def __init__(self, bus, register_name, gaze_filter: GazeFilter):
+        self.bus = bus
+        self.register_name = register_name
+        self.gaze_filter = gaze_filter
+        # evaluated on the live frames by the app
+        self.shadow_filter: ShadowGazeFilter = None
+        self.gui_call = ThreadCall()
+        self.populate_future = None
+        self.bus.subscribe(self.bus_event)
+
+    async def populate_bus(self):
+        # register on bus
+        await self.bus.register(self.register_name, self)
+
+    def bus_event(self, event):
+        if event == "connect":
+            if self.populate_future:
+                self.populate_future.cancel()
+            self.populate_future = self.bus.schedule(self.populate_bus())
+
+    # span -> [p50, p95, p99, count], milliseconds since the frame was received,
+    # except for blink_wait, the tracker time waited for the blink latency
+    def latency(self):
+        return {
+            span: list(stats) for span, stats in latency.percentiles().items() if stats
+        }
+
+    # pattern -> [fired, confirmed, mean milliseconds saved] of speculative blinks
+    async def speculation(self):
+        return await self.gui_call(
+            lambda: {
+                pattern: [s.fired, s.confirmed, 1000 * s.saved / max(s.confirmed, 1)]
+                for pattern, s in self.gaze_filter.blink_filter.stats.items()
+            }
+        )
+
+    # blink latencies in use and the samples they are learned from
+    async def blink_timing(self):
+        return await self.gui_call(self._blink_timing)
+
+    def _blink_timing(self):
+        blink_filter = self.gaze_filter.blink_filter
+        timing = blink_filter.timing
+        return {
+            "latency": blink_filter.latency,
+            "sync_latency": blink_filter.sync_latency,
+            "intervals": len(timing.intervals) if timing else 0,
+            "gaps": len(timing.gaps) if timing else 0,
+        }
+
+    # run GazeFilterParams(**params) next to the live filter
+    async def start_shadow(self, params):
+        params = GazeFilterParams(**params)
+        await self.gui_call(lambda: self._set_shadow(params))
+
+    async def stop_shadow(self):
+        await self.gui_call(lambda: self._set_shadow(None))
+
+    def _set_shadow(self, params):
+        self.shadow_filter = (
+            ShadowGazeFilter(self.gaze_filter, params) if params else None
+        )
+
+    # divergence from the live filter and cost per frame, None if not running
+    async def shadow(self):
+        return await self.gui_call(
+            lambda: self.shadow_filter.report() if self.shadow_filter else None
+        )
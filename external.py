@@ -10,6 +10,8 @@ from pynput.mouse import Button, Controller
 # https://github.com/boppreh/keyboard
 import keyboard
 
+import latency
+
 # see https://github.com/boppreh/keyboard/issues/588
 keyboard._os_keyboard.register_key(
     (12, ()), keyboard._os_keyboard.normalize_name("ssharp")
@@ -34,18 +36,22 @@ def left_click(position=None):
         mouse.position = previous_position
     else:
         mouse.click(Button.left, 1)
+    latency.mark("inject")
 
 
 def right_click():
     mouse.click(Button.right, 1)
+    latency.mark("inject")
 
 
 def mouse_move(x, y):
     mouse.position = (x, y)
+    latency.mark("inject")
 
 
 def scroll(amount):
     mouse.scroll(0, amount)
+    latency.mark("inject")
 
 
 def press_key(keycode):
@@ -53,6 +59,7 @@ def press_key(keycode):
     keyboard.press_and_release("shift")
     time.sleep(0.02)
     keyboard.press_and_release(keycode)
+    latency.mark("inject")
 
 
 def type(text: str):
@@ -60,6 +67,7 @@ def type(text: str):
     keyboard.press_and_release("shift")
     time.sleep(0.02)
     keyboard.write(text)
+    latency.mark("inject")
 
 
 def exec(command):
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+
+# offline benchmarks of the gaze pipeline
+#
+# python gaze_benchmark.py transport circle
+# python gaze_benchmark.py batch pointer --recording session.npz
+# python gaze_benchmark.py batch --recording ~/.cache/eyeput/recordings/*.npz
+# python gaze_benchmark.py pointer --recording a.npz --profile default.npz
+
+import argparse
+import itertools
+from pathlib import Path
+import socket
+import time
+
+import numpy as np
+
+from gaze_calibration import (
+    CalibrationProfile,
+    PolynomialCalibration,
+    ScreenPlane,
+    grid_points,
+    triangulation,
+)
+from gaze_filter import (
+    FixationFilter,
+    GazeFilter,
+    GazeFilterParams,
+    PointerFilter,
+    ProjectionFilter,
+    select_eye,
+)
+from gaze_filter_reference import LoopCircleFilter, replay
+from gaze_simulation import (
+    Calibrated,
+    Profiled,
+    Uncalibrated,
+    calibration_samples,
+    distorted,
+    fixations,
+    gaze_destinations,
+    input_frames,
+    l0,
+    session,
+)
+from gaze_thread import InputFrame
+from recorded_simulation import SharedMemoryProducer, input_frame, path
+from settings import CalibrationSettings
+from shared_ring import SharedFrameRing
+from unix_socket import UnixSocket
+
+
+# columns t, l0, l1, r0, r1 of a recording, see GazeFilter.transform_batch, and
+# optionally the true screen position as target, e.g. from a simulation
+recording = None
+# projects the recording, the profile it was taken with or the simulation's
+calibration = Uncalibrated()
+
+
+def _session(n):
+    return recording if recording is not None else session(n)
+
+
+# the configured profile of the tracker if there is one for a single display
+def _default_profile():
+    paths = list(
+        Path("~/.cache/eyeput/profiles", CalibrationSettings.tracker)
+        .expanduser()
+        .glob(f"*/{CalibrationSettings.profile}.npz")
+    )
+    return paths[0] if len(paths) == 1 else None
+
+
+def _report(label, n, seconds):
+    print(
+        f"{label:<24} {n / seconds:>12.0f} frames/s {seconds / n * 1e6:>8.2f} µs/frame"
+    )
+
+
+# frames from producer to decoded InputFrames, in bursts of `burst` frames
+def benchmark_transport(n=20000, burst=8):
+    frames = [input_frame(t, x, y) for (t, x, y) in path(0.001)]
+    frames = (frames * (n // len(frames) + 1))[:n]
+    msg_length = 200
+
+    messages = [frame.to_bytes().ljust(msg_length, b"\0") for frame in frames]
+    records = [frame.to_bytes() for frame in frames]
+
+    # only the consumer side is timed, that's what the gaze thread pays
+    sock = UnixSocket("", msg_length)
+    (sock.connection, peer) = socket.socketpair()
+    seconds = 0.0
+    for i in range(0, n, burst):
+        peer.sendall(b"".join(messages[i : i + burst]))
+        start = time.perf_counter()
+        received = 0
+        while received < min(burst, n - i):
+            transmissions = sock.receive_batch(1.0)
+            received += len(InputFrame.from_batch(transmissions, msg_length))
+        seconds += time.perf_counter() - start
+    _report("socket batch", n, seconds)
+    sock.close_connection()
+    peer.close()
+
+    handshake = []
+    producer = SharedMemoryProducer(handshake.append, 256)
+    ring = SharedFrameRing.attach(handshake.pop()[1:].decode())
+    decode = lambda records: InputFrame.from_batch(records, ring.record_size)
+    seconds = 0.0
+    for i in range(0, n, burst):
+        for record in records[i : i + burst]:
+            producer.ring.write(record)
+        start = time.perf_counter()
+        ring.read(decode)
+        seconds += time.perf_counter() - start
+    _report("shared memory ring", n, seconds)
+    ring.close()
+    producer.close()
+
+
+# vectorized CircleFilter against the former loop
+def benchmark_circle(n=5000):
+    (_, positions, _) = fixations(n)
+    for lookbehind in [20, 50, 200]:
+        for label, CircleFilter in [
+            ("loop", LoopCircleFilter),
+            ("vectorized", PointerFilter.CircleFilter),
+        ]:
+            start = time.perf_counter()
+            replay(CircleFilter(), positions, lookbehind)
+            _report(f"{label} lookbehind={lookbehind}", n, time.perf_counter() - start)
+
+
+# replay of a whole session, frame by frame against GazeFilter.transform_batch
+def benchmark_batch(n=20000):
+    columns = _session(n)
+    n = len(columns["t"])
+    frames = input_frames(columns)
+    gaze_filter = GazeFilter(calibration)
+    gaze_filter.set_blink_patterns([])
+    start = time.perf_counter()
+    for frame in frames:
+        gaze_filter.transform(frame)
+    _report("stream", n, time.perf_counter() - start)
+    start = time.perf_counter()
+    gaze_filter.transform_batch(columns)
+    _report("batch", n, time.perf_counter() - start)
+
+
+# time until the position crosses the middle of a saccade from `start` along
+# `direction` after the reference did, within frames a to end
+def _lag(t, position, reference, a, end, start, direction):
+    progress = lambda x: (x[a:end] - start) @ direction / (direction @ direction)
+    (crossed_reference, crossed) = (
+        progress(reference) >= 0.5,
+        progress(position) >= 0.5,
+    )
+    if not (crossed_reference.any() and crossed.any()):
+        return None
+    return t[a + np.argmax(crossed)] - t[a + np.argmax(crossed_reference)]
+
+
+# jitter: rms distance to the target during fixations, after the pointer settled
+# lag: time until the pointer crosses the middle of a saccade after the target did
+def _pointer_metrics(t, position, target, valid, settle=0.15):
+    moving = np.r_[False, np.any(np.diff(target, axis=0) != 0, axis=1)]
+    edges = np.flatnonzero(np.diff(np.r_[False, moving, False].astype(int)))
+    saccades = list(zip(edges[::2], edges[1::2]))
+    fixation = valid & ~moving
+    for (a, b) in saccades:
+        fixation[b : np.searchsorted(t, t[b - 1] + settle)] = False
+    jitter = np.sqrt(np.mean(np.sum(np.square(position - target)[fixation], axis=1)))
+    lags = []
+    for k, (a, b) in enumerate(saccades):
+        end = saccades[k + 1][0] if k + 1 < len(saccades) else len(t)
+        if a == 0 or not valid[a - 1 : end].all():
+            continue
+        (start, direction) = (target[a - 1], target[b - 1] - target[a - 1])
+        lags.append(_lag(t, position, target, a, end, start, direction))
+    lags = [lag for lag in lags if lag is not None]
+    return (jitter, 1000 * np.mean(lags), len(lags))
+
+
+# fixations of the raw fused gaze by FixationFilter, as (first frame, end frame,
+# centroid), and the raw fused gaze
+def _fixations(t, left, right):
+    (x, opened) = select_eye(left, right, 0.5 * (left + right))
+    frames = np.flatnonzero(opened)
+    params = GazeFilterParams()
+    fixation_filter = FixationFilter(
+        params.fixation_method,
+        params.fixation_dispersion,
+        params.fixation_velocity,
+        params.fixation_min_duration,
+    )
+    (fixations, start) = ([], None)
+    for (_, event) in fixation_filter.transform_batch(t[frames], x[frames]):
+        if event.kind == "fixation_start":
+            start = event.t
+        elif event.kind == "fixation_end":
+            (a, end) = np.searchsorted(t, (start, event.t), "right")
+            fixations.append((a - 1, end, event.position))
+    return (fixations, x)
+
+
+# without a true screen position, e.g. on recorded sessions
+# jitter: rms distance to the fixation centroids, after the pointer settled
+# lag: time until the pointer crosses the middle of a saccade after the raw fused
+# gaze did
+def _fixation_metrics(t, position, gaze, fixations, valid, settle=0.15):
+    (errors, lags) = ([], [])
+    for (a, end, centroid) in fixations:
+        frames = np.arange(np.searchsorted(t, t[a] + settle), end)
+        frames = frames[valid[frames]]
+        errors.append(np.sum(np.square(position[frames] - centroid), axis=1))
+    for ((_, a, start), (_, end, destination)) in zip(fixations, fixations[1:]):
+        if not valid[a - 1 : end].all():
+            continue
+        lags.append(_lag(t, position, gaze, a, end, start, destination - start))
+    lags = [lag for lag in lags if lag is not None]
+    jitter = np.sqrt(np.mean(np.concatenate(errors))) if errors else np.nan
+    return (jitter, 1000 * np.mean(lags), len(lags))
+
+
+# jitter and lag of the pointer engines, against the true screen position of
+# simulated sessions and against the fixations of the raw gaze of recordings
+def benchmark_pointer(n=20000):
+    columns = _session(n)
+    t = columns["t"]
+    valid = columns["l1"].any(axis=1) & columns["r1"].any(axis=1)
+    fixations = None
+    for engine in ["circle", *PointerFilter.engines]:
+        gaze_filter = GazeFilter(calibration, GazeFilterParams(pointer_engine=engine))
+        result = gaze_filter.transform_batch(columns)
+        position = result["screen_position"]
+        if "target" in columns:
+            (jitter, lag, saccades) = _pointer_metrics(
+                t, position, columns["target"], valid
+            )
+        else:
+            if fixations is None:
+                (fixations, gaze) = _fixations(
+                    t, result["l_screen_position"], result["r_screen_position"]
+                )
+            (jitter, lag, saccades) = _fixation_metrics(
+                t, position, gaze, fixations, valid
+            )
+        print(
+            f"{engine:<24} jitter {jitter:.4f} screen lag {lag:>6.1f} ms"
+            f" ({saccades} saccades)"
+        )
+
+
+# error of the predicted position against the pointer position `horizon` later,
+# compared to not predicting, per pointer engine; moving are frames where the
+# pointer moves by more than 0.01 screen within the horizon
+def benchmark_prediction(n=20000):
+    columns = _session(n)
+    t = columns["t"]
+    valid = columns["l1"].any(axis=1) & columns["r1"].any(axis=1)
+    for (engine, horizon) in itertools.product(
+        ["circle", *PointerFilter.engines], [0.016, 0.033, 0.05]
+    ):
+        params = GazeFilterParams(prediction_horizon=horizon, pointer_engine=engine)
+        result = GazeFilter(calibration, params).transform_batch(columns)
+        (position, predicted) = (
+            result["screen_position"],
+            result["predicted_position"],
+        )
+        future = np.stack(
+            [np.interp(t + horizon, t, position[:, k]) for k in range(2)], axis=1
+        )
+        # the future position is interpolated between open eye samples
+        j = np.minimum(np.searchsorted(t, t + horizon), len(t) - 1)
+        frames = valid & valid[j] & valid[j - 1] & (t + horizon <= t[-1])
+        moving = frames & (np.linalg.norm(future - position, axis=1) > 0.01)
+        rms = lambda x, m: np.sqrt(np.mean(np.sum(np.square(x - future)[m], axis=1)))
+        print(
+            f"{engine:<9} {1000 * horizon:>3.0f} ms"
+            f"  all {rms(position, frames):.4f} -> {rms(predicted, frames):.4f}"
+            f"  moving {rms(position, moving):.4f} -> {rms(predicted, moving):.4f}"
+        )
+
+
+# rms error against the true screen position of the calibration models on a
+# distorted tracker, and their cost per frame through ProjectionFilter
+def benchmark_calibration(n=5000):
+    y = np.random.default_rng(1).uniform(0.02, 0.98, (n, 2))
+    v1 = np.zeros((n, 3))
+    v1[:, :2] = distorted(y)
+    for (columns, rows) in [(2, 2), (3, 3), (4, 4), (5, 5)]:
+        references = np.array(grid_points(columns, rows))
+        samples = calibration_samples(references)
+        targets = np.repeat(references, samples.shape[1], axis=0)
+        models = {
+            # the reference point means, without outliers as EyeCalibration
+            "triangles": triangulation(np.median(samples, axis=1), references),
+            **{
+                f"polynomial order {order}": PolynomialCalibration.fit(
+                    samples.reshape(-1, 2), targets, order
+                )
+                for order in [2, 3]
+            },
+        }
+        for label, model in models.items():
+            projection_filter = ProjectionFilter(Calibrated(model))
+            error = projection_filter.transform_batch(None, None, v1) - y
+            rms = np.sqrt(np.mean(np.sum(np.square(error), axis=1)))
+            out = np.zeros(2)
+            start = time.perf_counter()
+            for i in range(n):
+                projection_filter.transform(None, None, v1[i : i + 1], out)
+            seconds = (time.perf_counter() - start) / n
+            print(
+                f"{columns}x{rows} {label:<20} rms {rms:.4f} screen"
+                f" {seconds * 1e6:>6.2f} µs/frame"
+            )
+
+
+# rms error against the true screen position after moving the head away from
+# where it rested while calibrating
+def benchmark_head(n=5000):
+    rng = np.random.default_rng(1)
+    y = np.repeat(np.array(grid_points(3, 3)), 45, axis=0)
+    eyes = l0 + rng.normal(0, (15, 10, 20), (len(y), 3))
+    destinations = gaze_destinations(eyes, y)
+    destinations[:, :2] += rng.normal(0, 2.0, (len(y), 2))
+    models = {
+        "polynomial": PolynomialCalibration.fit(destinations[:, :2], y),
+        "plane": ScreenPlane.fit(eyes, destinations, y),
+    }
+    x = rng.uniform(0.02, 0.98, (n, 2))
+    for offset in [0.0, 20.0, 40.0, 80.0]:
+        v0 = np.tile(l0 + (offset, offset / 2, offset), (n, 1))
+        v1 = gaze_destinations(v0, x)
+        for label, model in models.items():
+            error = Calibrated(model).transform_batch(None, v0, v1) - x
+            rms = np.sqrt(np.mean(np.sum(np.square(error), axis=1)))
+            print(f"head moved {offset:>4.0f} mm {label:<12} rms {rms:.4f} screen")
+
+
+if __name__ == "__main__":
+    benchmarks = {
+        "transport": benchmark_transport,
+        "circle": benchmark_circle,
+        "batch": benchmark_batch,
+        "pointer": benchmark_pointer,
+        "prediction": benchmark_prediction,
+        "calibration": benchmark_calibration,
+        "head": benchmark_head,
+    }
+    parser = argparse.ArgumentParser(description="gaze pipeline benchmarks")
+    # argparse checks choices against the empty default of nargs="*" as well
+    parser.add_argument("benchmark", nargs="*", help=", ".join(benchmarks))
+    parser.add_argument(
+        "--recording",
+        nargs="+",
+        help="npz files with columns t, l0, l1, r0, r1, e.g. recorded with Gaze.record",
+    )
+    parser.add_argument(
+        "--profile",
+        help="calibration profile the recording was taken with, defaults to"
+        " CalibrationSettings.profile",
+    )
+    args = parser.parse_args()
+    for name in args.benchmark:
+        if name not in benchmarks:
+            parser.error(
+                f"unknown benchmark {name}, choose from {', '.join(benchmarks)}"
+            )
+    if args.recording:
+        files = [np.load(path) for path in args.recording]
+        recording = {
+            key: np.concatenate([file[key] for file in files]) for key in files[0].files
+        }
+        # simulated recordings with a target are uncalibrated
+        profile = args.profile or ("target" not in recording and _default_profile())
+        if profile:
+            calibration = Profiled(CalibrationProfile(Path(profile)))
+        elif "target" not in recording:
+            print("no calibration profile, the recording is projected uncalibrated")
+    for name in args.benchmark or benchmarks:
+        print(f"# {name}")
+        benchmarks[name]()
@@ -3,9 +3,10 @@
 # ~/downloads/talon-linux/talon/resources/python/lib/python3.9/site-packages/talon/track/tobii.pyi
 
 
-from collections import deque
 from pathlib import Path
 import pickle
+import time
+import zipfile
 
 from PySide2.QtWidgets import QWidget
 from PySide2.QtGui import QPainter, QPixmap, QColor
@@ -15,38 +16,501 @@ import numpy as np
 
 from util import *
 from gaze_filter import *
+from logger import log_info
 from settings import *
 
 screen_size_mm = vec(344.0, -193.0)
 
-calibration_points = [
-    vec(0.01, 0.01),
-    vec(0.99, 0.01),
-    vec(0.01, 0.95),
-    vec(0.97, 0.95),
-]
-
 
+# reference points row by row
+def grid_points(columns, rows):
+    return [
+        vec(x, y)
+        for y in np.linspace(0.01, 0.95, rows)
+        for x in np.linspace(0.01, 0.99, columns)
+    ]
+
+
+calibration_points = grid_points(CalibrationSettings.columns, CalibrationSettings.rows)
+
+
+# Bowyer-Watson, index triples into points
+def delaunay(points):
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    # super triangle around all points
+    extent = np.ptp(points, axis=0).max() + 1.0
+    corners = [(-100.0, -100.0), (100.0, -100.0), (0.0, 100.0)]
+    vertices = np.concatenate(
+        (points, points.mean(axis=0) + extent * np.array(corners))
+    )
+
+    def circumcircle(triangle):
+        (a, b, c) = vertices[list(triangle)]
+        (b, c) = (b - a, c - a)
+        d = 2 * (b[0] * c[1] - b[1] * c[0])
+        center = (
+            np.array((c[1] * (b @ b) - b[1] * (c @ c), b[0] * (c @ c) - c[0] * (b @ b)))
+            / d
+        )
+        return (a + center, center @ center)
+
+    # triangle -> circumcircle
+    triangles = {(n, n + 1, n + 2): circumcircle((n, n + 1, n + 2))}
+    for i, p in enumerate(points):
+        bad = [
+            triangle
+            for triangle, (center, r2) in triangles.items()
+            if np.sum(np.square(p - center)) < r2 * (1 - 1e-12)
+        ]
+        # the cavity boundary are the edges of exactly one bad triangle
+        edges = {}
+        for (a, b, c) in bad:
+            del triangles[(a, b, c)]
+            for edge in ((a, b), (b, c), (c, a)):
+                key = tuple(sorted(edge))
+                edges[key] = key not in edges
+        for edge, boundary in edges.items():
+            if boundary:
+                triangles[(*edge, i)] = circumcircle((*edge, i))
+    return np.array([t for t in triangles if max(t) < n]).reshape(-1, 3)
+
+
+# piecewise affine map from measured to screen positions over triangles, the
+# first triangle containing a point is used and the last one extrapolates
+#
+# a baked map is instead looked up bilinearly in a table over measured positions
+# that samples the triangles, see bake
 @dataclass
 class CalibrationData:
+    # measured corners, shape (triangles, 3, 2)
     r: np.ndarray = None
+    # inverse of the edges [r0 - r2, r1 - r2] as columns, shape (triangles, 2, 2)
     Tinv: np.ndarray = None
+    # screen positions of the corners, shape (triangles, 3, 2)
     y: np.ndarray = None
+    # screen positions at the nodes, shape (rows, columns, 2)
+    lut: np.ndarray = None
+    # measured position of the first node and distance between nodes
+    lut_origin: np.ndarray = None
+    lut_step: np.ndarray = None
+
+    def __post_init__(self):
+        self._stack()
+
+    def __getstate__(self):
+        return {
+            "r": self.r,
+            "Tinv": self.Tinv,
+            "y": self.y,
+            "lut": self.lut,
+            "lut_origin": self.lut_origin,
+            "lut_step": self.lut_step,
+        }
+
+    # older pickles hold lists of per triangle arrays and a scratch vector l
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.pop("l", None)
+        self._stack()
+
+    def arrays(self):
+        state = self.__getstate__()
+        return {key: value for key, value in state.items() if value is not None}
+
+    @staticmethod
+    def from_arrays(arrays):
+        return CalibrationData(**arrays)
+
+    def validate(self):
+        shapes = {"Tinv": (2, 2), "y": (3, 2)}
+        if self.r is None or self.r.ndim != 3 or self.r.shape[1:] != (3, 2):
+            raise ValueError("triangles have to be of shape (triangles, 3, 2)")
+        for key, shape in shapes.items():
+            if getattr(self, key).shape != (len(self.r), *shape):
+                raise ValueError(f"{key} doesn't match the triangles")
+        if self.lut is not None and (
+            self.lut.ndim != 3
+            or min(self.lut.shape[:2]) < 2
+            or self.lut_origin.shape != (2,)
+            or self.lut_step.shape != (2,)
+        ):
+            raise ValueError("invalid lookup table")
+        if not all(np.isfinite(x).all() for x in self.arrays().values()):
+            raise ValueError("calibration isn't finite")
+
+    def _stack(self):
+        if self.r is None:
+            return
+        self.r = np.asarray(self.r, dtype=float)
+        self.Tinv = np.asarray(self.Tinv, dtype=float)
+        self.y = np.asarray(self.y, dtype=float)
+        # barycentric coordinates l = Tinv @ x + offset
+        self.offset = -np.einsum("tij,tj->ti", self.Tinv, self.r[:, 2])
+        # screen position = y2 + l @ edges
+        self.edges = self.y[:, :2] - self.y[:, 2:]
+
+    # the triangle containing x, or the one closest to containing it
+    def interpolate_batch(self, x):
+        l = np.einsum("tij,nj->nti", self.Tinv, x) + self.offset
+        # smallest barycentric coordinate, negative outside
+        margin = np.minimum(l.min(axis=2), 1 - l.sum(axis=2))
+        triangle = np.argmax(margin, axis=1)
+        l = l[np.arange(len(x)), triangle]
+        return self.y[triangle, 2] + np.einsum("nk,nkj->nj", l, self.edges[triangle])
+
+    # sample interpolate_batch on a grid around the measured points, extended by
+    # `margin` of their extent on each side, beyond the map is clamped
+    def bake(self, size=(256, 256), margin=0.5):
+        points = self.r.reshape(-1, 2)
+        (lower, upper) = (points.min(axis=0), points.max(axis=0))
+        (lower, upper) = (
+            lower - margin * (upper - lower),
+            upper + margin * (upper - lower),
+        )
+        (u, v) = np.meshgrid(
+            *(np.linspace(lower[k], upper[k], size[k]) for k in range(2))
+        )
+        nodes = np.stack((u.ravel(), v.ravel()), axis=1)
+        self.lut = self.interpolate_batch(nodes).reshape(size[1], size[0], 2)
+        self.lut_origin = lower
+        self.lut_step = (upper - lower) / (np.array(size) - 1)
+
+    def _lookup(self, x):
+        (rows, columns) = self.lut.shape[:2]
+        u = (x[0] - self.lut_origin[0]) / self.lut_step[0]
+        v = (x[1] - self.lut_origin[1]) / self.lut_step[1]
+        u = min(max(u, 0.0), columns - 1.0)
+        v = min(max(v, 0.0), rows - 1.0)
+        (j, i) = (min(int(u), columns - 2), min(int(v), rows - 2))
+        (a, b) = (u - j, v - i)
+        weights = ((1 - a) * (1 - b), a * (1 - b), (1 - a) * b, a * b)
+        return np.dot(weights, self.lut[i : i + 2, j : j + 2].reshape(4, 2))
+
+    def _lookup_batch(self, x):
+        (rows, columns) = self.lut.shape[:2]
+        u = (x - self.lut_origin) / self.lut_step
+        np.clip(u, 0.0, (columns - 1.0, rows - 1.0), out=u)
+        k = np.minimum(u.astype(int), (columns - 2, rows - 2))
+        (a, b) = (u - k).T
+        (j, i) = k.T
+        lut = self.lut
+        top = (1 - a)[:, None] * lut[i, j] + a[:, None] * lut[i, j + 1]
+        bottom = (1 - a)[:, None] * lut[i + 1, j] + a[:, None] * lut[i + 1, j + 1]
+        return (1 - b)[:, None] * top + b[:, None] * bottom
+
+    def transform(self, x):
+        if self.lut is not None:
+            return self._lookup(x)
+        # barycentric coordinates in every triangle
+        l = self.Tinv @ x
+        l += self.offset
+        inside = (np.abs(l - 0.5) <= 0.5).all(axis=1)
+        triangle = inside.argmax() if inside.any() else len(l) - 1
+        return self.y[triangle, 2] + l[triangle] @ self.edges[triangle]
+
+    # same as transform, for all rows of x at once
+    def transform_batch(self, x):
+        if self.lut is not None:
+            return self._lookup_batch(x)
+        # barycentric coordinates in every triangle, shape (n, triangles, 2)
+        l = np.einsum("tij,nj->nti", self.Tinv, x) + self.offset
+        inside = (np.abs(l - 0.5) <= 0.5).all(axis=2)
+        inside[:, -1] = True
+        triangle = np.argmax(inside, axis=1)
+        l = l[np.arange(len(x)), triangle]
+        return self.y[triangle, 2] + np.einsum("nk,nkj->nj", l, self.edges[triangle])
+
+
+# calibration over index triples into measured x and screen positions y
+def triangle_map(x, y, triangles):
+    r = x[triangles]
+    return CalibrationData(
+        r=r,
+        Tinv=np.linalg.inv(np.stack((r[:, 0] - r[:, 2], r[:, 1] - r[:, 2]), axis=2)),
+        y=y[triangles],
+    )
+
+
+# triangles of consecutive points, as the former four point calibration
+def triangle_strip(x, y):
+    return triangle_map(x, y, np.arange(len(x) - 2)[:, None] + np.arange(3))
+
+
+# delaunay triangulation of the reference grid, which has no slivers unlike the
+# noisy measured points, baked into a lookup table
+def triangulation(x, y):
+    calibration_data = triangle_map(x, y, delaunay(y))
+    calibration_data.bake()
+    return calibration_data
+
+
+# 2d polynomial from measured to screen positions, fitted by least squares to all
+# samples of the reference points
+@dataclass
+class PolynomialCalibration:
+    # exponents (i, j) of the terms u^i v^j
+    exponents: list = None
+    # shape (terms, 2)
+    coefficients: np.ndarray = None
+    # measured positions are normalized to u, v = (x - center) / scale
+    center: np.ndarray = None
+    scale: np.ndarray = None
+
+    @staticmethod
+    def fit(x, y, order=2, rejection=3.0, iterations=3):
+        # no more terms than distinct reference points
+        references = len(np.unique(y, axis=0))
+        while (order + 1) * (order + 2) // 2 > references:
+            order -= 1
+        exponents = [(i, n - i) for n in range(order + 1) for i in range(n, -1, -1)]
+        center = x.mean(axis=0)
+        scale = x.std(axis=0)
+        calibration = PolynomialCalibration(exponents, None, center, scale)
+        terms = calibration.terms_batch(x)
+        # drop samples beyond `rejection` times the robust spread of the
+        # residuals, e.g. saccades and blinks, and fit again
+        inliers = np.ones(len(x), dtype=bool)
+        for i in range(iterations):
+            calibration.coefficients = np.linalg.lstsq(
+                terms[inliers], y[inliers], rcond=None
+            )[0]
+            residual = np.linalg.norm(terms @ calibration.coefficients - y, axis=1)
+            median = np.median(residual[inliers])
+            spread = 1.4826 * np.median(np.abs(residual[inliers] - median))
+            limit = median + rejection * max(spread, 1e-9)
+            if np.array_equal(inliers, residual <= limit):
+                break
+            inliers = residual <= limit
+        return calibration
+
+    def arrays(self):
+        return {
+            "exponents": np.array(self.exponents),
+            "coefficients": self.coefficients,
+            "center": self.center,
+            "scale": self.scale,
+        }
+
+    @staticmethod
+    def from_arrays(arrays):
+        exponents = [tuple(int(i) for i in e) for e in arrays["exponents"]]
+        return PolynomialCalibration(
+            exponents, arrays["coefficients"], arrays["center"], arrays["scale"]
+        )
+
+    def validate(self):
+        if self.coefficients.shape != (len(self.exponents), 2):
+            raise ValueError("coefficients don't match the exponents")
+        if self.center.shape != (2,) or self.scale.shape != (2,):
+            raise ValueError("invalid normalization")
+        if not all(np.isfinite(x).all() for x in self.arrays().values()):
+            raise ValueError("calibration isn't finite")
+
+    def terms_batch(self, x):
+        (u, v) = ((x - self.center) / self.scale).T
+        return np.stack([u**i * v**j for (i, j) in self.exponents], axis=1)
 
-    # properties used for faster computation
-    l: np.ndarray = None
+    def transform(self, x):
+        u = (x[0] - self.center[0]) / self.scale[0]
+        v = (x[1] - self.center[1]) / self.scale[1]
+        return np.dot([u**i * v**j for (i, j) in self.exponents], self.coefficients)
 
-    # there's quite a performance penalty for a generic solution
-    def __iter__(self):
-        return iter((self.r, self.Tinv, self.y, self.l))
+    def transform_batch(self, x):
+        return self.terms_batch(x) @ self.coefficients
 
-    def _is_last(self):
-        for i in range(len(self.r) - 1):
-            yield False
-        yield True
 
-    def triangles(self):
-        return zip(self.r, self.Tinv, self.y, self._is_last())
+# the screen as a plane in tracker coordinates [mm], screen position y is at
+# origin + y @ axes; a frame is projected by intersecting the ray from the eye
+# position v0 through the gaze destination v1 with the plane, so that moving the
+# head after calibrating doesn't shift the pointer
+@dataclass
+class ScreenPlane:
+    origin: np.ndarray = None
+    # shape (2, 3)
+    axes: np.ndarray = None
+    # mean eye position while calibrating, stands in for missing eye positions
+    eye: np.ndarray = None
+
+    def __post_init__(self):
+        if self.axes is not None:
+            self.normal = np.cross(*self.axes)
+            self.inverse = np.linalg.pinv(self.axes)
+
+    # the display plane that the tracker projects to, see EyeCalibration
+    @staticmethod
+    def nominal():
+        (origin, axes) = (np.zeros(3), np.zeros((2, 3)))
+        origin[:2] = -vec(0.5, 1.0) * screen_size_mm
+        axes[[0, 1], [0, 1]] = screen_size_mm
+        return ScreenPlane(origin, axes)
+
+    # the depth of the plane is only observable from the head moving while
+    # calibrating, with a resting head the rays meet in the eye and `prior`
+    # weights the nominal plane per sample
+    #
+    # the least squares distance of the points at the reference positions y to
+    # the rays is linear, but the rays are as noisy as the gaze destinations
+    # and the fit shrinks the plane towards the eye (errors in variables), so it
+    # only starts a few Gauss-Newton steps on the error of the gaze destinations
+    @staticmethod
+    def fit(eyes, destinations, y, prior=1e-6, steps=5):
+        d = destinations - eyes
+        d /= np.linalg.norm(d, axis=1, keepdims=True)
+        # cross product with d as matrix, shape (n, 3, 3)
+        cross = np.zeros((len(d), 3, 3))
+        cross[:, [2, 0, 1], [1, 2, 0]] = d
+        cross[:, [1, 2, 0], [2, 0, 1]] = -d
+        # d x (origin + y0 axes[0] + y1 axes[1] - eye) = 0
+        weights = np.concatenate([np.ones((len(y), 1)), y], axis=1)
+        a = (cross[:, :, None, :] * weights[:, None, :, None]).reshape(-1, 9)
+        b = np.einsum("nij,nj->ni", cross, eyes).reshape(-1)
+        nominal = ScreenPlane.nominal()
+        nominal = np.concatenate([nominal.origin, nominal.axes.reshape(-1)])
+        scale = np.sqrt(prior * len(y))
+        theta = np.linalg.lstsq(
+            np.concatenate([a, scale * np.eye(9)]),
+            np.concatenate([b, scale * nominal]),
+            rcond=None,
+        )[0]
+        for _ in range(steps):
+            # the ray through the screen point hits the destination's depth at
+            # eye + s d
+            d = weights @ theta.reshape(3, 3) - eyes
+            s = (destinations[:, 2] - eyes[:, 2]) / d[:, 2]
+            residual = eyes[:, :2] + s[:, None] * d[:, :2] - destinations[:, :2]
+            # derivatives by d, shape (n, 2, 3), and by theta, shape (n, 2, 3, 3)
+            jacobian = np.zeros((len(d), 2, 3))
+            jacobian[:, [0, 1], [0, 1]] = s[:, None]
+            jacobian[:, :, 2] = -(s / d[:, 2])[:, None] * d[:, :2]
+            jacobian = weights[:, None, :, None] * jacobian[:, :, None, :]
+            theta -= np.linalg.lstsq(
+                np.concatenate([jacobian.reshape(-1, 9), scale * np.eye(9)]),
+                np.concatenate([residual.reshape(-1), scale * (theta - nominal)]),
+                rcond=None,
+            )[0]
+        return ScreenPlane(theta[:3], theta[3:].reshape(2, 3), eyes.mean(axis=0))
+
+    def arrays(self):
+        return {"origin": self.origin, "axes": self.axes, "eye": self.eye}
+
+    @staticmethod
+    def from_arrays(arrays):
+        return ScreenPlane(arrays["origin"], arrays["axes"], arrays["eye"])
+
+    def validate(self):
+        if self.origin.shape != (3,) or self.axes.shape != (2, 3):
+            raise ValueError("invalid screen plane")
+        if self.eye.shape != (3,):
+            raise ValueError("invalid eye position")
+        if not all(np.isfinite(x).all() for x in self.arrays().values()):
+            raise ValueError("calibration isn't finite")
+        if not self.normal.any():
+            raise ValueError("degenerate screen plane")
+
+    # eye positions v0 and gaze destinations v1, shape (n, 3)
+    def transform_batch(self, v0, v1):
+        v0 = np.where(v0.any(axis=1, keepdims=True), v0, self.eye)
+        d = v1 - v0
+        # rays parallel to the plane end up at infinity
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = ((self.origin - v0) @ self.normal) / (d @ self.normal)
+        point = v0 + distance[:, None] * d - self.origin
+        return point @ self.inverse
+
+    def transform(self, v0, v1):
+        return self.transform_batch(v0[None], v1[None])[0]
+
+
+# calibration profiles are npz files with the keys
+#
+#   version, tracker, screen (width, height), created (unix time), points
+#   <eye>.model            name in calibration_models
+#   <eye>.<array>          arrays of the model, e.g. left.Tinv
+profile_version = 1
+calibration_models = {
+    "triangles": CalibrationData,
+    "polynomial": PolynomialCalibration,
+    "plane": ScreenPlane,
+}
+
+
+# models by eye label
+def save_profile(path: Path, models, tracker, screen, points):
+    arrays = {
+        "version": profile_version,
+        "tracker": tracker,
+        "screen": np.array(screen),
+        "created": time.time(),
+        "points": np.array(points),
+    }
+    for label, model in models.items():
+        (name,) = [n for n, cls in calibration_models.items() if type(model) is cls]
+        arrays[f"{label}.model"] = name
+        arrays |= {f"{label}.{key}": x for key, x in model.arrays().items()}
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # don't leave a partial profile behind
+    partial = path.with_suffix(".partial")
+    with partial.open("wb") as file:
+        np.savez(file, **arrays)
+    partial.replace(path)
+
+
+# truncated or otherwise unreadable npz files
+profile_errors = (OSError, EOFError, zipfile.BadZipFile)
+
+
+# checks the metadata on opening, the models are read on demand, a profile that
+# can't be read raises ValueError
+class CalibrationProfile:
+    def __init__(self, path: Path, screen=None):
+        try:
+            self.file = np.load(path, allow_pickle=False)
+        except profile_errors as e:
+            raise ValueError(f"{path} is unreadable: {e}")
+        try:
+            self._check(path, screen)
+        except ValueError:
+            self.close()
+            raise
+
+    def _check(self, path, screen):
+        try:
+            version = int(self.file["version"])
+            self.metadata = {
+                "tracker": str(self.file["tracker"]),
+                "screen": tuple(int(x) for x in self.file["screen"]),
+                "created": float(self.file["created"]),
+                "points": len(self.file["points"]),
+            }
+        except KeyError as e:
+            raise ValueError(f"{path} misses {e}")
+        except profile_errors as e:
+            raise ValueError(f"{path} is unreadable: {e}")
+        if version != profile_version:
+            raise ValueError(f"{path} has version {version}")
+        if screen is not None and self.metadata["screen"] != tuple(screen):
+            raise ValueError(f"{path} is for screen {self.metadata['screen']}")
+
+    def close(self):
+        self.file.close()
+
+    def model(self, label):
+        prefix = f"{label}."
+        try:
+            name = str(self.file[f"{label}.model"])
+            arrays = {
+                key[len(prefix) :]: self.file[key]
+                for key in self.file.files
+                if key.startswith(prefix) and key != f"{label}.model"
+            }
+        except profile_errors as e:
+            raise ValueError(f"{label} model is unreadable: {e}")
+        if name not in calibration_models:
+            raise ValueError(f"unknown calibration model {name}")
+        model = calibration_models[name].from_arrays(arrays)
+        model.validate()
+        return model
 
 
 class LookAtMe(QWidget):
@@ -86,49 +550,122 @@ class EyeMarker(QWidget):
         painter.drawRect(QRect(0, 0, 20, 20))
 
 
+# samples of one reference point in O(1) per sample: blinks and samples off the
+# median of the recent ones by `rejection` robust spreads, e.g. saccades, are
+# rejected, the accepted ones update a running mean and spread (Welford)
+#
+# samples are kept as records of `shape`, e.g. with the eye position
+class CalibrationSampler:
+    # robust spread below which samples aren't rejected [mm]
+    min_spread = 2.0
+
+    def __init__(self, take, spread, ring=9, rejection=3.0, shape=(2,)):
+        self.take = take
+        self.spread = spread
+        self.rejection = rejection
+        self.recent = RingBuffer(ring, (2,))
+        # the last `take` accepted samples
+        self.accepted = RingBuffer(take, shape)
+        self.clear()
+
+    def clear(self):
+        self.recent.clear()
+        self.restart()
+
+    def restart(self):
+        self.accepted.clear()
+        self.n = 0
+        self.mean = np.zeros(2)
+        self.m2 = 0.0
+
+    # returns whether x was accepted
+    def add(self, x, record=None):
+        # eye closed
+        if not x.any():
+            return False
+        self.recent.append(x)
+        if len(self.recent) < self.recent.length:
+            return False
+        recent = self.recent.last()
+        median = np.median(recent, axis=0)
+        distance = np.sqrt(np.sum(np.square(recent - median), axis=1))
+        mad = max(1.4826 * np.median(distance), self.min_spread)
+        if distance[-1] > self.rejection * mad:
+            return False
+        # the gaze settled elsewhere, e.g. after a late saccade
+        if self.n and np.sqrt(np.sum(np.square(median - self.mean))) > self.spread:
+            self.restart()
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta @ (x - self.mean)
+        self.accepted.append(x if record is None else record)
+        return True
+
+    # rms distance of the accepted samples to their mean
+    def rms(self):
+        return np.sqrt(self.m2 / self.n) if self.n else np.inf
+
+    def done(self):
+        return self.n >= self.take and self.rms() < self.spread
+
+    def samples(self):
+        return self.accepted.last(len(self.accepted)).copy()
+
+
 class EyeCalibration:
+    # CalibrationData or PolynomialCalibration
     calibration_data: CalibrationData
 
     def __init__(self, parent, label, color, references):
         self.marker = EyeMarker(parent, color)
         self.marker.show()
-        self.position_buffer = deque(maxlen=30)
+        self.sampler = CalibrationSampler(
+            CalibrationSettings.samples, CalibrationSettings.spread, shape=(6,)
+        )
         self.measurements = np.zeros((len(references), 2))
+        # accepted eye positions and gaze destinations per reference point,
+        # fitted by PolynomialCalibration and ScreenPlane
+        self.samples = [np.zeros((0, 6))] * len(references)
         self.index = -1
+        self.label = label
+        # CalibrationProfile that the model is read from on first use
+        self.profile = None
+        self.calibration_data = None
+
+    def use_profile(self, profile: CalibrationProfile):
+        (self.profile, self.calibration_data) = (profile, None)
 
-        self.calibration_path = Path("~/.cache/eyeput", label).expanduser()
-        self.calibration_path.parent.mkdir(exist_ok=True, parents=True)
+    def load(self):
+        (profile, self.profile) = (self.profile, None)
         try:
-            with self.calibration_path.open("rb") as file:
-                self.calibration_data = pickle.load(file)
-        except FileNotFoundError as e:
-            self.calibration_data = None
+            self.calibration_data = profile.model(self.label)
+        except (KeyError, ValueError) as e:
+            log_info(f"calibration of {self.label} eye not loaded: {e}")
 
     def transform(self, t, v0, v1):
+        if self.profile:
+            self.load()
         x = v1[-1][:2]
         # initial guess: project to zero plane
         if self.calibration_data is None:
             return x / screen_size_mm + vec(0.5, 1.0)
+        elif isinstance(self.calibration_data, ScreenPlane):
+            return self.calibration_data.transform(v0[-1], v1[-1])
         # https://en.wikipedia.org/wiki/Barycentric_coordinate_system#Edge_approach
         else:
-            l = self.calibration_data.l
-
-            def find_triangle(l):
-                triangles = self.calibration_data.triangles()
-                for r, Tinv, y, is_last in triangles:
-                    l[:2] = Tinv @ (x - r[2])
-                    if 0 <= l[0] <= 1 and 0 <= l[1] <= 1 or is_last:
-                        l[2] = 1 - l[0] - l[1]
-                        return y
-
-            y = find_triangle(l)
-            screen_position = np.dot(l, y)
-            # ntimes(
-            #     1000,
-            #     lambda: find_triangle(),
-            #     lambda: np.zeros(3),
-            # )
-            return screen_position
+            return self.calibration_data.transform(x)
+
+    def transform_batch(self, t, v0, v1):
+        if self.profile:
+            self.load()
+        x = v1[:, :2]
+        if self.calibration_data is None:
+            return x / screen_size_mm + vec(0.5, 1.0)
+        elif isinstance(self.calibration_data, ScreenPlane):
+            return self.calibration_data.transform_batch(v0, v1)
+        else:
+            return self.calibration_data.transform_batch(x)
 
     def next(self, index):
         if index == -1:
@@ -136,44 +673,35 @@ class EyeCalibration:
         else:
             self.index = index
             self.measurements[index].fill(0.0)
-            self.position_buffer.clear()
+            self.sampler.clear()
             self.marker.show()
 
     def finalize(self):
-        x = self.measurements.copy()
-        # triangle strip
-        I = range(len(x) - 2)
-        self.calibration_data = CalibrationData(
-            r=[x[i : i + 3] for i in I],
-            Tinv=[
-                np.linalg.inv(
-                    np.array([x[i + 0] - x[i + 2], x[i + 1] - x[i + 2]]).transpose()
-                )
-                for i in I
-            ],
-            y=[calibration_points[i : i + 3] for i in I],
-            l=np.zeros(3),
-        )
-        with self.calibration_path.open("wb") as file:
-            pickle.dump(self.calibration_data, file, pickle.HIGHEST_PROTOCOL)
+        y = np.array(calibration_points)
+        samples = np.concatenate(self.samples)
+        targets = np.repeat(y, [len(s) for s in self.samples], axis=0)
+        if CalibrationSettings.model == "polynomial":
+            self.calibration_data = PolynomialCalibration.fit(
+                samples[:, 3:5], targets, CalibrationSettings.polynomial_order
+            )
+        elif CalibrationSettings.model == "plane":
+            self.calibration_data = ScreenPlane.fit(
+                samples[:, :3], samples[:, 3:], targets
+            )
+        else:
+            self.calibration_data = triangulation(self.measurements.copy(), y)
+        self.profile = None
 
-    def on_gaze(self, reference, gaze_position, take, test, radius_mm):
+    def on_gaze(self, reference, eye_position, gaze_position):
         gaze_position_2d = gaze_position[:2]
-
-        # calculate new mean
-        self.position_buffer.append(gaze_position_2d)
-        self.measurements[self.index] = np.mean(
-            slice(self.position_buffer, -take), axis=0
-        )
-        distance = np.linalg.norm(
-            slice(self.position_buffer, -(take + test)) - self.measurements[self.index],
-            axis=1,
-        )
+        record = np.concatenate([eye_position, gaze_position])
+        if self.sampler.add(gaze_position_2d, record):
+            self.measurements[self.index] = self.sampler.mean
 
         # decide whether this reference point has completed
-        self.is_ok = len(self.position_buffer) >= take + test and np.all(
-            distance < radius_mm
-        )
+        self.is_ok = self.sampler.done()
+        if self.is_ok:
+            self.samples[self.index] = self.sampler.samples()
 
         # visualize current deviation
         deviation = (self.measurements[self.index] - gaze_position_2d) / screen_size_mm
@@ -193,6 +721,67 @@ class Calibration(QWidget):
         self.right = EyeCalibration(self, "right", Colors.eye_right, calibration_points)
         self.hide()
 
+        self.screen = (geometry.width(), geometry.height())
+        self.profiles = Path(
+            "~/.cache/eyeput/profiles",
+            CalibrationSettings.tracker,
+            "{}x{}".format(*self.screen),
+        ).expanduser()
+        # CalibrationProfile in use, closed when switching
+        self.profile = None
+        self.import_pickles()
+        try:
+            self.select_profile(CalibrationSettings.profile)
+        except ValueError as e:
+            log_info(e)
+            self.profile_name = CalibrationSettings.profile
+
+    def profile_path(self, name):
+        return Path(self.profiles, f"{name}.npz")
+
+    def list_profiles(self):
+        return sorted(path.stem for path in self.profiles.glob("*.npz"))
+
+    # without a saved profile the eyes are uncalibrated until calibrating
+    def select_profile(self, name):
+        path = self.profile_path(name)
+        profile = CalibrationProfile(path, self.screen) if path.exists() else None
+        self.close_profile()
+        (self.profile_name, self.profile) = (name, profile)
+        self.left.use_profile(profile)
+        self.right.use_profile(profile)
+
+    def close_profile(self):
+        if self.profile:
+            self.profile.close()
+            self.profile = None
+
+    # metadata of a saved profile
+    def profile_info(self, name):
+        profile = CalibrationProfile(self.profile_path(name), self.screen)
+        profile.close()
+        return profile.metadata
+
+    # calibrations pickled by earlier versions become the default profile
+    def import_pickles(self):
+        paths = [
+            Path("~/.cache/eyeput", label).expanduser() for label in ["left", "right"]
+        ]
+        target = self.profile_path("default")
+        if target.exists() or not all(path.exists() for path in paths):
+            return
+        try:
+            models = {}
+            for label, path in zip(["left", "right"], paths):
+                with path.open("rb") as file:
+                    models[label] = pickle.load(file)
+            points = np.unique(models["left"].y.reshape(-1, 2), axis=0)
+        # stale classes or truncated files, calibrate anew
+        except Exception as e:
+            log_info(f"pickled calibration not imported: {e}")
+            return
+        save_profile(target, models, CalibrationSettings.tracker, self.screen, points)
+
     def get(self, label):
         if label == "left":
             return self.left
@@ -228,13 +817,21 @@ class Calibration(QWidget):
         self.end_signal.emit()
         self.left.finalize()
         self.right.finalize()
+        self.close_profile()
+        save_profile(
+            self.profile_path(self.profile_name),
+            {"left": self.left.calibration_data, "right": self.right.calibration_data},
+            CalibrationSettings.tracker,
+            self.screen,
+            calibration_points,
+        )
         self.hide()
 
     def on_frame(self, frame: FilteredFrame):
         if self.isVisible() and not self.paused:
             reference = calibration_points[self.counter]
-            self.left.on_gaze(reference, frame.l1, 15, 5, 12)
-            self.right.on_gaze(reference, frame.r1, 15, 5, 12)
+            self.left.on_gaze(reference, frame.l0, frame.l1)
+            self.right.on_gaze(reference, frame.r0, frame.r1)
             # proceed with next point
             if self.left.is_ok and self.right.is_ok:
                 self.finalize_point()
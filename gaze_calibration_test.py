@@ -0,0 +1,304 @@
+# python -m unittest gaze_calibration_test.py
+
+from pathlib import Path
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from gaze_calibration import (
+    CalibrationData,
+    CalibrationProfile,
+    CalibrationSampler,
+    PolynomialCalibration,
+    ScreenPlane,
+    delaunay,
+    grid_points,
+    save_profile,
+    triangle_strip,
+    triangulation,
+)
+from gaze_simulation import (
+    calibration_samples,
+    distorted,
+    gaze_destinations,
+    l0,
+    screen_plane,
+)
+
+
+# measured positions [mm] of the reference points, roughly the uncalibrated
+# projection
+def measure(y, rng):
+    return (y - (0.5, 1.0)) * (344.0, -193.0) + rng.normal(0, 5, y.shape)
+
+
+# EyeCalibration.transform before vectorization
+def loop_transform(calibration_data, x):
+    l = np.zeros(3)
+    for i, (r, Tinv, y) in enumerate(
+        zip(calibration_data.r, calibration_data.Tinv, calibration_data.y)
+    ):
+        l[:2] = Tinv @ (x - r[2])
+        if 0 <= l[0] <= 1 and 0 <= l[1] <= 1 or i == len(calibration_data.r) - 1:
+            l[2] = 1 - l[0] - l[1]
+            return np.dot(l, y)
+
+
+class TestCalibrationData(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        y = np.array(grid_points(2, 2))
+        self.calibration_data = triangle_strip(measure(y, rng), y)
+        self.x = rng.uniform(-250, 250, (500, 2)) + (0, 100)
+
+    def test_transform(self):
+        expected = [loop_transform(self.calibration_data, x) for x in self.x]
+        actual = [self.calibration_data.transform(x) for x in self.x]
+        np.testing.assert_allclose(actual, expected, atol=1e-12)
+        np.testing.assert_allclose(
+            self.calibration_data.transform_batch(self.x), expected, atol=1e-12
+        )
+
+    def test_pickle(self):
+        # state of older pickles, lists of per triangle arrays and a scratch vector
+        old = object.__new__(CalibrationData)
+        old.__setstate__(
+            {
+                "r": list(self.calibration_data.r),
+                "Tinv": list(self.calibration_data.Tinv),
+                "y": list(self.calibration_data.y),
+                "l": np.zeros(3),
+            }
+        )
+        self.assertEqual(old.Tinv.shape, (2, 2, 2))
+        self.assertFalse(hasattr(old, "l"))
+        for calibration_data in [old, pickle.loads(pickle.dumps(old))]:
+            np.testing.assert_array_equal(
+                calibration_data.transform_batch(self.x),
+                self.calibration_data.transform_batch(self.x),
+            )
+
+
+class TestTriangulation(unittest.TestCase):
+    def test_delaunay(self):
+        points = np.random.default_rng(0).uniform(0, 1, (20, 2))
+        triangles = delaunay(points)
+        self.assertEqual(set(triangles.ravel()), set(range(len(points))))
+        for triangle in triangles:
+            (a, b, c) = points[triangle]
+            # no point inside the circumcircle
+            d = 2 * ((b - a)[0] * (c - a)[1] - (b - a)[1] * (c - a)[0])
+            (u, v) = (b - a, c - a)
+            center = (
+                a
+                + np.array(
+                    (v[1] * (u @ u) - u[1] * (v @ v), u[0] * (v @ v) - v[0] * (u @ u))
+                )
+                / d
+            )
+            distance = np.linalg.norm(points - center, axis=1)
+            self.assertTrue(np.all(distance >= np.linalg.norm(a - center) - 1e-9))
+
+    def test_grid(self):
+        for n in range(2, 6):
+            with self.subTest(n):
+                y = np.array(grid_points(n, n))
+                triangles = delaunay(y)
+                self.assertEqual(len(triangles), 2 * (n - 1) ** 2)
+                (u, v) = (
+                    y[triangles[:, 1]] - y[triangles[:, 0]],
+                    y[triangles[:, 2]] - y[triangles[:, 0]],
+                )
+                area = np.sum(np.abs(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0])) / 2
+                self.assertAlmostEqual(area, 0.98 * 0.94)
+
+    def test_lookup(self):
+        rng = np.random.default_rng(0)
+        y = np.array(grid_points(5, 5))
+        x = measure(y, rng)
+        calibration_data = triangulation(x, y)
+        np.testing.assert_allclose(calibration_data.transform_batch(x), y, atol=1e-3)
+        points = rng.uniform(x.min(axis=0), x.max(axis=0), (1000, 2))
+        exact = calibration_data.interpolate_batch(points)
+        looked_up = calibration_data.transform_batch(points)
+        error = np.linalg.norm(looked_up - exact, axis=1)
+        # only cells crossing a triangle edge differ
+        self.assertLess(np.max(error), 0.01)
+        self.assertLess(np.mean(error), 1e-3)
+        np.testing.assert_allclose(
+            [calibration_data.transform(p) for p in points[:100]],
+            looked_up[:100],
+            atol=1e-12,
+        )
+        loaded = pickle.loads(pickle.dumps(calibration_data))
+        np.testing.assert_array_equal(loaded.transform_batch(points), looked_up)
+
+
+class TestPolynomialCalibration(unittest.TestCase):
+    def test_exact(self):
+        x = np.random.default_rng(0).uniform(-150, 150, (50, 2))
+        y = np.stack(
+            (1e-5 * x[:, 0] * x[:, 1] + 0.003 * x[:, 0], 2e-5 * x[:, 1] ** 2), axis=1
+        )
+        calibration = PolynomialCalibration.fit(x, y, order=2)
+        np.testing.assert_allclose(calibration.transform_batch(x), y, atol=1e-12)
+        np.testing.assert_allclose(calibration.transform(x[0]), y[0], atol=1e-12)
+
+    def test_order(self):
+        y = np.array(grid_points(3, 3))
+        calibration = PolynomialCalibration.fit(distorted(y), y, order=3)
+        # 10 terms of order 3 for 9 reference points
+        self.assertEqual(len(calibration.exponents), 6)
+
+    def test_outliers(self):
+        references = np.array(grid_points(4, 4))
+        samples = calibration_samples(references, outliers=0.1).reshape(-1, 2)
+        targets = np.repeat(references, len(samples) // len(references), axis=0)
+        y = np.random.default_rng(1).uniform(0.02, 0.98, (1000, 2))
+        rms = lambda calibration: np.sqrt(
+            np.mean(
+                np.sum(np.square(calibration.transform_batch(distorted(y)) - y), axis=1)
+            )
+        )
+        robust = PolynomialCalibration.fit(samples, targets, 3)
+        plain = PolynomialCalibration.fit(samples, targets, 3, rejection=np.inf)
+        self.assertLess(rms(robust), 0.004)
+        self.assertLess(rms(robust), rms(plain) / 2)
+
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name, "tobii", "default.npz")
+        references = np.array(grid_points(3, 3))
+        samples = calibration_samples(references)
+        self.models = {
+            "left": triangulation(np.median(samples, axis=1), references),
+            "right": PolynomialCalibration.fit(
+                samples.reshape(-1, 2), np.repeat(references, 20, axis=0)
+            ),
+        }
+        self.x = distorted(np.random.default_rng(1).uniform(0, 1, (100, 2)))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save(self):
+        points = grid_points(3, 3)
+        save_profile(self.path, self.models, "tobii", (1920, 1080), points)
+
+    def test_roundtrip(self):
+        self.save()
+        profile = CalibrationProfile(self.path, (1920, 1080))
+        self.assertEqual(profile.metadata["points"], 9)
+        for label, model in self.models.items():
+            loaded = profile.model(label)
+            self.assertIs(type(loaded), type(model))
+            np.testing.assert_array_equal(
+                loaded.transform_batch(self.x), model.transform_batch(self.x)
+            )
+
+    def test_validation(self):
+        self.save()
+        with self.assertRaises(ValueError):
+            CalibrationProfile(self.path, (2560, 1440))
+        self.models["left"].lut_step = np.ones(3)
+        self.save()
+        with self.assertRaises(ValueError):
+            CalibrationProfile(self.path).model("left")
+        arrays = dict(np.load(self.path))
+        arrays["version"] = 0
+        np.savez(self.path, **arrays)
+        with self.assertRaises(ValueError):
+            CalibrationProfile(self.path)
+
+    def test_unreadable(self):
+        self.save()
+        data = self.path.read_bytes()
+        for size in [0, 100, len(data) // 2]:
+            with self.subTest(size=size):
+                self.path.write_bytes(data[:size])
+                with self.assertRaises(ValueError):
+                    CalibrationProfile(self.path)
+
+
+class TestCalibrationSampler(unittest.TestCase):
+    def test_rejection(self):
+        rng = np.random.default_rng(0)
+        target = np.array([100.0, 50.0])
+        x = target + rng.normal(0, 1.5, (120, 2))
+        # blinks and a saccade away and back
+        x[30:36] = 0
+        x[60:64] = target + [80.0, -40.0]
+        sampler = CalibrationSampler(45, 6.0)
+        accepted = [sampler.add(x_i) for x_i in x]
+        self.assertTrue(sampler.done())
+        self.assertFalse(any(accepted[30:36]) or any(accepted[60:64]))
+        self.assertLess(np.linalg.norm(sampler.mean - target), 0.5)
+        self.assertGreater(np.linalg.norm(np.mean(x, axis=0) - target), 2)
+        np.testing.assert_allclose(sampler.mean, np.mean(x[np.array(accepted)], axis=0))
+        self.assertEqual(sampler.samples().shape, (45, 2))
+
+    def test_restart(self):
+        rng = np.random.default_rng(0)
+        sampler = CalibrationSampler(20, 6.0)
+        # the gaze settles on the target late
+        for x_i in rng.normal(0, 1.0, (40, 2)):
+            sampler.add(x_i)
+        for x_i in [30.0, 0.0] + rng.normal(0, 1.0, (40, 2)):
+            sampler.add(x_i)
+        self.assertTrue(sampler.done())
+        self.assertLess(np.linalg.norm(sampler.mean - [30.0, 0.0]), 1.0)
+
+
+class TestScreenPlane(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.y = np.repeat(np.array(grid_points(3, 3)), 45, axis=0)
+        self.eyes = l0 + rng.normal(0, (15, 10, 20), (len(self.y), 3))
+        self.x = rng.uniform(0, 1, (200, 2))
+
+    def rms(self, position):
+        return np.sqrt(np.mean(np.sum(np.square(position - self.x), axis=1)))
+
+    def test_head_movement(self):
+        destinations = gaze_destinations(self.eyes, self.y)
+        plane = ScreenPlane.fit(self.eyes, destinations, self.y)
+        np.testing.assert_allclose(plane.origin, screen_plane.origin, atol=0.1)
+        np.testing.assert_allclose(plane.axes, screen_plane.axes, atol=0.1)
+        polynomial = PolynomialCalibration.fit(destinations[:, :2], self.y)
+        eyes = np.tile(l0 + (40.0, 20.0, 50.0), (len(self.x), 1))
+        v1 = gaze_destinations(eyes, self.x)
+        self.assertLess(self.rms(plane.transform_batch(eyes, v1)), 1e-4)
+        self.assertGreater(self.rms(polynomial.transform_batch(v1[:, :2])), 0.01)
+        # missing eye positions are taken from calibration
+        eyes[::2] = 0
+        np.testing.assert_array_equal(
+            plane.transform_batch(eyes, v1)[::2],
+            plane.transform_batch(np.tile(plane.eye, (len(v1), 1)), v1)[::2],
+        )
+        np.testing.assert_allclose(
+            [plane.transform(e, v) for (e, v) in zip(eyes, v1)],
+            plane.transform_batch(eyes, v1),
+        )
+
+    def test_noise(self):
+        rng = np.random.default_rng(1)
+        destinations = gaze_destinations(self.eyes, self.y)
+        destinations[:, :2] += rng.normal(0, 2.0, (len(self.y), 2))
+        plane = ScreenPlane.fit(self.eyes, destinations, self.y)
+        # the depth isn't shrunk towards the eye by the noise
+        self.assertLess(abs(plane.origin[2] - screen_plane.origin[2]), 15.0)
+        eyes = np.tile(l0 + (80.0, 40.0, 80.0), (len(self.x), 1))
+        v1 = gaze_destinations(eyes, self.x)
+        self.assertLess(self.rms(plane.transform_batch(eyes, v1)), 0.006)
+
+    def test_resting_head(self):
+        eyes = np.tile(l0, (len(self.y), 1))
+        plane = ScreenPlane.fit(eyes, gaze_destinations(eyes, self.y), self.y)
+        plane.validate()
+        eyes = np.tile(l0, (len(self.x), 1))
+        v1 = gaze_destinations(eyes, self.x)
+        self.assertLess(self.rms(plane.transform_batch(eyes, v1)), 1e-4)
@@ -1,11 +1,18 @@
-from collections import deque
 from dataclasses import dataclass
-from itertools import islice
+from pathlib import Path
+from typing import Callable
+
+import bisect
+import math
+import zipfile
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 from gaze_thread import InputFrame
 from settings import *
+from util import RingBuffer
+import latency
 
 
 # recognize blink patterns
@@ -19,206 +26,1054 @@ from settings import *
 # a blink is only recognized on every closing bracket; it doesn't matter whether the eye starts closed or opened
 #
 # defining a limited set of available patterns reduces latency
+#
+# the patterns are compiled into a deterministic automaton over the four flip
+# symbols, a symbol encodes which eyes are opened after a flip
+symbols = " rl."
+# symbol bits
+eye_bits = {"l": 2, "r": 1}
+
+
+# first of some zones that contains a point, in constant time
+#
+# the zone edges divide each axis into cells, i.e. the edges themselves and the open
+# intervals between them; as zones are closed rectangles, the first containing zone
+# is the same for all points of a cell
+class ZoneRaster:
+    def __init__(self, zones):
+        self.zones = list(zones)
+        self.edges = [
+            sorted({z.top_left[k] for z in zones} | {z.bottom_right[k] for z in zones})
+            for k in range(2)
+        ]
+        # a representative point per cell, ordered like the cell indices
+        points = []
+        for edges in self.edges:
+            points.append([edges[0] - 1.0])
+            for (a, b) in zip(edges, edges[1:]):
+                points[-1] += [a, 0.5 * (a + b)]
+            points[-1] += [edges[-1], edges[-1] + 1.0]
+        self.table = [
+            [next((z for z in self.zones if (x, y) in z), None) for y in points[1]]
+            for x in points[0]
+        ]
+
+    def cell(self, k, x):
+        edges = self.edges[k]
+        i = bisect.bisect_left(edges, x)
+        return 2 * i + 1 if i < len(edges) and edges[i] == x else 2 * i
+
+    def lookup(self, point):
+        return self.table[self.cell(0, point[0])][self.cell(1, point[1])]
+
+
+class BlinkAutomaton:
+    dead = 0
+    start = 1
+
+    def __init__(self, blink_patterns, speculative=()):
+        # one state per prefix
+        prefixes = {"": BlinkAutomaton.start}
+        for p, zone in blink_patterns:
+            for i in range(1, len(p) + 1):
+                prefixes.setdefault(p[:i], len(prefixes) + 1)
+        n = len(prefixes) + 1
+        # transitions[state][symbol], unknown prefixes end in the dead state
+        self.transitions = [[BlinkAutomaton.dead] * 4 for _ in range(n)]
+        # encoded pattern
+        self.pattern = [None] * n
+        # whether the prefix is a complete pattern
+        self.accepting = [False] * n
+        # number of patterns starting with the prefix
+        self.completions = [0] * n
+        # zones of complete patterns in order of precedence
+        self.zones = [{} for _ in range(n)]
+        for prefix, state in prefixes.items():
+            self.pattern[state] = prefix
+            for symbol, c in enumerate(symbols):
+                self.transitions[state][symbol] = prefixes.get(
+                    prefix + c, BlinkAutomaton.dead
+                )
+        for p, zone in blink_patterns:
+            state = prefixes[p]
+            self.accepting[state] = True
+            self.zones[state][zone] = None
+        self.rasters = [ZoneRaster(zones) if zones else None for zones in self.zones]
+        # complete patterns whose action can be taken back, fired before it is
+        # certain that they aren't extended
+        self.speculative = set(speculative)
+        for p in {p for p, zone in blink_patterns}:
+            for i in range(1, len(p) + 1):
+                self.completions[prefixes[p[:i]]] += 1
+
+    def run(self, flips):
+        state = BlinkAutomaton.start
+        for symbol in flips:
+            state = self.transitions[state][symbol]
+        return state
+
+
+# a blink fired before it is certain, and whether it turned out right
+@dataclass
+class Speculation:
+    # "fire", "confirm" or "rollback"
+    kind: str
+    blink: tuple
+    position: np.ndarray = None
+
+
+@dataclass
+class SpeculationStats:
+    fired: int = 0
+    confirmed: int = 0
+    # tracker time from firing until the blink was certain [s]
+    saved: float = 0.0
+
+    # confirmed rate with one prior hit and miss
+    def rate(self):
+        return (self.confirmed + 1) / (self.fired + 2)
+
+
 class BlinkFilter:
+    # speculate on a pattern only while it is confirmed at least this often
+    speculation_threshold = 0.5
+
     def __init__(self, latency, sync_latency):
         self.latency = latency
         self.sync_latency = sync_latency
+        # flip symbols, the first one is the state before the pattern
+        self.flips = [3]
+        self.flip_times = [0]
+        # time between the flips of both eyes that were synced, nan if unsynced
+        self.flip_gaps = [math.nan]
+        # learns latency and sync_latency, see BlinkTiming
+        self.timing: BlinkTiming = None
+        # last flip time of a pattern that timed out
+        self.timed_out = None
+        self.automaton = BlinkAutomaton([])
+        # automaton state after each flip
+        self.states = [self.automaton.run(self.flips)]
+        # Speculation of the last transform
+        self.speculation = None
+        # pending (Speculation, tracker time)
+        self.speculated = None
+        # number of flips when speculation was considered
+        self.speculated_at = None
+        # pattern -> SpeculationStats
+        self.stats = {}
 
-    flips = "."
-    flip_times = [0]
-    prefix_tree = {}
-    blink_zones = {}
+    def set_blink_patterns(self, blink_patterns):
+        self.set_automaton(BlinkAutomaton(blink_patterns))
 
-    def decode(self, pattern):
-        return {
-            ".": {"l": True, "r": True},
-            "l": {"l": True, "r": False},
-            "r": {"l": False, "r": True},
-            " ": {"l": False, "r": False},
-        }[pattern]
+    def set_automaton(self, automaton: BlinkAutomaton):
+        # a speculated action that switches the patterns is committed
+        if self.speculated and automaton is not self.automaton:
+            self.stats[self.speculated[0].blink[0]].confirmed += 1
+            self.speculated = None
+            self._restart()
+        self.automaton = automaton
+        self.states = [
+            automaton.run(self.flips[: i + 1]) for i in range(len(self.flips))
+        ]
 
-    def encode(self, pair):
-        return {
-            (True, True): ".",
-            (True, False): "l",
-            (False, True): "r",
-            (False, False): " ",
-        }[(pair["l"], pair["r"])]
+    def _restart(self):
+        self.flips = self.flips[-1:]
+        self.flip_times = self.flip_times[-1:]
+        self.flip_gaps = self.flip_gaps[-1:]
+        self.states = [self.automaton.run(self.flips)]
+        self.speculated_at = None
 
-    def set_blink_patterns(self, blink_patterns):
-        # build prefix tree and zone dictionary
-        self.prefix_tree = {}
-        self.blink_zones = {}
-        for p, zone in blink_patterns:
-            self.blink_zones.setdefault(p, {})[zone] = None
-            for i in range(1, len(p) + 1):
-                self.prefix_tree.setdefault(p[:i], {})[p] = None
+    def set_timing(self, timing: "BlinkTiming"):
+        self.timing = timing
+        # tuning starts from the latencies in use
+        if timing.latency is None:
+            (timing.latency, timing.sync_latency) = (self.latency, self.sync_latency)
+        (self.latency, self.sync_latency) = (timing.latency, timing.sync_latency)
+
+    # timing of a recognized pattern, the first flip is the state before it
+    def _learn(self):
+        gaps = [gap for gap in self.flip_gaps[1:] if not math.isnan(gap)]
+        intervals = np.diff(self.flip_times[1:])
+        # a complete pattern that was extended later than the learned intervals
+        # suggests that two patterns merged, the extension isn't learned
+        accepting = [self.automaton.accepting[s] for s in self.states[1:-1]]
+        merged = accepting & (intervals > self.latency / self.timing.margin)
+        if self.timing.observe(intervals[~merged], gaps, merged.any()):
+            self.set_timing(self.timing)
+
+    # a flip shortly after a pattern timed out suggests that the latency cut the
+    # pattern off
+    def _check_timeout(self, flip_time):
+        if flip_time - self.timed_out < self.latency * self.timing.max_step:
+            if self.timing.timed_out():
+                self.set_timing(self.timing)
+        self.timed_out = None
+
+    # fire the blink of an accepting state that may still be extended
+    def _speculate(self, t, state, filtered_position):
+        self.speculated_at = len(self.flips)
+        pattern = self.automaton.pattern[state]
+        stats = self.stats.setdefault(pattern, SpeculationStats())
+        if stats.rate() < self.speculation_threshold:
+            return
+        (blink, position) = self.checked_position(
+            t, state, self.flip_times[1], filtered_position
+        )
+        if blink in self.automaton.speculative:
+            stats.fired += 1
+            self.speculation = Speculation("fire", blink, position)
+            self.speculated = (self.speculation, t[-1])
+
+    # confirm the pending speculation if it was right, roll it back otherwise
+    def _settle(self, t, blink):
+        (speculation, fired) = self.speculated
+        self.speculated = None
+        if speculation.blink == blink:
+            stats = self.stats[blink[0]]
+            stats.confirmed += 1
+            stats.saved += t - fired
+            self.speculation = Speculation("confirm", blink, speculation.position)
+        else:
+            self.speculation = Speculation("rollback", speculation.blink)
 
     def check_flip(self, t, buffer, eye):
-        current_flip = self.decode(self.flips[-1])
-        opened = buffer[-1].any()
+        bit = eye_bits[eye]
+        current_flip = self.flips[-1]
+        opened = bool(buffer[-1].any())
         # a little debounce
-        if opened != current_flip[eye] and buffer[-2].any() == opened:
-            current_flip[eye] = opened
+        if opened != bool(current_flip & bit) and buffer[-2].any() == opened:
+            current_flip ^= bit
             # sync both eyes
             if (
                 len(self.flips) >= 2
                 and t[-2] - self.flip_times[-1] < self.sync_latency
-                and self.decode(self.flips[-2])[eye] != current_flip[eye]
+                and (self.flips[-2] ^ current_flip) & bit
             ):
-                self.flips = self.flips[:-1] + self.encode(current_flip)
+                self.flips[-1] = current_flip
+                self.flip_gaps[-1] = t[-2] - self.flip_times[-1]
                 self.flip_times[-1] = t[-2]
+                self.states[-1] = self.automaton.transitions[self.states[-2]][
+                    current_flip
+                ]
             else:
-                self.flips += self.encode(current_flip)
+                if self.timed_out is not None:
+                    self._check_timeout(t[-2])
+                self.flips.append(current_flip)
                 self.flip_times.append(t[-2])
+                self.flip_gaps.append(math.nan)
+                self.states.append(
+                    self.automaton.transitions[self.states[-1]][current_flip]
+                )
 
-    def checked_position(self, t, flips, flip_time, filtered_position):
-        # take position at the time of blinking
-        flip_position = None
-        for (_t, _position) in zip(reversed(t), reversed(filtered_position)):
-            if _t < flip_time - 0.05:
-                flip_position = _position
-                break
-        if flip_position is None:
+    def checked_position(self, t, state, flip_time, filtered_position):
+        # take position at the time of blinking, interpolated between samples
+        flip_time -= 0.05
+        i = int(np.searchsorted(t, flip_time))
+        if i == 0:
             return (None, None)
+        elif i == len(t):
+            flip_position = np.array(filtered_position[-1])
+        else:
+            alpha = (flip_time - t[i - 1]) / (t[i] - t[i - 1])
+            flip_position = (1 - alpha) * filtered_position[i - 1]
+            flip_position += alpha * filtered_position[i]
 
         # return first blink zone that matches
-        for zone in self.blink_zones[flips]:
-            if flip_position in zone:
-                return ((flips, zone), flip_position)
-        return (None, None)
+        zone = self.automaton.rasters[state].lookup(flip_position)
+        if zone is None:
+            return (None, None)
+        return ((self.automaton.pattern[state], zone), flip_position)
 
     def transform(self, t, left, right, filtered_position):
         # recognize flip
         self.check_flip(t, left, "l")
         self.check_flip(t, right, "r")
+        self.speculation = None
+        # an extended pattern rolls back the speculation on its prefix
+        if self.speculated and len(self.flips) != self.speculated_at:
+            self._settle(t[-1], None)
         dt = t[-1] - self.flip_times[-1]
         if dt < self.sync_latency:
             return (None, None)
+        state = self.states[-1]
         # emit when reaching leaf or blink latency
-        if (
-            self.flips in self.prefix_tree
-            and self.flips in self.prefix_tree[self.flips]
-            and (dt > self.latency or len(self.prefix_tree[self.flips]) == 1)
+        if self.automaton.accepting[state] and (
+            dt > self.latency or self.automaton.completions[state] == 1
         ):
             if len(self.flips) == 1:
                 return self.checked_position(
-                    t, self.flips, self.flip_times[0], filtered_position
+                    t, state, self.flip_times[0], filtered_position
                 )
-            flips, flip_time = (self.flips, self.flip_times[1])
-            self.flips = self.flips[-1:]
-            self.flip_times = self.flip_times[-1:]
-            return self.checked_position(t, flips, flip_time, filtered_position)
+            flip_time = self.flip_times[1]
+            (blink, position) = self.checked_position(
+                t, state, flip_time, filtered_position
+            )
+            if blink and self.timing:
+                self._learn()
+            self._restart()
+            if self.speculated:
+                self._settle(t[-1], blink)
+            return (blink, position)
         # preemptively cancel unregistered blink and timed out blink
-        if not self.flips in self.prefix_tree or dt > self.latency:
+        if state == BlinkAutomaton.dead or dt > self.latency:
+            if state != BlinkAutomaton.dead and len(self.flips) > 1 and self.timing:
+                self.timed_out = self.flip_times[-1]
             # todo: check for sub pattern and issue it
-            self.flips = self.flips[-1:]
-            self.flip_times = self.flip_times[-1:]
+            self._restart()
+            if self.speculated:
+                self._settle(t[-1], None)
+        elif (
+            self.automaton.speculative
+            and self.automaton.accepting[state]
+            and self.speculated_at != len(self.flips) > 1
+        ):
+            self._speculate(t, state, filtered_position)
         return (None, None)
         # todo: variance filters closing eyelid
 
+    # inherently sequential, replayed with a fresh state on views of the padded
+    # columns, i.e. the first `history` samples are padding
+    def transform_batch(self, t, left, right, filtered_position, history):
+        blink_filter = BlinkFilter(self.latency, self.sync_latency)
+        blink_filter.set_automaton(self.automaton)
+        flips = [None] * (len(t) - history)
+        flip_position = np.full((len(flips), 2), np.nan)
+        for i in range(len(flips)):
+            u, v = i + 1, i + 1 + history
+            (flips[i], position) = blink_filter.transform(
+                t[u:v], left[u:v], right[u:v], filtered_position[u:v]
+            )
+            if position is not None:
+                flip_position[i] = position
+        return (flips, flip_position)
+
+
+# learns the flip timing of the user's recognized blinks and tunes the blink
+# latencies to the smallest values that cut off less than `target` of them:
+# latency bounds the intervals between the flips of a pattern, sync_latency the
+# gaps between the flips of both eyes that are merged into one
+#
+# the samples are censored by the latencies in use, so a tuning moves them by
+# at most max_step, and patterns that timed out just before their next flip
+# count as cut off
+#
+# false positives are estimated by the patterns that look merged, i.e. that
+# extend a complete pattern after more than latency / margin, which the learned
+# intervals rarely exceed. while more than `target` of them look merged, latency
+# doesn't step up for cut off patterns and steps down otherwise
+class BlinkTiming:
+    target = 0.02
+    margin = 1.25
+    max_step = 1.2
+    # new samples before the latencies are tuned
+    min_samples = 20
+    latency_bounds = (0.08, 0.4)
+    sync_latency_bounds = (0.02, 0.1)
+
+    def __init__(self, path: Path = None, size=200):
+        self.path = path
+        self.intervals = RingBuffer(size)
+        self.gaps = RingBuffer(size)
+        self.pending = 0
+        self.timeouts = 0
+        self.merges = 0
+        # None until tuned or set by BlinkFilter.set_timing
+        self.latency = self.sync_latency = None
+        if path:
+            self.load()
+
+    # npz with the samples and the latencies, see save
+    def load(self):
+        try:
+            with np.load(self.path) as file:
+                (intervals, gaps) = (file["intervals"], file["gaps"])
+                latencies = (float(file["latency"]), float(file["sync_latency"]))
+        # missing or unreadable, learned anew
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return
+        for x in intervals:
+            self.intervals.append(x)
+        for x in gaps:
+            self.gaps.append(x)
+        if not any(math.isnan(x) for x in latencies):
+            (self.latency, self.sync_latency) = latencies
+        elif len(self.intervals) >= self.min_samples:
+            self.tune()
+
+    def save(self):
+        none = lambda x: math.nan if x is None else x
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        partial = self.path.with_suffix(".partial")
+        with partial.open("wb") as file:
+            np.savez(
+                file,
+                intervals=self.intervals.last(len(self.intervals)),
+                gaps=self.gaps.last(len(self.gaps)),
+                latency=none(self.latency),
+                sync_latency=none(self.sync_latency),
+            )
+        partial.replace(self.path)
+
+    # returns whether the latencies were tuned
+    def observe(self, intervals, gaps, merged=False):
+        for x in intervals:
+            self.intervals.append(x)
+        for x in gaps:
+            self.gaps.append(x)
+        self.merges += merged
+        return self._count(len(intervals))
+
+    # a pattern timed out shortly before its next flip
+    def timed_out(self):
+        self.timeouts += 1
+        return self._count(1)
+
+    def _count(self, n):
+        self.pending += n
+        if self.pending < self.min_samples:
+            return False
+        self.tune()
+        if self.path:
+            self.save()
+        return True
+
+    def _tune(self, samples, current, bounds, timeouts=0, merges=0):
+        x = current
+        if len(samples) >= self.min_samples:
+            x = self.margin * np.quantile(samples.last(len(samples)), 1 - self.target)
+        if current is not None:
+            cut_off = timeouts > self.target * self.pending
+            # more patterns merged than the target allows
+            if merges > self.target * self.pending:
+                x = min(x, current if cut_off else current / self.max_step)
+            # more patterns were cut off than the target allows
+            elif cut_off:
+                x = max(x, current * self.max_step)
+            x = np.clip(x, current / self.max_step, current * self.max_step)
+        return None if x is None else float(np.clip(x, *bounds))
+
+    def tune(self):
+        self.latency = self._tune(
+            self.intervals,
+            self.latency,
+            self.latency_bounds,
+            self.timeouts,
+            self.merges,
+        )
+        self.sync_latency = self._tune(
+            self.gaps, self.sync_latency, self.sync_latency_bounds
+        )
+        (self.pending, self.timeouts, self.merges) = (0, 0, 0)
+
+
+# per frame the fused position if both eyes are open, otherwise the open eye
+def select_eye(left, right, center):
+    (l_open, r_open) = (left.any(axis=1), right.any(axis=1))
+    x = np.where((l_open & r_open)[:, None], center, left)
+    x[~l_open] = right[~l_open]
+    return (x, l_open | r_open)
+
+
+# low pass whose cutoff frequency rises with the speed, i.e. smooth fixations and
+# little lag during saccades (Casiez et al., 1€ filter)
+class OneEuroFilter:
+    # cutoff [Hz] at rest
+    min_cutoff = 0.5
+    # cutoff increase per speed [Hz / (screen/s)]
+    beta = 6.0
+    # cutoff for the speed estimate [Hz]
+    d_cutoff = 1.0
+
+    def __init__(self):
+        self.t = None
+        self.x = None
+        self.dx = np.zeros(2)
+
+    def _alpha(self, cutoff, dt):
+        return 1 / (1 + 1 / (2 * math.pi * cutoff * dt))
+
+    # the smoothed position is written to out
+    def update(self, t, x, out):
+        dt = t - self.t if self.t is not None else 0.0
+        if dt <= 0:
+            if self.x is None:
+                self.t, self.x = t, np.array(x)
+            out[...] = self.x
+            return out
+        np.subtract(x, self.x, out=out)
+        self.dx += self._alpha(self.d_cutoff, dt) * (out / dt - self.dx)
+        cutoff = self.min_cutoff + self.beta * math.sqrt(self.dx @ self.dx)
+        out *= self._alpha(cutoff, dt)
+        self.x += out
+        self.t = t
+        out[...] = self.x
+        return out
+
+
+# constant velocity model with white noise acceleration, both axes share the
+# covariance as their noise is the same
+class KalmanFilter:
+    # acceleration noise density [screen/s^2]^2 / Hz
+    acceleration_noise = 1.5
+    # variance of a measurement [screen^2]
+    measurement_noise = 0.006**2
+
+    def __init__(self):
+        self.t = None
+        self.x = None
+        self.v = np.zeros(2)
+        # covariance of position and velocity
+        (self.p00, self.p01, self.p11) = (0.0, 0.0, 0.0)
+
+    # the filtered position is written to out
+    def update(self, t, x, out):
+        dt = t - self.t if self.t is not None else 0.0
+        if dt <= 0:
+            if self.x is None:
+                self.t, self.x = t, np.array(x)
+                self.p00 = self.measurement_noise
+                self.p11 = 1.0
+            out[...] = self.x
+            return out
+        # predict
+        q = self.acceleration_noise
+        p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + q * dt**3 / 3
+        p01 = self.p01 + dt * self.p11 + q * dt**2 / 2
+        p11 = self.p11 + q * dt
+        self.x += dt * self.v
+        # correct, out holds the innovation
+        s = p00 + self.measurement_noise
+        (k0, k1) = (p00 / s, p01 / s)
+        np.subtract(x, self.x, out=out)
+        self.x += k0 * out
+        self.v += k1 * out
+        (self.p00, self.p01, self.p11) = (
+            (1 - k0) * p00,
+            (1 - k0) * p01,
+            p11 - k1 * p01,
+        )
+        self.t = t
+        out[...] = self.x
+        return out
+
 
 # assume measurements are distributed in a circle
 class PointerFilter:
-    def __init__(self, radius, lookbehind):
+    def __init__(self, radius, lookbehind, engine="circle"):
         self.radius = radius
         self.lookbehind = lookbehind
+        self.left_filter = self.CircleFilter()
+        self.engine = None
+        self.set_engine(engine)
+
+    # smoothing engines besides the circle filter
+    engines = {"one_euro": OneEuroFilter, "kalman": KalmanFilter}
+
+    def set_engine(self, engine):
+        assert engine == "circle" or engine in self.engines, engine
+        if engine != self.engine:
+            self.engine = engine
+            self.smoother = self.engines[engine]() if engine != "circle" else None
 
     class CircleFilter:
         def __init__(self):
             self.last_center = np.array((0.0, 0.0))
+            self.counts = np.arange(1.0, 2.0)
+            # running means, deviations and distances of the window
+            self.means = np.zeros((1, 2))
+            (self.deviation, self.distance) = (np.zeros((0, 2)), np.zeros(0))
 
         def _check_distance(self, u, v, radius):
             distance = np.linalg.norm((u - v) / radius)
             return distance < 1
 
-        def transform(self, x, lookbehind, radius):
-            # find last circle
-            c = x[-1]
-            sum = np.array(c)
-            n = 1
-            for v in islice(reversed(x), 1, lookbehind):
-                if not self._check_distance(c, v, radius):
-                    break
-                sum += v
-                n += 1
-                c = sum / n
+        def transform(self, x, lookbehind, radius, out):
+            # find last circle: walking backwards from the newest sample, a sample
+            # belongs to the circle if it is close to the mean of the newer ones
+            window = x[: -lookbehind - 1 : -1]
+            n = len(window)
+            if len(self.counts) < n:
+                self.counts = np.arange(1.0, n + 1)
+                self.means = np.zeros((n, 2))
+                (self.deviation, self.distance) = (
+                    np.zeros((n - 1, 2)),
+                    np.zeros(n - 1),
+                )
+            # running means of the first k samples, for all k at once
+            means = np.cumsum(window, axis=0, out=self.means[:n])
+            means /= self.counts[:n, None]
+            deviation = np.subtract(means[:-1], window[1:], out=self.deviation[: n - 1])
+            deviation /= radius
+            np.square(deviation, out=deviation)
+            distance = np.sum(deviation, axis=1, out=self.distance[: n - 1])
+            np.sqrt(distance, out=distance)
+            # early exit at the first sample outside
+            outside = np.flatnonzero(distance >= 1)
+            c = means[outside[0] if len(outside) else len(distance)]
             # slight drift accommodation
-            if self._check_distance(self.last_center, c, radius):
-                c = self.last_center
-            self.last_center = c
+            if not self._check_distance(self.last_center, c, radius):
+                self.last_center[...] = c
+            out[...] = self.last_center
+            return out
+
+        # circle centers for the given frames of a padded column, in chunks to
+        # limit memory
+        def centers_batch(self, x, frames, lookbehind, radius, history, chunk=4096):
+            n = min(lookbehind, history)
+            if n == 1:
+                return x[history:][frames]
+            # windows[j] are the samples up to frame j, newest first
+            windows = sliding_window_view(x[history - n + 1 :], n, axis=0)
+            counts = np.arange(1.0, n + 1)[:, None]
+            centers = np.zeros((len(frames), 2))
+            for u in range(0, len(frames), chunk):
+                window = windows[frames[u : u + chunk], :, ::-1].transpose(0, 2, 1)
+                means = np.cumsum(window, axis=1) / counts
+                distance = np.sqrt(
+                    np.sum(np.square((means[:, :-1] - window[:, 1:]) / radius), axis=2)
+                )
+                outside = distance >= 1
+                first = np.where(outside.any(axis=1), outside.argmax(axis=1), n - 1)
+                centers[u : u + chunk] = means[np.arange(len(first)), first]
+            return centers
+
+    # padded columns, see BlinkFilter.transform_batch
+    def transform_batch(self, t, left, right, center, history):
+        l_open = left[history:].any(axis=1)
+        r_open = right[history:].any(axis=1)
+        if self.smoother:
+            # sequential, from a fresh state
+            smoother = self.engines[self.engine]()
+            (t, left, right, center) = (x[history:] for x in (t, left, right, center))
+            (x, opened) = select_eye(left, right, center)
+            result = np.array(left)
+            for i in np.flatnonzero(opened):
+                smoother.update(t[i], x[i], result[i])
+            return result
+        circle_filter = self.CircleFilter()
+        centers = np.zeros((len(l_open), 2))
+        for x, selected in [
+            (right, ~l_open & r_open),
+            (left, l_open & ~r_open),
+            (center, l_open & r_open),
+        ]:
+            frames = np.flatnonzero(selected)
+            centers[frames] = circle_filter.centers_batch(
+                x, frames, self.lookbehind, self.radius, history
+            )
+        # drift accommodation is sequential, plain floats keep the loop tight
+        (r0, r1) = self.radius.tolist()
+        (u0, u1) = (0.0, 0.0)
+        for i in np.flatnonzero(l_open | r_open):
+            (c0, c1) = centers[i]
+            if math.sqrt(((u0 - c0) / r0) ** 2 + ((u1 - c1) / r1) ** 2) < 1:
+                centers[i] = (u0, u1)
+            else:
+                (u0, u1) = (c0, c1)
+        return centers
 
-            return c
+    # the pointer position is written to out
+    def transform(self, t, left, right, center, out):
+        (l_open, r_open) = (left[-1].any(), right[-1].any())
+        if not l_open and not r_open:
+            out[...] = left[-1]
+            return out
+        x = center if l_open and r_open else left if l_open else right
+        if self.smoother:
+            return self.smoother.update(t[-1], x[-1], out)
+        return self.left_filter.transform(x, self.lookbehind, self.radius, out)
 
-    left_filter = CircleFilter()
 
-    def transform(self, t, left, right, center):
-        if not left[-1].any() and not right[-1].any():
-            return left[-1]
-        elif not left[-1].any() and right[-1].any():
-            return self.left_filter.transform(right, self.lookbehind, self.radius)
-        elif left[-1].any() and not right[-1].any():
-            return self.left_filter.transform(left, self.lookbehind, self.radius)
-        elif left[-1].any() and right[-1].any():
-            return self.left_filter.transform(center, self.lookbehind, self.radius)
+# mean and variance of the last n samples of a RingBuffer, updated in constant
+# time per sample (Welford's algorithm, replacing the sample leaving the window)
+class SlidingStats:
+    # recompute from the window now and then against accumulated rounding errors
+    resync_interval = 1000
+
+    def __init__(self, n, shape=(2,)):
+        self.n = n
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        # RingBuffer.count at the last update
+        self.count = -1
+        self.updates = 0
+
+    def update(self, x: RingBuffer):
+        if x.count != self.count + 1 or self.updates >= self.resync_interval:
+            # missed samples
+            window = x.last(self.n)
+            self.mean = np.mean(window, axis=0)
+            self.m2 = np.sum(np.square(window - self.mean), axis=0)
+            self.updates = 0
+        else:
+            window = x.last(self.n + 1)
+            (new, old) = (window[-1], window[0])
+            mean = self.mean + (new - old) / self.n
+            self.m2 += (new - old) * (new - mean + old - self.mean)
+            self.mean = mean
+            self.updates += 1
+        self.count = x.count
+
+    def variance(self):
+        return np.maximum(self.m2, 0) / self.n
 
 
 class VarianceFilter:
     def __init__(self, lookbehind, radius):
         self.lookbehind = lookbehind
         self.radius = radius
+        self.stats = (SlidingStats(lookbehind), SlidingStats(lookbehind))
 
     def _clamp(self, n, smallest, largest):
         return max(smallest, min(n, largest))
 
-    def _get_factor(self, x):
-        if not x[-1].any():
+    def _get_factor(self, x: RingBuffer, stats: SlidingStats):
+        stats.update(x)
+        if not x.last(1)[-1].any():
             return 0
         else:
-            a = np.fromiter(
-                reversed(x), dtype=np.dtype((float, 2)), count=self.lookbehind
-            )
-            deviation = np.sum(np.std(a, axis=0))
+            deviation = np.sum(np.sqrt(stats.variance()))
             return self._clamp(self.radius / deviation, 0, 1)
 
-    def transform(self, t, left, right):
+    def transform(self, t, left: RingBuffer, right: RingBuffer):
         # map to range [0=bad, 1=good]
-        return (self._get_factor(left), self._get_factor(right))
+        return (
+            self._get_factor(left, self.stats[0]),
+            self._get_factor(right, self.stats[1]),
+        )
+
+    def _get_factor_batch(self, x, history):
+        windows = sliding_window_view(
+            x[history - self.lookbehind + 1 :], self.lookbehind, axis=0
+        )
+        deviation = np.sum(np.std(windows, axis=2), axis=1)
+        with np.errstate(divide="ignore"):
+            factor = np.clip(self.radius / deviation, 0, 1)
+        factor[~x[history:].any(axis=1)] = 0
+        return factor
+
+    # padded columns, see BlinkFilter.transform_batch
+    def transform_batch(self, t, left, right, history):
+        return (
+            self._get_factor_batch(left, history),
+            self._get_factor_batch(right, history),
+        )
 
 
+# share of samples within radius around the mean of the window
+#
+# the mean moves with every sample, so the distances of all samples change and
+# are counted again, on the contiguous history view instead of a copy
 class FlickerFilter:
     def __init__(self, radius, lookbehind):
         self.radius = radius
         self.lookbehind = lookbehind
+        # deviations and distances of the window
+        self.deviation = np.zeros((lookbehind, 2))
+        self.distance = np.zeros(lookbehind)
 
-    def _get_factor(self, x):
-        if not x[-1].any():
+    def _get_factor(self, x: RingBuffer):
+        window = x.last(self.lookbehind)
+        if not window[-1].any():
             return 0
         else:
-            a = np.fromiter(
-                reversed(x), dtype=np.dtype((float, 2)), count=self.lookbehind
-            )
-            mean = np.mean(a, axis=0)
-            distance = np.linalg.norm((a - mean) / self.radius, axis=1)
-            return 0.1 + 0.9 * np.count_nonzero(distance < 1) / len(distance)
+            deviation = self.deviation
+            np.subtract(window, window.mean(axis=0), out=deviation)
+            deviation /= self.radius
+            np.square(deviation, out=deviation)
+            distance = np.sum(deviation, 1, out=self.distance)
+            return 0.1 + 0.9 * np.count_nonzero(distance < 1) / self.lookbehind
 
-    def transform(self, t, left, right):
+    def transform(self, t, left: RingBuffer, right: RingBuffer):
         # map to range [0=bad, 1=good]
         return (self._get_factor(left), self._get_factor(right))
 
+    def _get_factor_batch(self, x, history):
+        # shape (frames, lookbehind, 2)
+        windows = sliding_window_view(
+            x[history - self.lookbehind + 1 :], self.lookbehind, axis=0
+        ).transpose(0, 2, 1)
+        deviation = (windows - windows.mean(axis=1, keepdims=True)) / self.radius
+        distance = np.sum(np.square(deviation), axis=2)
+        factor = 0.1 + 0.9 * np.count_nonzero(distance < 1, axis=1) / self.lookbehind
+        factor[~x[history:].any(axis=1)] = 0
+        return factor
+
+    # padded columns, see BlinkFilter.transform_batch
+    def transform_batch(self, t, left, right, history):
+        return (
+            self._get_factor_batch(left, history),
+            self._get_factor_batch(right, history),
+        )
+
+
+@dataclass
+class GazeEvent:
+    # "fixation_start", "fixation_end" or "saccade"
+    kind: str
+    # fixation onset or end, saccade onset
+    t: float
+    # fixation centroid, for saccades the centroid of the next fixation
+    position: np.ndarray
+    duration: float = 0.0
+
+
+_no_events = ()
+
+
+# fixations by velocity threshold (I-VT) or dispersion threshold (I-DT)
+#
+# a fixation is reported once it lasted min_duration, i.e. events are delayed by
+# that much but carry the onset time
+class FixationFilter:
+    def __init__(
+        self, method="idt", dispersion=0.08, velocity=1.5, min_duration=0.1, span=3
+    ):
+        assert method in ["idt", "ivt"], method
+        self.method = method
+        # sum of the bounding box sides [screen]
+        self.dispersion = dispersion
+        # [screen/s], measured over span samples
+        self.velocity = velocity
+        self.span = span
+        self.min_duration = min_duration
+        # candidate windows must fit
+        self.t = RingBuffer(256)
+        self.x = RingBuffer(256, (2,))
+        # samples since the last fixation ended, I-DT windows don't reach further
+        self.since = 0
+        # onset of the current fixation
+        self.start = None
+        (self.low, self.high, self.sum, self.n, self.last_t) = (None,) * 5
+        # extent of the fixation with the current sample, swapped with low and
+        # high if the sample extends the fixation
+        (self.next_low, self.next_high) = (np.zeros(2), np.zeros(2))
+        # end of the last fixation
+        self.end = None
+
+    def _velocity(self, t, x):
+        s = self.span
+        return np.linalg.norm(x[s:] - x[:-s], axis=1) / (t[s:] - t[:-s])
+
+    def _fixation_events(self, start, window, t):
+        centroid = window.sum(axis=0) / len(window)
+        events = []
+        if self.end is not None:
+            events.append(GazeEvent("saccade", self.end, centroid, start - self.end))
+        events.append(GazeEvent("fixation_start", start, centroid, t - start))
+        return events
+
+    def _fixation_end(self, last_t, centroid, start):
+        self.end = last_t
+        return GazeEvent("fixation_end", last_t, centroid, last_t - start)
+
+    # returns the events of this sample, an empty tuple if there are none
+    def update(self, t, x):
+        events = _no_events
+        self.t.append(t)
+        self.x.append(x)
+        self.since += 1
+        if self.start is not None:
+            if self.method == "idt":
+                (low, high) = (self.next_low, self.next_high)
+                np.minimum(self.low, x, out=low)
+                np.maximum(self.high, x, out=high)
+                extends = (high[0] - low[0]) + (high[1] - low[1]) <= self.dispersion
+            else:
+                s = self.span + 1
+                extends = self._velocity(self.t.last(s), self.x.last(s))[0]
+                extends = extends < self.velocity
+            if extends:
+                if self.method == "idt":
+                    (self.low, self.next_low) = (low, self.low)
+                    (self.high, self.next_high) = (high, self.high)
+                self.sum += x
+                self.n += 1
+                self.last_t = t
+                return events
+            events = [self._fixation_end(self.last_t, self.sum / self.n, self.start)]
+            self.start = None
+            # the sample that broke the fixation starts a new window
+            self.since = 1
+        n = len(self.t) if self.method == "ivt" else min(self.since, len(self.t))
+        (ts, xs) = (self.t.last(n), self.x.last(n))
+        # candidate window of the last min_duration
+        i = int(np.searchsorted(ts, t - self.min_duration, "right")) - 1
+        if i < 0:
+            return events
+        window = xs[i:]
+        if self.method == "idt":
+            (low, high) = (window.min(axis=0), window.max(axis=0))
+            if np.sum(high - low) > self.dispersion:
+                return events
+            (self.low, self.high) = (low, high)
+        else:
+            # velocities of the window need span older samples
+            s = self.span
+            if i < s or not np.all(
+                self._velocity(ts[i - s :], xs[i - s :]) < self.velocity
+            ):
+                return events
+        self.start = ts[i]
+        self.sum = window.sum(axis=0)
+        self.n = len(window)
+        self.last_t = t
+        return [*events, *self._fixation_events(self.start, window, t)]
+
+    # minimum and maximum of x[i : k + 1] for all k, by a sparse table
+    def _window_extent(self, x, i, k):
+        (low, high) = ([x], [x])
+        while 2 ** len(low) <= len(x):
+            h = 2 ** (len(low) - 1)
+            low.append(np.minimum(low[-1][:-h], low[-1][h:]))
+            high.append(np.maximum(high[-1][:-h], high[-1][h:]))
+        level = np.log2(k - i + 1).astype(int)
+        h = 2**level
+        (u, v) = (np.zeros((len(k), 2)), np.zeros((len(k), 2)))
+        for j in np.unique(level):
+            m = level == j
+            u[m] = np.minimum(low[j][i[m]], low[j][k[m] - h[m] + 1])
+            v[m] = np.maximum(high[j][i[m]], high[j][k[m] - h[m] + 1])
+        return (u, v)
+
+    # events of a whole recording, from a fresh state; returns (sample, event)
+    # pairs in order
+    def transform_batch(self, t, x, chunk=1024):
+        events = []
+        replay = FixationFilter(
+            self.method, self.dispersion, self.velocity, self.min_duration, self.span
+        )
+        (s, n) = (self.span, len(t))
+        k = np.arange(n)
+        # start of the candidate window at each sample
+        i = np.searchsorted(t, t - self.min_duration, "right") - 1
+        if self.method == "ivt":
+            slow = np.zeros(n, bool)
+            slow[s:] = self._velocity(t, x) < self.velocity
+            last_fast = np.maximum.accumulate(np.where(slow, -1, k))
+            candidates = np.flatnonzero((i >= s) & (last_fast < i))
+            fast = np.flatnonzero(~slow)
+        else:
+            (low, high) = self._window_extent(x, np.maximum(i, 0), k)
+            candidates = np.flatnonzero(
+                (i >= 0) & (np.sum(high - low, axis=1) <= self.dispersion)
+            )
+        # the first window starts at sample 0, windows after a fixation at the
+        # sample that ended it
+        (cursor, reset) = (0, 0)
+        while True:
+            first = max(
+                cursor, np.searchsorted(i, reset) if self.method == "idt" else 0
+            )
+            c = np.searchsorted(candidates, first)
+            if c == len(candidates):
+                break
+            c = candidates[c]
+            start = i[c]
+            events += [
+                (c, e)
+                for e in replay._fixation_events(t[start], x[start : c + 1], t[c])
+            ]
+            # first sample that doesn't extend the fixation
+            if self.method == "ivt":
+                j = np.searchsorted(fast, c + 1)
+                end = fast[j] if j < len(fast) else n
+            else:
+                (u, v) = (low[c], high[c])
+                end = n
+                for a in range(c + 1, n, chunk):
+                    u_ = np.minimum.accumulate(np.vstack((u, x[a : a + chunk])))[1:]
+                    v_ = np.maximum.accumulate(np.vstack((v, x[a : a + chunk])))[1:]
+                    outside = np.flatnonzero(np.sum(v_ - u_, axis=1) > self.dispersion)
+                    if len(outside):
+                        end = a + outside[0]
+                        break
+                    (u, v) = (u_[-1], v_[-1])
+            if end == n:
+                break
+            window = x[start:end]
+            centroid = window.sum(axis=0) / len(window)
+            events.append((end, replay._fixation_end(t[end - 1], centroid, t[start])))
+            (cursor, reset) = (end + 1, end)
+        return events
+
+
+# extrapolates the pointer position by the time until it is drawn, along the
+# velocity of the last samples; during fixations the position is kept
+class PredictionFilter:
+    # time from done to the display [s]
+    display_latency = 1 / 60
+
+    def __init__(self, horizon=None, lookbehind=6, max_distance=0.15):
+        # [s], follows the measured pipeline latency if None
+        self.fixed_horizon = horizon
+        self.horizon = horizon or self.display_latency
+        # samples for the velocity
+        self.lookbehind = lookbehind
+        # [screen]
+        self.max_distance = max_distance
+
+    # median time from receiving a frame until it is drawn
+    def follow_latency(self):
+        stats = latency.percentiles("done")
+        if self.fixed_horizon is None and stats:
+            self.horizon = stats[0] / 1000 + self.display_latency
+
+    def _clamp(self, shift):
+        distance = np.linalg.norm(shift, axis=-1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return shift * np.minimum(1, self.max_distance / distance)
+
+    # the predicted position is written to out
+    def transform(self, t, x, fixating, out):
+        out[...] = x[-1]
+        if fixating:
+            return out
+        (t, x) = (t[-self.lookbehind :], x[-self.lookbehind :])
+        dt = t - np.mean(t)
+        if not dt.any():
+            return out
+        # least squares velocity
+        velocity = dt @ (x - np.mean(x, axis=0)) / (dt @ dt)
+        out += self._clamp(velocity * self.horizon)
+        return out
+
+    # padded columns, see BlinkFilter.transform_batch
+    def transform_batch(self, t, x, fixating, history):
+        k = self.lookbehind
+        tw = sliding_window_view(t[history - k + 1 :], k)
+        xw = sliding_window_view(x[history - k + 1 :], k, axis=0)
+        dt = tw - np.mean(tw, axis=1, keepdims=True)
+        dx = xw - np.mean(xw, axis=2, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            velocity = (
+                np.sum(dt[:, None] * dx, axis=2) / np.sum(dt * dt, axis=1)[:, None]
+            )
+        velocity[~dt.any(axis=1) | fixating] = 0
+        return x[history:] + self._clamp(velocity * self.horizon)
+
 
 class ProjectionFilter:
     def __init__(self, calibration):
         self.calibration = calibration
 
-    def transform(self, t, v0, v1):
+    # the screen position is written to out
+    def transform(self, t, v0, v1, out):
         # eye closed or offscreen
         if not v1[-1].any():
-            return np.array((0.0, 0.0))
-        return self.calibration.transform(t, v0, v1)
+            out.fill(0.0)
+        else:
+            out[...] = self.calibration.transform(t, v0, v1)
+        return out
 
+    # columns without padding
+    def transform_batch(self, t, v0, v1):
+        screen_position = self.calibration.transform_batch(t, v0, v1)
+        screen_position[~v1.any(axis=1)] = 0.0
+        return screen_position
 
-@dataclass
+
+@dataclass(slots=True)
 class FilteredFrame(InputFrame):
     # merged projected position, 0=top-left 1=bottom-right
     screen_position: np.ndarray = None
@@ -229,70 +1084,301 @@ class FilteredFrame(InputFrame):
     flips: str = None
     # screen position where blink occured
     flip_position: np.ndarray = None
+    # blink fired before flips, or its confirmation or rollback
+    speculation: Speculation = None
     # accuracy of measurement [0=bad, 1=good]
     l_variance: float = None
     r_variance: float = None
+    # fused position of both eyes, 0=top-left 1=bottom-right
+    center: np.ndarray = None
+    # fixation and saccade events, see FixationFilter
+    events: list[GazeEvent] = None
+    # screen_position extrapolated to the time it is drawn
+    predicted_position: np.ndarray = None
+
+    def __init__(self, input_frame: InputFrame = None):
+        if input_frame:
+            self.reset(input_frame)
+
+    def reset(self, input_frame: InputFrame):
+        (self.t, self.l0, self.r0, self.l1, self.r1, self.received) = (
+            input_frame.t,
+            input_frame.l0,
+            input_frame.r0,
+            input_frame.l1,
+            input_frame.r1,
+            input_frame.received,
+        )
+        self.screen_position = self.l_screen_position = self.r_screen_position = None
+        self.flips = self.flip_position = self.l_variance = self.r_variance = None
+        self.speculation = None
+        self.center = self.events = self.predicted_position = None
+
+
+# frames of GazeFilter.transform are reused after `size` more frames, consumers
+# that keep a frame or one of its arrays longer have to copy it
+class FramePool:
+    # fields backed by the buffers
+    fields = (
+        "l_screen_position",
+        "r_screen_position",
+        "center",
+        "screen_position",
+        "predicted_position",
+    )
+
+    def __init__(self, size=8):
+        self.frames = [FilteredFrame() for _ in range(size)]
+        self.buffers = np.zeros((size, len(self.fields), 2))
+        self.views = [dict(zip(self.fields, buffer)) for buffer in self.buffers]
+        self.index = 0
+
+    def take(self, input_frame: InputFrame):
+        self.index = (self.index + 1) % len(self.frames)
+        frame = self.frames[self.index]
+        frame.reset(input_frame)
+        return frame
 
-    def __init__(self, input_frame: InputFrame):
-        self.__dict__.update(input_frame.__dict__)
+    # buffer of a field of the current frame
+    def buffer(self, field):
+        return self.views[self.index][field]
 
 
+# a step of GazeFilter.transform, inputs and outputs are fields of FilteredFrame
+@dataclass
+class Stage:
+    name: str
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+    run: Callable[[FilteredFrame, np.ndarray], None]
+    # keeps the histories aligned when the stage is not evaluated
+    skip: Callable[[FilteredFrame, np.ndarray], None] = None
+
+
+# history row of a stage that is not evaluated
+_zero2 = np.zeros(2)
+_zero2.flags.writeable = False
+
+
+@dataclass
+class GazeFilterParams:
+    # samples kept for the filters
+    history: int = 50
+    pointer_radius: tuple[float, float] = (0.02, 0.02)
+    pointer_lookbehind: int = 20
+    # "circle" or one of PointerFilter.engines
+    pointer_engine: str = "circle"
+    # seconds until a blink pattern is complete
+    blink_latency: float = 0.16
+    # seconds within both eyes count as one flip
+    blink_sync_latency: float = 0.04
+    flicker_radius: tuple[float, float] = (0.7 * 0.02, 0.7 * 0.02)
+    flicker_lookbehind: int = 5
+    # "idt" or "ivt"
+    fixation_method: str = "idt"
+    # below the width of a grid label, so that looking at the adjacent label
+    # ends the fixation
+    fixation_dispersion: float = 0.9 / Tiles.x
+    fixation_velocity: float = 1.5
+    fixation_min_duration: float = 0.1
+    # seconds to extrapolate, follows the measured latency if None
+    prediction_horizon: float = None
+
+
+# filters read the history as views of the last samples, e.g. left[-1] is the
+# current screen position of the left eye
 class GazeFilter:
-    t = deque([0] * 50, 50)
-    # eye position relative to tracker [mm]
-    l0 = deque([np.array((0.0, 0.0, 0.0))] * 50, 50)
-    r0 = deque([np.array((0.0, 0.0, 0.0))] * 50, 50)
-    # gaze destination relative to tracker [mm]
-    l1 = deque([np.array((0.0, 0.0, 0.0))] * 50, 50)
-    r1 = deque([np.array((0.0, 0.0, 0.0))] * 50, 50)
-    # screen position, 0=top-left 1=bottom-right
-    left = deque([np.array((0.0, 0.0))] * 50, 50)
-    right = deque([np.array((0.0, 0.0))] * 50, 50)
-    center = deque([np.array((0.0, 0.0))] * 50, 50)
-    # merged screen position
-    filtered_position = deque([np.array((0.0, 0.0))] * 50, 50)
-
-    pointer_filter = PointerFilter(np.array((0.02, 0.02)), 20)
-    blink_filter = BlinkFilter(0.16, 0.04)
-    flicker_filter = FlickerFilter(0.7 * np.array((0.02, 0.02)), 5)
-    # flicker_filter = VarianceFilter(5, 0.02)
+    def __init__(self, calibration, params=None, measure=True):
+        self.calibration = calibration
+        self.params = params = params or GazeFilterParams()
+        # record latency spans, off for pipelines that don't drive the input
+        self.measure = measure
+        # the windows of the filters have to fit
+        self.history = history = max(
+            params.history, params.pointer_lookbehind, params.flicker_lookbehind
+        )
+        self.t = RingBuffer(history)
+        # eye position relative to tracker [mm]
+        self.l0 = RingBuffer(history, (3,))
+        self.r0 = RingBuffer(history, (3,))
+        # gaze destination relative to tracker [mm]
+        self.l1 = RingBuffer(history, (3,))
+        self.r1 = RingBuffer(history, (3,))
+        # screen position, 0=top-left 1=bottom-right
+        self.left = RingBuffer(history, (2,))
+        self.right = RingBuffer(history, (2,))
+        self.center = RingBuffer(history, (2,))
+        # merged screen position
+        self.filtered_position = RingBuffer(history, (2,))
 
-    def __init__(self, calibration):
+        self.pointer_filter = PointerFilter(
+            np.array(params.pointer_radius),
+            params.pointer_lookbehind,
+            params.pointer_engine,
+        )
+        self.blink_filter = BlinkFilter(params.blink_latency, params.blink_sync_latency)
+        self.flicker_filter = FlickerFilter(
+            np.array(params.flicker_radius), params.flicker_lookbehind
+        )
+        # self.flicker_filter = VarianceFilter(5, 0.02)
+        self.fixation_filter = FixationFilter(
+            params.fixation_method,
+            params.fixation_dispersion,
+            params.fixation_velocity,
+            params.fixation_min_duration,
+        )
+        self.prediction_filter = PredictionFilter(params.prediction_horizon)
         self.projection_filter_left = ProjectionFilter(calibration.get("left"))
         self.projection_filter_right = ProjectionFilter(calibration.get("right"))
+        self.frame_pool = FramePool()
+        self.full_plan = self.compile()
+        # processed frames and the seconds spent on them
+        self.frames = 0
+        self.seconds = 0.0
 
-    def transform(
-        self, input_frame: InputFrame, position=True, blink=True, variance=True
-    ):
-        frame = FilteredFrame(input_frame)
-        self.t.append(frame.t)
-        self.l0.append(frame.l0)
-        self.l1.append(frame.l1)
-        self.r0.append(frame.r0)
-        self.r1.append(frame.r1)
+    def _mark(self, span):
+        if self.measure:
+            latency.mark(span)
+
+    # projection of each eye
+    def _project(self, frame, t):
         frame.l_screen_position = self.projection_filter_left.transform(
-            self.t, self.l0, self.l1
+            t,
+            self.l0.last(),
+            self.l1.last(),
+            self.frame_pool.buffer("l_screen_position"),
         )
         frame.r_screen_position = self.projection_filter_right.transform(
-            self.t, self.r0, self.r1
+            t,
+            self.r0.last(),
+            self.r1.last(),
+            self.frame_pool.buffer("r_screen_position"),
         )
         self.left.append(frame.l_screen_position)
         self.right.append(frame.r_screen_position)
-        self.center.append(0.5 * (frame.r_screen_position + frame.r_screen_position))
-        frame.screen_position = frame.l_screen_position
-        if position:
-            frame.screen_position = self.pointer_filter.transform(
-                self.t, self.left, self.right, self.center
-            )
+
+    def _skip_projection(self, frame, t):
+        self.left.append(_zero2)
+        self.right.append(_zero2)
+
+    def _fuse(self, frame, t):
+        frame.center = self.frame_pool.buffer("center")
+        np.add(frame.r_screen_position, frame.r_screen_position, out=frame.center)
+        frame.center *= 0.5
+        self.center.append(frame.center)
+
+    def _skip_fusion(self, frame, t):
+        self.center.append(_zero2)
+
+    def _point(self, frame, t):
+        frame.screen_position = self.pointer_filter.transform(
+            t,
+            self.left.last(),
+            self.right.last(),
+            self.center.last(),
+            self.frame_pool.buffer("screen_position"),
+        )
         self.filtered_position.append(frame.screen_position)
-        if variance:
-            [frame.l_variance, frame.r_variance] = self.flicker_filter.transform(
-                self.t, self.left, self.right
-            )
-        if blink:
-            (frame.flips, frame.flip_position) = self.blink_filter.transform(
-                self.t, self.left, self.right, self.filtered_position
-            )
+
+    def _skip_pointer(self, frame, t):
+        self.filtered_position.append(_zero2)
+
+    def _flicker(self, frame, t):
+        [frame.l_variance, frame.r_variance] = self.flicker_filter.transform(
+            t, self.left, self.right
+        )
+
+    def _blink(self, frame, t):
+        (frame.flips, frame.flip_position) = self.blink_filter.transform(
+            t, self.left.last(), self.right.last(), self.filtered_position.last()
+        )
+        frame.speculation = speculation = self.blink_filter.speculation
+        kind = speculation.kind if speculation else None
+        dispatched = kind == "fire" or (frame.flips and kind != "confirm")
+        if dispatched and self.measure:
+            # tracker time from the last flip until dispatch
+            latency.record("blink_wait", t[-1] - self.blink_filter.flip_times[-1])
+
+    def _fixate(self, frame, t):
+        (left, right) = (frame.l_screen_position, frame.r_screen_position)
+        (l_open, r_open) = (left.any(), right.any())
+        frame.events = _no_events
+        if l_open or r_open:
+            x = frame.center if l_open and r_open else left if l_open else right
+            frame.events = self.fixation_filter.update(t[-1], x) or _no_events
+
+    def _predict(self, frame, t):
+        if self.measure and self.frames % 120 == 0:
+            self.prediction_filter.follow_latency()
+        frame.predicted_position = self.prediction_filter.transform(
+            t,
+            self.filtered_position.last(),
+            self.fixation_filter.start is not None,
+            self.frame_pool.buffer("predicted_position"),
+        )
+
+    # stages in order of evaluation, see GazePipeline
+    def stages(self):
+        screen_position = ("l_screen_position", "r_screen_position")
+        return [
+            Stage(
+                "projection",
+                ("t", "l0", "l1", "r0", "r1"),
+                screen_position,
+                self._project,
+                self._skip_projection,
+            ),
+            Stage(
+                "fusion", screen_position, ("center",), self._fuse, self._skip_fusion
+            ),
+            Stage(
+                "pointer",
+                screen_position + ("center",),
+                ("screen_position",),
+                self._point,
+                self._skip_pointer,
+            ),
+            Stage(
+                "flicker", screen_position, ("l_variance", "r_variance"), self._flicker
+            ),
+            Stage(
+                "blink",
+                screen_position + ("screen_position",),
+                ("flips", "flip_position", "speculation"),
+                self._blink,
+            ),
+            Stage("fixation", screen_position + ("center",), ("events",), self._fixate),
+            Stage(
+                "prediction",
+                ("screen_position", "events"),
+                ("predicted_position",),
+                self._predict,
+            ),
+        ]
+
+    # plan for transform that evaluates the given stages, all if None
+    def compile(self, stages=None):
+        plan = []
+        for stage in self.stages():
+            if stages is None or stage.name in stages:
+                plan.append((stage.name, stage.run, True))
+            elif stage.skip:
+                plan.append((stage.name, stage.skip, False))
+        return plan
+
+    def transform(self, input_frame: InputFrame, plan=None):
+        start = latency.now()
+        frame = self.frame_pool.take(input_frame)
+        self.t.append(frame.t)
+        self.l0.append(frame.l0)
+        self.l1.append(frame.l1)
+        self.r0.append(frame.r0)
+        self.r1.append(frame.r1)
+        t = self.t.last()
+        for (name, run, evaluated) in plan or self.full_plan:
+            run(frame, t)
+            if evaluated:
+                self._mark(name)
 
         # import timeit
         # _time = lambda n, f: print(timeit.timeit(f, number=n))
@@ -300,7 +1386,122 @@ class GazeFilter:
         # _time(1000, lambda: self.pointer_filter.transform(t, left, right))
         # _time(1000, lambda: self.blink_filter.transform(t, left, right))
         # _time(1000, lambda: self.flicker_filter.transform(t, left, right))
+        self.frames += 1
+        self.seconds += latency.now() - start
         return frame
 
-    def set_blink_patterns(self, blink_patterns):
-        self.blink_filter.set_blink_patterns(blink_patterns)
+    # offline replay of whole recordings, e.g. for parameter tuning
+    #
+    # takes columns t (n,), l0, l1, r0, r1 (n, 3) and returns columns named like
+    # the fields of FilteredFrame; all stages run from a fresh state, without
+    # touching the state of this filter
+    def transform_batch(self, columns):
+        t = np.asarray(columns["t"], dtype=float)
+        # same as the zero initialized history of the streaming filter
+        pad = lambda x: np.concatenate((np.zeros((self.history, *x.shape[1:])), x))
+        result = {"t": t}
+        result["l_screen_position"] = self.projection_filter_left.transform_batch(
+            t, columns["l0"], columns["l1"]
+        )
+        result["r_screen_position"] = self.projection_filter_right.transform_batch(
+            t, columns["r0"], columns["r1"]
+        )
+        t = pad(t)
+        left = pad(result["l_screen_position"])
+        right = pad(result["r_screen_position"])
+        center = pad(0.5 * (result["r_screen_position"] + result["r_screen_position"]))
+        result["screen_position"] = self.pointer_filter.transform_batch(
+            t, left, right, center, self.history
+        )
+        (
+            result["l_variance"],
+            result["r_variance"],
+        ) = self.flicker_filter.transform_batch(t, left, right, self.history)
+        (result["flips"], result["flip_position"]) = self.blink_filter.transform_batch(
+            t, left, right, pad(result["screen_position"]), self.history
+        )
+        (x, opened) = select_eye(*(x[self.history :] for x in (left, right, center)))
+        frames = np.flatnonzero(opened)
+        result["events"] = [[] for _ in range(len(opened))]
+        # fixating from the frame that reported the start until the end
+        fixating = np.zeros(len(opened), int)
+        for (i, event) in self.fixation_filter.transform_batch(
+            result["t"][frames], x[frames]
+        ):
+            result["events"][frames[i]].append(event)
+            fixating[frames[i]] += {"fixation_start": 1, "fixation_end": -1}.get(
+                event.kind, 0
+            )
+        result["predicted_position"] = self.prediction_filter.transform_batch(
+            t, pad(result["screen_position"]), np.cumsum(fixating) > 0, self.history
+        )
+        return result
+
+    def set_blink_patterns(self, blink_patterns, speculative=()):
+        self.blink_filter.set_automaton(BlinkAutomaton(blink_patterns, speculative))
+
+    def set_blink_automaton(self, automaton: BlinkAutomaton):
+        self.blink_filter.set_automaton(automaton)
+
+    def set_blink_timing(self, timing: BlinkTiming):
+        self.blink_filter.set_timing(timing)
+
+
+# runs an alternative configuration on the frames of the live filter, its results
+# are only compared with the live ones and never drive any input
+class ShadowGazeFilter:
+    def __init__(self, live: GazeFilter, params: GazeFilterParams):
+        self.live = live
+        self.gaze_filter = GazeFilter(live.calibration, params, measure=False)
+        self.frames = 0
+        self.position_error = 0.0
+        self.max_position_error = 0.0
+        self.variance_error = 0.0
+        self.blinks = [0, 0]
+        # blinks emitted by one filter only or resolved to different patterns
+        self.blink_mismatches = 0
+        self.live_start = (live.frames, live.seconds)
+        # stages of the live filter and the compiled plan
+        self.plan = (None, self.gaze_filter.full_plan)
+
+    # stages as evaluated by the live filter, all if None
+    def transform(
+        self, input_frame: InputFrame, live_frame: FilteredFrame, stages=None
+    ):
+        # follow tag changes
+        automaton = self.live.blink_filter.automaton
+        if self.gaze_filter.blink_filter.automaton is not automaton:
+            self.gaze_filter.set_blink_automaton(automaton)
+        if self.plan[0] != stages:
+            self.plan = (stages, self.gaze_filter.compile(stages))
+        frame = self.gaze_filter.transform(input_frame, self.plan[1])
+        self.frames += 1
+        if stages is None or "pointer" in stages:
+            error = np.linalg.norm(frame.screen_position - live_frame.screen_position)
+            self.position_error += error
+            self.max_position_error = max(self.max_position_error, error)
+        if stages is None or "flicker" in stages:
+            self.variance_error += abs(frame.l_variance - live_frame.l_variance)
+            self.variance_error += abs(frame.r_variance - live_frame.r_variance)
+        self.blinks[0] += live_frame.flips is not None
+        self.blinks[1] += frame.flips is not None
+        if live_frame.flips != frame.flips:
+            self.blink_mismatches += 1
+        return frame
+
+    def report(self):
+        frames = max(self.frames, 1)
+        live_frames = max(self.live.frames - self.live_start[0], 1)
+        live_seconds = self.live.seconds - self.live_start[1]
+        return {
+            "frames": self.frames,
+            "mean_position_error": self.position_error / frames,
+            "max_position_error": self.max_position_error,
+            "mean_variance_error": self.variance_error / frames / 2,
+            "live_blinks": self.blinks[0],
+            "shadow_blinks": self.blinks[1],
+            "blink_mismatches": self.blink_mismatches,
+            # milliseconds per frame
+            "live_cost": 1000 * live_seconds / live_frames,
+            "shadow_cost": 1000 * self.gaze_filter.seconds / frames,
+        }
@@ -0,0 +1,54 @@
+# former implementations that the vectorized filters are checked and benchmarked
+# against
+
+from itertools import islice
+
+import numpy as np
+
+from util import RingBuffer
+
+
+# CircleFilter before vectorization
+class LoopCircleFilter:
+    def __init__(self):
+        self.last_center = np.array((0.0, 0.0))
+
+    def _check_distance(self, u, v, radius):
+        distance = np.linalg.norm((u - v) / radius)
+        return distance < 1
+
+    def transform(self, x, lookbehind, radius, out):
+        c = np.array(x[-1])
+        sum = np.array(c)
+        n = 1
+        for v in islice(reversed(x), 1, lookbehind):
+            if not self._check_distance(c, v, radius):
+                break
+            sum += v
+            n += 1
+            c = sum / n
+        if self._check_distance(self.last_center, c, radius):
+            c = self.last_center
+        self.last_center = c
+        out[...] = c
+        return out
+
+
+# CircleFilter positions when streaming positions through the history
+def replay(circle_filter, positions, lookbehind, radius=np.array((0.02, 0.02))):
+    x = RingBuffer(max(50, lookbehind), (2,))
+    result = np.zeros_like(positions)
+    for i, position in enumerate(positions):
+        x.append(position)
+        circle_filter.transform(x.last(), lookbehind, radius, result[i])
+    return result
+
+
+# FlickerFilter._get_factor before the history became a RingBuffer
+def loop_flicker_factor(x, radius, lookbehind):
+    if not x[-1].any():
+        return 0
+    a = np.fromiter(reversed(x), dtype=np.dtype((float, 2)), count=lookbehind)
+    mean = np.mean(a, axis=0)
+    distance = np.linalg.norm((a - mean) / radius, axis=1)
+    return 0.1 + 0.9 * np.count_nonzero(distance < 1) / len(distance)
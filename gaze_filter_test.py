@@ -0,0 +1,365 @@
+# python -m unittest gaze_filter_test.py
+
+from pathlib import Path
+import tempfile
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from gaze_filter import (
+    FixationFilter,
+    FlickerFilter,
+    BlinkAutomaton,
+    BlinkTiming,
+    GazeFilter,
+    GazeFilterParams,
+    PointerFilter,
+    ShadowGazeFilter,
+    SlidingStats,
+    ZoneRaster,
+    symbols,
+)
+from gaze_calibration import screen_size_mm
+from gaze_filter_reference import LoopCircleFilter, loop_flicker_factor, replay
+from gaze_simulation import Uncalibrated, fixations, input_frames, session
+from recorded_simulation import input_frame
+from tiles import Zone
+from util import RingBuffer
+
+
+class TestCircleFilter(unittest.TestCase):
+    def test_replay_equivalence(self):
+        (_, positions, _) = fixations(3000, jitter=0.008)
+        for lookbehind in [1, 2, 20, 50, 200]:
+            with self.subTest(lookbehind=lookbehind):
+                expected = replay(LoopCircleFilter(), positions, lookbehind)
+                actual = replay(PointerFilter.CircleFilter(), positions, lookbehind)
+                np.testing.assert_array_equal(actual, expected)
+
+
+class TestSlidingStats(unittest.TestCase):
+    def test_window(self):
+        (_, positions, _) = fixations(3000)
+        x = RingBuffer(50, (2,))
+        stats = SlidingStats(20)
+        for i, position in enumerate(positions):
+            x.append(position)
+            # skipped samples are caught up
+            if i % 500 < 490:
+                stats.update(x)
+                np.testing.assert_allclose(stats.mean, np.mean(x.last(20), axis=0))
+                np.testing.assert_allclose(
+                    stats.variance(), np.var(x.last(20), axis=0), atol=1e-15
+                )
+
+
+class TestFlickerFilter(unittest.TestCase):
+    def test_exact_count(self):
+        (_, positions, _) = fixations(2000, jitter=0.01)
+        positions[::97] = 0
+        radius = np.array((0.014, 0.014))
+        for lookbehind in [5, 20, 50]:
+            with self.subTest(lookbehind=lookbehind):
+                flicker_filter = FlickerFilter(radius, lookbehind)
+                x = RingBuffer(50, (2,))
+                for position in positions:
+                    x.append(position)
+                    (factor, _) = flicker_filter.transform(None, x, x)
+                    expected = loop_flicker_factor(x.last(), radius, lookbehind)
+                    self.assertAlmostEqual(factor, expected)
+
+    def test_window_length(self):
+        x = RingBuffer(50, (2,))
+        with self.assertRaises(ValueError):
+            FlickerFilter(np.array((0.014, 0.014)), 60).transform(None, x, x)
+        gaze_filter = GazeFilter(
+            Uncalibrated(), GazeFilterParams(flicker_lookbehind=60)
+        )
+        self.assertEqual(gaze_filter.history, 60)
+
+
+class TestBlinkAutomaton(unittest.TestCase):
+    def test_prefixes(self):
+        patterns = [
+            (".r", Zone.c),
+            (". .", Zone.c),
+            (". .", Zone.inside),
+            (". . .", Zone.c),
+            (" r", Zone.c),
+        ]
+        automaton = BlinkAutomaton(patterns)
+        encode = lambda p: [symbols.index(c) for c in p]
+        for p in [".", ".r", ". ", ". .", ". . .", " r", "l", ".rr"]:
+            with self.subTest(p):
+                state = automaton.run(encode(p))
+                matches = {q for q, _ in patterns if q.startswith(p)}
+                self.assertEqual(state == BlinkAutomaton.dead, not matches)
+                if matches:
+                    self.assertEqual(automaton.pattern[state], p)
+                    self.assertEqual(automaton.completions[state], len(matches))
+                    self.assertEqual(automaton.accepting[state], p in matches)
+        self.assertEqual(
+            list(automaton.zones[automaton.run(encode(". ."))]), [Zone.c, Zone.inside]
+        )
+
+    def test_zone_raster(self):
+        zones = [Zone.c, Zone.l, Zone.tr, Zone.br, Zone.r, Zone.tl, Zone.inside]
+        raster = ZoneRaster(zones)
+        rng = np.random.default_rng(0)
+        # random points and points on the edges
+        points = list(rng.uniform(-0.2, 1.2, (1000, 2)))
+        points += [(x, y) for x in raster.edges[0] for y in raster.edges[1]]
+        points += [(np.nan, 0.5)]
+        for point in points:
+            expected = next((z for z in zones if point in z), None)
+            self.assertIs(raster.lookup(point), expected, point)
+
+
+class TestTransformBatch(unittest.TestCase):
+    def test_stream_equivalence(self):
+        columns = session(6000)
+        params = GazeFilterParams(prediction_horizon=0.03)
+        gaze_filter = GazeFilter(Uncalibrated(), params)
+        patterns = [(p, Zone.any) for p in [".r", ".l", ". .", ". . .", " ", ". r"]]
+        gaze_filter.set_blink_patterns(patterns)
+        batch = gaze_filter.transform_batch(columns)
+        for i, input_frame in enumerate(input_frames(columns)):
+            frame = gaze_filter.transform(input_frame)
+            for key in ["screen_position", "l_screen_position", "r_screen_position"]:
+                np.testing.assert_array_equal(getattr(frame, key), batch[key][i])
+            for key in ["l_variance", "r_variance"]:
+                self.assertAlmostEqual(getattr(frame, key), batch[key][i])
+            np.testing.assert_allclose(
+                frame.predicted_position, batch["predicted_position"][i], atol=1e-12
+            )
+            self.assertEqual(frame.flips, batch["flips"][i])
+            self.assertEqual(
+                [(e.kind, e.t) for e in frame.events],
+                [(e.kind, e.t) for e in batch["events"][i]],
+            )
+            if frame.flips:
+                np.testing.assert_array_equal(
+                    frame.flip_position, batch["flip_position"][i]
+                )
+        self.assertGreater(len([f for f in batch["flips"] if f]), 10)
+
+
+class TestAllocations(unittest.TestCase):
+    # blocks per frame that GazeFilter.transform may keep alive
+    budget = 1.0
+    # bytes that a frame may allocate on top of what it keeps, i.e. array views
+    # and scalars, the stages write their results into the pooled buffers
+    peak_budget = 3072
+
+    def test_steady_state(self):
+        frames = input_frames(session(1200))
+        for engine in ["circle", *PointerFilter.engines]:
+            with self.subTest(engine=engine):
+                params = GazeFilterParams(
+                    prediction_horizon=0.03, pointer_engine=engine
+                )
+                gaze_filter = GazeFilter(Uncalibrated(), params)
+                patterns = [(p, Zone.any) for p in [".r", ".l", " "]]
+                gaze_filter.set_blink_patterns(patterns)
+                for frame in frames[:600]:
+                    gaze_filter.transform(frame)
+                # the frames aren't kept, the pool recycles them
+                peaks = np.zeros(300, int)
+                tracemalloc.start()
+                try:
+                    before = tracemalloc.take_snapshot()
+                    for i, frame in enumerate(frames[600:900]):
+                        current = tracemalloc.get_traced_memory()[0]
+                        tracemalloc.reset_peak()
+                        gaze_filter.transform(frame)
+                        peaks[i] = tracemalloc.get_traced_memory()[1] - current
+                    after = tracemalloc.take_snapshot()
+                finally:
+                    tracemalloc.stop()
+                filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+                diff = after.filter_traces(filters).compare_to(
+                    before.filter_traces(filters), "lineno"
+                )
+                blocks = sum(stat.count_diff for stat in diff)
+                self.assertLess(blocks / len(peaks), self.budget, diff[:5])
+                self.assertLess(max(peaks), self.peak_budget)
+
+
+# frames with both eyes closed during the intervals
+def blinks(closed, duration):
+    for t in np.arange(0.0, duration, 1 / 120):
+        frame = input_frame(t, 0.5, 0.5)
+        if any(a <= t < b for (a, b) in closed):
+            frame.l1 = frame.r1 = np.zeros(3)
+        yield frame
+
+
+class TestSpeculation(unittest.TestCase):
+    def replay(self, closed, speculative):
+        gaze_filter = GazeFilter(Uncalibrated())
+        patterns = [(p, Zone.any) for p in [". .", ". . ."]]
+        gaze_filter.set_blink_patterns(patterns, patterns if speculative else ())
+        events = []
+        for frame in blinks(closed, 2.0):
+            t = frame.t
+            frame = gaze_filter.transform(frame)
+            if frame.flips:
+                events.append(("flips", frame.flips[0], t))
+            if frame.speculation:
+                speculation = frame.speculation
+                events.append((speculation.kind, speculation.blink[0], t))
+        return (events, gaze_filter.blink_filter.stats)
+
+    def test_confirm(self):
+        (events, stats) = self.replay([(1.0, 1.1)], True)
+        self.assertEqual(
+            [e[:2] for e in events],
+            [("fire", ". ."), ("flips", ". ."), ("confirm", ". .")],
+        )
+        (fired, confirmed) = (events[0][2], events[1][2])
+        self.assertEqual(self.replay([(1.0, 1.1)], False)[0], events[1:2])
+        self.assertGreater(confirmed - fired, 0.1)
+        self.assertAlmostEqual(stats[". ."].saved, confirmed - fired)
+
+    def test_rollback(self):
+        closed = [(1.0, 1.1), (1.2, 1.3)]
+        (events, stats) = self.replay(closed, True)
+        self.assertEqual(
+            [e[:2] for e in events],
+            [("fire", ". ."), ("rollback", ". ."), ("flips", ". . .")],
+        )
+        self.assertEqual(self.replay(closed, False)[0], events[2:])
+        self.assertEqual((stats[". ."].fired, stats[". ."].confirmed), (1, 0))
+
+
+class TestBlinkTiming(unittest.TestCase):
+    def test_persistence(self):
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as directory:
+            timing = BlinkTiming(Path(directory, "blink_timing"))
+            self.assertFalse(timing.observe(rng.normal(0.1, 0.01, 10), []))
+            self.assertIsNone(timing.latency)
+            gaps = rng.uniform(0.0, 0.02, 20)
+            self.assertTrue(timing.observe(rng.normal(0.1, 0.01, 10), gaps))
+            self.assertTrue(0.1 < timing.latency < 0.16)
+            self.assertTrue(0.02 <= timing.sync_latency < 0.03)
+            loaded = BlinkTiming(Path(directory, "blink_timing"))
+            self.assertEqual(
+                (loaded.latency, loaded.sync_latency),
+                (timing.latency, timing.sync_latency),
+            )
+
+    def test_learn(self):
+        gaze_filter = GazeFilter(Uncalibrated())
+        gaze_filter.set_blink_patterns([(". . .", Zone.any)])
+        gaze_filter.set_blink_timing(BlinkTiming())
+        # double blinks, 0.1 s closed and open
+        closed = [(a + b, a + b + 0.1) for a in range(1, 11) for b in (0.0, 0.2)]
+        recognized = [
+            frame.flips for frame in map(gaze_filter.transform, blinks(closed, 12.0))
+        ]
+        self.assertEqual(len([f for f in recognized if f]), 10)
+        blink_filter = gaze_filter.blink_filter
+        self.assertTrue(0.1 < blink_filter.latency < 0.16)
+        # bounded step towards the lower bound
+        self.assertAlmostEqual(blink_filter.sync_latency, 0.04 / BlinkTiming.max_step)
+
+    def test_timeouts(self):
+        gaze_filter = GazeFilter(Uncalibrated())
+        gaze_filter.set_blink_patterns([(". . .", Zone.any)])
+        gaze_filter.set_blink_timing(BlinkTiming())
+        # short double blinks that are open a little longer than the latency
+        closed = [(a + b, a + b + 0.05) for a in range(1, 41) for b in (0.0, 0.23)]
+        recognized = [
+            frame.t
+            for frame in map(gaze_filter.transform, blinks(closed, 42.0))
+            if frame.flips
+        ]
+        self.assertGreater(gaze_filter.blink_filter.latency, 0.16)
+        self.assertTrue(recognized and recognized[-1] > 40)
+
+    def test_merges(self):
+        gaze_filter = GazeFilter(Uncalibrated())
+        gaze_filter.set_blink_patterns([(p, Zone.any) for p in [". .", ". . ."]])
+        gaze_filter.blink_filter.latency = 0.18
+        gaze_filter.set_blink_timing(BlinkTiming())
+        # single blinks that are open a little shorter than the latency
+        closed = [(a + b, a + b + 0.05) for a in range(1, 31) for b in (0.0, 0.21)]
+        recognized = [
+            frame.flips[0]
+            for frame in map(gaze_filter.transform, blinks(closed, 32.0))
+            if frame.flips
+        ]
+        self.assertEqual(recognized[0], ". . .")
+        self.assertEqual(set(recognized[-20:]), {". ."})
+        self.assertLess(gaze_filter.blink_filter.latency, 0.16)
+
+
+class TestFixationFilter(unittest.TestCase):
+    def test_stream_equivalence(self):
+        (t, x, target) = fixations(6000)
+        moving = np.r_[False, np.any(np.diff(target, axis=0) != 0, axis=1)]
+        fixation_count = np.sum(np.diff(moving.astype(int)) == -1)
+        for method in ["idt", "ivt"]:
+            with self.subTest(method):
+                fixation_filter = FixationFilter(method)
+                stream = []
+                for i in range(len(t)):
+                    stream += [(i, e) for e in fixation_filter.update(t[i], x[i])]
+                batch = FixationFilter(method).transform_batch(t, x)
+                self.assertEqual(len(stream), len(batch))
+                for ((i, e), (j, f)) in zip(stream, batch):
+                    self.assertEqual((i, e.kind, e.t), (j, f.kind, f.t))
+                    np.testing.assert_allclose(e.position, f.position)
+                    self.assertAlmostEqual(e.duration, f.duration)
+                starts = [e for (_, e) in stream if e.kind == "fixation_start"]
+                self.assertAlmostEqual(len(starts), fixation_count, delta=5)
+
+
+class TestPointerEngines(unittest.TestCase):
+    def test_stream_equivalence(self):
+        columns = session(1500)
+        frames = input_frames(columns)
+        for engine in PointerFilter.engines:
+            with self.subTest(engine):
+                params = GazeFilterParams(pointer_engine=engine)
+                gaze_filter = GazeFilter(Uncalibrated(), params)
+                batch = gaze_filter.transform_batch(columns)["screen_position"]
+                for i, input_frame in enumerate(frames):
+                    frame = gaze_filter.transform(input_frame)
+                    np.testing.assert_allclose(frame.screen_position, batch[i])
+                # smoother than the measurements during fixations
+                fixation = np.all(
+                    columns["target"][1:] == columns["target"][:-1], axis=1
+                )
+                steps = np.linalg.norm(np.diff(batch, axis=0), axis=1)[fixation]
+                measured = np.diff(columns["l1"][:, :2], axis=0)[fixation]
+                measured = np.linalg.norm(measured / screen_size_mm, axis=1)
+                self.assertLess(np.median(steps), 0.5 * np.median(measured))
+
+
+class TestShadow(unittest.TestCase):
+    def setUp(self):
+        self.frames = input_frames(session(1500))
+        self.live = GazeFilter(Uncalibrated())
+        self.live.set_blink_patterns([(p, Zone.any) for p in [".r", ".l", " "]])
+
+    def replay(self, params):
+        shadow = ShadowGazeFilter(self.live, params)
+        for input_frame in self.frames:
+            shadow.transform(input_frame, self.live.transform(input_frame))
+        return shadow.report()
+
+    def test_same_params(self):
+        report = self.replay(GazeFilterParams())
+        self.assertEqual(report["frames"], len(self.frames))
+        self.assertEqual(report["max_position_error"], 0.0)
+        self.assertEqual(report["mean_variance_error"], 0.0)
+        self.assertEqual(report["blink_mismatches"], 0)
+        self.assertGreater(report["live_blinks"], 0)
+
+    def test_other_params(self):
+        report = self.replay(GazeFilterParams(pointer_radius=(0.005, 0.005)))
+        self.assertGreater(report["max_position_error"], 0.0)
+        self.assertEqual(report["mean_variance_error"], 0.0)
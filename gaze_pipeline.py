@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from gaze_filter import FilteredFrame, GazeFilter
+from gaze_thread import InputFrame
+
+
+# consumer of some fields of FilteredFrame
+@dataclass
+class Subscription:
+    fields: tuple[str, ...]
+    # called with the fields, or the whole frame if `frame` is set
+    callback: Callable
+    frame: bool = False
+    # not called for outdated frames that only update the filter state
+    latest_only: bool = False
+
+
+# runs only the stages of a GazeFilter that the subscriptions depend on
+#
+# compile is called when the subscriptions change, e.g. on tag changes; stages
+# that are not needed keep their histories aligned with zeros
+class GazePipeline:
+    def __init__(self, gaze_filter: GazeFilter):
+        self.gaze_filter = gaze_filter
+        self.compile([])
+
+    def compile(self, subscriptions: list[Subscription]):
+        stages = self.gaze_filter.stages()
+        producers = {field: stage for stage in stages for field in stage.outputs}
+        # walk the inputs back to the frame fields of the tracker
+        needed = set()
+        pending = [field for s in subscriptions for field in s.fields]
+        while pending:
+            stage = producers.get(pending.pop())
+            if stage and stage.name not in needed:
+                needed.add(stage.name)
+                pending += stage.inputs
+        self.stages = frozenset(needed)
+        self.plan = self.gaze_filter.compile(self.stages)
+        self.subscriptions = list(subscriptions)
+
+    # latest is false for outdated frames, subscriptions are called in order
+    def process(self, input_frame: InputFrame, latest=True) -> FilteredFrame:
+        frame = self.gaze_filter.transform(input_frame, self.plan)
+        for s in self.subscriptions:
+            if s.latest_only and not latest:
+                continue
+            elif s.frame:
+                s.callback(frame)
+            else:
+                s.callback(*(getattr(frame, field) for field in s.fields))
+        return frame
@@ -0,0 +1,50 @@
+# python -m unittest gaze_pipeline_test.py
+
+import unittest
+
+import numpy as np
+
+from gaze_filter import GazeFilter
+from gaze_pipeline import GazePipeline, Subscription
+from gaze_simulation import Uncalibrated, input_frames, session
+
+
+class TestGazePipeline(unittest.TestCase):
+    def setUp(self):
+        self.frames = input_frames(session(600))
+        self.pipeline = GazePipeline(GazeFilter(Uncalibrated()))
+
+    def test_compile(self):
+        for (fields, stages) in [
+            ((), []),
+            (("l1",), []),
+            (("l_screen_position",), ["projection"]),
+            (("l_variance",), ["projection", "flicker"]),
+            (("flips",), ["projection", "fusion", "pointer", "blink"]),
+        ]:
+            with self.subTest(fields):
+                self.pipeline.compile([Subscription(fields, print)])
+                self.assertEqual(self.pipeline.stages, set(stages))
+
+    def test_process(self):
+        positions, variances = [], []
+        self.pipeline.compile(
+            [
+                Subscription(("screen_position",), positions.append),
+                Subscription(("l_variance",), variances.append, latest_only=True),
+            ]
+        )
+        gaze_filter = GazeFilter(Uncalibrated())
+        for i, input_frame in enumerate(self.frames):
+            frame = self.pipeline.process(input_frame, latest=i % 2 == 0)
+            expected = gaze_filter.transform(input_frame)
+            np.testing.assert_array_equal(
+                frame.screen_position, expected.screen_position
+            )
+            self.assertIsNone(frame.flips)
+        self.assertEqual(len(positions), len(self.frames))
+        self.assertEqual(len(variances), len(self.frames) // 2)
+        # skipped stages keep the histories aligned
+        self.assertEqual(
+            self.pipeline.gaze_filter.filtered_position.count, len(positions)
+        )
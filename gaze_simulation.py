@@ -0,0 +1,150 @@
+# synthetic gaze data and calibration stand-ins for tests and benchmarks
+
+import numpy as np
+
+from gaze_calibration import ScreenPlane, screen_size_mm
+from gaze_thread import InputFrame
+
+
+# eye position relative to tracker [mm]
+l0 = np.array((-30.0, 0.0, 600.0))
+r0 = np.array((30.0, 0.0, 600.0))
+
+
+# fixations on random targets with gaussian jitter, connected by saccades
+#
+# returns timestamps, measured and true screen positions
+def fixations(n, rate=120.0, seed=0, jitter=0.006, saccade=0.04):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / rate
+    target = np.zeros((n, 2))
+    position, i = rng.uniform(0.05, 0.95, 2), 0
+    while i < n:
+        # fixation
+        k = int(rate * rng.uniform(0.2, 0.8))
+        target[i : i + k] = position
+        i += k
+        # saccade
+        destination = rng.uniform(0.05, 0.95, 2)
+        k = max(1, int(rate * saccade))
+        alpha = np.linspace(0, 1, k + 1)[1:, None]
+        target[i : i + k] = ((1 - alpha) * position + alpha * destination)[: n - i]
+        position, i = destination, i + k
+    return (t, target + rng.normal(0, jitter, (n, 2)), target)
+
+
+# eyes closed (left, right) for some frames, rows are (start, length) in seconds
+blinks = {
+    (True, True): [(0.0, 0.2)],
+    (False, True): [(0.0, 0.18)],
+    (True, False): [(0.0, 0.18)],
+    # double blink
+    (True, True, 2): [(0.0, 0.12), (0.25, 0.12)],
+}
+
+
+# columns as taken by GazeFilter.transform_batch, with a blink every two seconds,
+# and the true screen position as column target
+def session(n, rate=120.0, seed=0):
+    (t, position, target) = fixations(n, rate, seed)
+    l1 = np.zeros((n, 3))
+    l1[:, :2] = (position - (0.5, 1.0)) * screen_size_mm
+    r1 = l1.copy()
+    kinds = list(blinks.items())
+    for i, start in enumerate(np.arange(1.0, t[-1], 2.0)):
+        (kind, closed) = kinds[i % len(kinds)]
+        for (u, duration) in closed:
+            frames = (start + u <= t) & (t < start + u + duration)
+            if kind[0]:
+                l1[frames] = 0.0
+            if kind[1]:
+                r1[frames] = 0.0
+    return {
+        "t": t,
+        "l0": np.tile(l0, (n, 1)),
+        "l1": l1,
+        "r0": np.tile(r0, (n, 1)),
+        "r1": r1,
+        "target": target,
+    }
+
+
+# stand-in for Calibration with the uncalibrated projection of EyeCalibration
+class Uncalibrated:
+    def get(self, label):
+        return self
+
+    def transform(self, t, v0, v1):
+        return v1[-1][:2] / screen_size_mm + (0.5, 1.0)
+
+    def transform_batch(self, t, v0, v1):
+        return v1[:, :2] / screen_size_mm + (0.5, 1.0)
+
+
+# stand-in for Calibration with a fitted model, e.g. CalibrationData
+class Calibrated(Uncalibrated):
+    def __init__(self, model):
+        self.model = model
+
+    def transform(self, t, v0, v1):
+        if isinstance(self.model, ScreenPlane):
+            return self.model.transform(v0[-1], v1[-1])
+        return self.model.transform(v1[-1][:2])
+
+    def transform_batch(self, t, v0, v1):
+        if isinstance(self.model, ScreenPlane):
+            return self.model.transform_batch(v0, v1)
+        return self.model.transform_batch(v1[:, :2])
+
+
+# stand-in for Calibration with the models of a saved CalibrationProfile
+class Profiled:
+    def __init__(self, profile):
+        self.eyes = {
+            label: Calibrated(profile.model(label)) for label in ["left", "right"]
+        }
+
+    def get(self, label):
+        return self.eyes[label]
+
+
+# tracker positions [mm] when looking at screen positions y, with a smooth
+# distortion that a calibration has to undo
+def distorted(y):
+    warp = 0.04 * np.sin(np.pi * y[..., ::-1]) + 0.05 * (y - 0.5) ** 2
+    return (y + warp - (0.5, 1.0)) * screen_size_mm
+
+
+# a screen mounted behind and tilted against the display plane the tracker is
+# configured with
+screen_plane = ScreenPlane(
+    np.array((-180.0, 200.0, -30.0)),
+    np.array(((350.0, 0.0, 10.0), (0.0, -190.0, -40.0))),
+)
+
+
+# gaze destinations [mm] on the tracker's display plane z = 0 from the eye
+# positions when looking at screen positions y of `plane`
+def gaze_destinations(eyes, y, plane=screen_plane):
+    d = plane.origin + y @ plane.axes - eyes
+    return eyes - d * (eyes[:, 2:] / d[:, 2:])
+
+
+# samples [mm] while fixating each reference point, shape (points, n, 2), a
+# fraction of them are off by up to 40 mm like saccades
+def calibration_samples(references, n=20, jitter=2.0, outliers=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = distorted(references)[:, None] + rng.normal(
+        0, jitter, (len(references), n, 2)
+    )
+    off = rng.random(samples.shape[:2]) < outliers
+    samples[off] += rng.uniform(-40, 40, (off.sum(), 2))
+    return samples
+
+
+# frames of session columns, as the gaze thread delivers them
+def input_frames(columns):
+    keys = ["t", "l0", "r0", "l1", "r1"]
+    return [
+        InputFrame(*(columns[k][i] for k in keys)) for i in range(len(columns["t"]))
+    ]
@@ -1,8 +1,15 @@
+import atexit
+from collections import deque
 from dataclasses import dataclass
+import functools
+from pathlib import Path
 import pickle
+import time
 
 from PySide2.QtCore import Signal, QThread, QMutex
 
+from shared_ring import SharedFrameRing
+import latency
 from unix_socket import UnixSocket
 from settings import *
 from util import *
@@ -15,7 +22,66 @@ sock_gaze = UnixSocket(Sockets.gaze, 200)
 # graph = Graph()
 
 
-@dataclass
+# the first byte of a transmission negotiates its format
+class FrameFormat:
+    # pickled tuple (t, l0, l1, r0, r1), legacy tracker bridges
+    pickle = 0x80
+    # fixed layout, see frame_dtype
+    binary = 0x01
+    # handshake, followed by the name of a SharedFrameRing with binary frames
+    shared_memory = 0x02
+    # new frames in the SharedFrameRing
+    wakeup = 0x03
+
+
+# binary frame flags
+class FrameFlags:
+    # eye vectors are packed as float32 instead of float64
+    float32 = 0x01
+    # validity bits below are set by the sender
+    validity = 0x02
+    l_valid = 0x04
+    r_valid = 0x08
+
+
+# header: format byte, flags byte, padding to 8 bytes, timestamp
+# body: eye vectors in pickle order l0, l1, r0, r1
+def _frame_dtype(eye_type):
+    return np.dtype(
+        [
+            ("format", "u1"),
+            ("flags", "u1"),
+            ("pad", "V6"),
+            ("t", "<f8"),
+            ("eyes", eye_type, (4, 3)),
+        ]
+    )
+
+
+frame_dtype = {
+    0: _frame_dtype("<f8"),
+    FrameFlags.float32: _frame_dtype("<f4"),
+}
+
+_zero = np.zeros(3)
+_zero.flags.writeable = False
+
+
+# same layout as frame_dtype, but strided by the padded message length
+@functools.cache
+def _batch_dtype(flags, msg_length):
+    dtype = frame_dtype[flags & FrameFlags.float32]
+    return np.dtype(
+        {
+            "names": ["t", "eyes"],
+            "formats": [dtype.fields["t"][0], dtype.fields["eyes"][0]],
+            "offsets": [dtype.fields["t"][1], dtype.fields["eyes"][1]],
+            "itemsize": msg_length,
+        }
+    )
+
+
+@dataclass(slots=True)
 class InputFrame:
     # timestamp
     t: float
@@ -25,23 +91,195 @@ class InputFrame:
     # gaze destination relative to tracker [mm]
     l1: np.ndarray
     r1: np.ndarray
+    # local receive time, see latency.now
+    received: float = 0.0
 
     @staticmethod
     def from_bytes(transmission: bytes) -> "InputFrame":
-        (t, l0, l1, r0, r1) = pickle.loads(transmission)
-        return InputFrame(t, vec(l0), vec(r0), vec(l1), vec(r1))
+        format = transmission[0]
+        if format == FrameFormat.binary:
+            flags = transmission[1]
+            record = np.frombuffer(
+                transmission, frame_dtype[flags & FrameFlags.float32], count=1
+            )[0]
+            (l0, l1, r0, r1) = record["eyes"]
+            if flags & FrameFlags.validity:
+                if not flags & FrameFlags.l_valid:
+                    (l0, l1) = (_zero, _zero)
+                if not flags & FrameFlags.r_valid:
+                    (r0, r1) = (_zero, _zero)
+            return InputFrame(float(record["t"]), l0, r0, l1, r1)
+        elif format == FrameFormat.pickle:
+            (t, l0, l1, r0, r1) = pickle.loads(transmission)
+            return InputFrame(t, vec(l0), vec(r0), vec(l1), vec(r1))
+        else:
+            raise ValueError(f"unknown frame format {format:#x}")
+
+    @staticmethod
+    def from_batch(transmissions: memoryview, msg_length: int) -> list["InputFrame"]:
+        header = np.frombuffer(transmissions, np.uint8).reshape(-1, msg_length)[:, :2]
+        formats, flags = header[:, 0], header[:, 1]
+        if (
+            np.all(formats == FrameFormat.binary)
+            and np.all(flags == flags[0])
+            and not flags[0] & FrameFlags.validity
+        ):
+            records = np.frombuffer(transmissions, _batch_dtype(flags[0], msg_length))
+            # copy once, the receive buffer is reused
+            t = records["t"].tolist()
+            eyes = records["eyes"].copy()
+            return [
+                InputFrame(t[i], eyes[i, 0], eyes[i, 2], eyes[i, 1], eyes[i, 3])
+                for i in range(len(t))
+            ]
+        # mixed or legacy formats
+        return [
+            InputFrame.from_bytes(bytes(transmissions[i : i + msg_length]))
+            for i in range(0, len(transmissions), msg_length)
+        ]
+
+    def to_bytes(self, float32=False) -> bytes:
+        flags = FrameFlags.float32 if float32 else 0
+        record = np.zeros(1, frame_dtype[flags])
+        record["format"] = FrameFormat.binary
+        record["flags"] = flags
+        record["t"] = self.t
+        record["eyes"] = (self.l0, self.l1, self.r0, self.r1)
+        return record.tobytes()
+
+
+# bounded handoff from the gaze thread to the gui thread, at most one wakeup is
+# queued in the event loop no matter how many frames arrive meanwhile
+class FrameQueue:
+    def __init__(self, capacity):
+        self.frames = deque(maxlen=capacity)
+        self.lock = QMutex()
+        self.wakeup_pending = False
+        # metrics
+        self.depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    # returns whether the consumer needs a wakeup
+    def put(self, frames):
+        self.lock.lock()
+        overflow = len(self.frames) + len(frames) - self.frames.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+        self.frames.extend(frames)
+        wakeup = not self.wakeup_pending
+        self.wakeup_pending = True
+        self.lock.unlock()
+        return wakeup
+
+    def drain(self):
+        self.lock.lock()
+        frames = list(self.frames)
+        self.frames.clear()
+        self.wakeup_pending = False
+        self.lock.unlock()
+        self.depth = len(frames)
+        self.coalesced += max(0, len(frames) - 1)
+        return frames
+
+
+# writes received frames as columns t, l0, l1, r0, r1 to npz files of at most
+# `chunk` frames, see GazeFilter.transform_batch and gaze_benchmark --recording
+class SessionRecorder:
+    def __init__(self, directory: Path, chunk=60000):
+        self.directory = directory
+        self.chunk = chunk
+        self.t = np.zeros(chunk)
+        # l0, l1, r0, r1
+        self.eyes = np.zeros((chunk, 4, 3))
+        self.n = 0
+        self.files = 0
+        # flushed from the gui thread on exit
+        self.lock = QMutex()
+
+    def add(self, frames):
+        self.lock.lock()
+        for frame in frames:
+            self.t[self.n] = frame.t
+            self.eyes[self.n] = (frame.l0, frame.l1, frame.r0, frame.r1)
+            self.n += 1
+            if self.n == self.chunk:
+                self._write()
+        self.lock.unlock()
+
+    def flush(self):
+        self.lock.lock()
+        if self.n:
+            self._write()
+        self.lock.unlock()
+
+    def _write(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = time.strftime("%Y%m%d-%H%M%S") + f"-{self.files:04d}.npz"
+        (l0, l1, r0, r1) = self.eyes[: self.n].transpose(1, 0, 2)
+        np.savez(
+            Path(self.directory, name), t=self.t[: self.n], l0=l0, l1=l1, r0=r0, r1=r1
+        )
+        self.n = 0
+        self.files += 1
 
 
 class GazeThread(QThread):
     gaze_signal = Signal(object)
+    # list of frames that were queued in the socket
+    gaze_batch_signal = Signal(object)
+    # frames are waiting in frame_queue
+    gaze_ready_signal = Signal()
 
     def __init__(self, pause_lock):
         super().__init__()
         self.pause_lock = pause_lock
+        self.frame_queue = FrameQueue(Gaze.queue_capacity)
+        self.recorder = None
+        if Gaze.record:
+            self.recorder = SessionRecorder(Path(Gaze.record).expanduser())
+            atexit.register(self.recorder.flush)
 
         # for debugging
         # graph.setup()
 
+    def deliver(self, gaze_frames, received):
+        latency.record("decode", latency.now() - received)
+        for gaze_frame in gaze_frames:
+            gaze_frame.received = received
+        if self.recorder:
+            self.recorder.add(gaze_frames)
+        if not Gaze.coalesce:
+            self.gaze_batch_signal.emit(gaze_frames)
+        elif self.frame_queue.put(gaze_frames):
+            self.gaze_ready_signal.emit()
+
+    # read frames from shared memory until the connection breaks, the socket only
+    # carries wakeups while the ring is empty
+    def run_shared_ring(self, handshake):
+        ring = SharedFrameRing.attach(handshake[1:].rstrip(b"\0").decode())
+        print(f"Reading frames from {ring.name}")
+        decode = lambda records: InputFrame.from_batch(records, ring.record_size)
+        try:
+            while True:
+                self.pause_lock.lock()
+                self.pause_lock.unlock()
+                received = latency.now()
+                gaze_frames = ring.read(decode)
+                if gaze_frames:
+                    self.deliver(gaze_frames, received)
+                    continue
+                ring.set_waiting(1)
+                # the producer may have written before seeing the flag
+                if ring.available() == 0:
+                    try:
+                        sock_gaze.receive_batch(2.0)
+                    except TimeoutError:
+                        pass
+                ring.set_waiting(0)
+        finally:
+            ring.close()
+
     def run(self):
         sock_gaze.listen()
         while True:
@@ -53,12 +291,33 @@ class GazeThread(QThread):
                 while True:
                     self.pause_lock.lock()
                     self.pause_lock.unlock()
+                    if Gaze.batch:
+                        transmissions = sock_gaze.receive_batch(2.0)
+                        received = latency.now()
+                        if transmissions[0] == FrameFormat.shared_memory:
+                            self.run_shared_ring(
+                                bytes(transmissions[: sock_gaze.msg_length])
+                            )
+                        gaze_frames = InputFrame.from_batch(
+                            transmissions, sock_gaze.msg_length
+                        )
+                        self.deliver(gaze_frames, received)
+                        continue
                     transmission = sock_gaze.receive(2.0)
+                    received = latency.now()
+                    if transmission[0] == FrameFormat.shared_memory:
+                        self.run_shared_ring(transmission)
                     gaze_frame = InputFrame.from_bytes(transmission)
+                    gaze_frame.received = received
+                    latency.record("decode", latency.now() - received)
+                    if self.recorder:
+                        self.recorder.add([gaze_frame])
                     self.gaze_signal.emit(gaze_frame)
                     # graph.gaze_signal.emit(t, l0, l1, r0, r1)
 
             except (
+                # the producer's shared memory ring is gone
+                FileNotFoundError,
                 ValueError,
                 RuntimeError,
                 pickle.UnpicklingError,
@@ -69,3 +328,5 @@ class GazeThread(QThread):
             finally:
                 print("Clean up the connection")
                 sock_gaze.close_connection()
+                if self.recorder:
+                    self.recorder.flush()
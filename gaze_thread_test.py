@@ -0,0 +1,134 @@
+# python -m unittest gaze_thread_test.py
+
+from pathlib import Path
+import pickle
+import socket
+import tempfile
+import unittest
+
+import numpy as np
+
+from gaze_filter import GazeFilter
+from gaze_simulation import Uncalibrated, input_frames, session
+from gaze_thread import FrameFlags, FrameFormat, FrameQueue, InputFrame, SessionRecorder
+from unix_socket import UnixSocket
+
+
+def _frame():
+    return InputFrame(
+        12.5,
+        np.array((1.0, 2.0, 3.0)),
+        np.array((4.0, 5.0, 6.0)),
+        np.array((7.0, 8.0, 9.0)),
+        np.array((10.0, 11.0, 12.0)),
+    )
+
+
+class FrameAssertions(unittest.TestCase):
+    def assertFrameEqual(self, a: InputFrame, b: InputFrame):
+        self.assertEqual(a.t, b.t)
+        for key in ["l0", "r0", "l1", "r1"]:
+            np.testing.assert_array_equal(getattr(a, key), getattr(b, key))
+
+
+class TestInputFrame(FrameAssertions):
+    def test_binary(self):
+        transmission = _frame().to_bytes().ljust(200, b"\0")
+        self.assertEqual(transmission[0], FrameFormat.binary)
+        self.assertFrameEqual(InputFrame.from_bytes(transmission), _frame())
+
+    def test_binary_float32(self):
+        transmission = _frame().to_bytes(float32=True)
+        self.assertFrameEqual(InputFrame.from_bytes(transmission), _frame())
+
+    def test_validity(self):
+        transmission = bytearray(_frame().to_bytes())
+        transmission[1] |= FrameFlags.validity | FrameFlags.r_valid
+        frame = InputFrame.from_bytes(bytes(transmission))
+        self.assertFalse(frame.l0.any() or frame.l1.any())
+        np.testing.assert_array_equal(frame.r1, _frame().r1)
+
+    def test_pickle(self):
+        f = _frame()
+        transmission = pickle.dumps(
+            (f.t, tuple(f.l0), tuple(f.l1), tuple(f.r0), tuple(f.r1)),
+            pickle.HIGHEST_PROTOCOL,
+        ).ljust(200, b"\0")
+        self.assertEqual(transmission[0], FrameFormat.pickle)
+        self.assertFrameEqual(InputFrame.from_bytes(transmission), f)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            InputFrame.from_bytes(b"\x7f".ljust(200, b"\0"))
+
+
+class TestBatch(FrameAssertions):
+    def setUp(self):
+        self.sock = UnixSocket("", 200, 8)
+        (self.sock.connection, self.peer) = socket.socketpair()
+
+    def tearDown(self):
+        self.sock.close_connection()
+        self.peer.close()
+
+    def test_drain(self):
+        frames = [_frame() for _ in range(3)]
+        for i, frame in enumerate(frames):
+            frame.t = float(i)
+            self.peer.sendall(frame.to_bytes().ljust(200, b"\0"))
+        # partial message stays in the buffer
+        self.peer.sendall(frames[0].to_bytes()[:50])
+        transmissions = self.sock.receive_batch(1.0)
+        self.assertEqual(self.sock.wakeup_messages, 3)
+        self.assertEqual(self.sock.wakeup_bytes, 650)
+        batch = InputFrame.from_batch(transmissions, 200)
+        self.assertEqual([frame.t for frame in batch], [0.0, 1.0, 2.0])
+        self.assertFrameEqual(batch[2], frames[2])
+
+        self.peer.sendall(frames[0].to_bytes()[50:].ljust(150, b"\0"))
+        batch = InputFrame.from_batch(self.sock.receive_batch(1.0), 200)
+        self.assertEqual(len(batch), 1)
+        self.assertFrameEqual(batch[0], frames[0])
+
+    def test_mixed(self):
+        self.peer.sendall(_frame().to_bytes().ljust(200, b"\0"))
+        self.peer.sendall(_frame().to_bytes(float32=True).ljust(200, b"\0"))
+        batch = InputFrame.from_batch(self.sock.receive_batch(1.0), 200)
+        self.assertEqual(len(batch), 2)
+        self.assertFrameEqual(batch[1], _frame())
+
+
+class TestFrameQueue(unittest.TestCase):
+    def test_coalesce(self):
+        queue = FrameQueue(4)
+        self.assertTrue(queue.put([1, 2]))
+        # wakeup already pending
+        self.assertFalse(queue.put([3, 4, 5]))
+        self.assertEqual(queue.drain(), [2, 3, 4, 5])
+        self.assertEqual((queue.depth, queue.dropped, queue.coalesced), (4, 1, 3))
+        self.assertTrue(queue.put([6]))
+
+
+class TestSessionRecorder(unittest.TestCase):
+    def test_replay(self):
+        columns = session(250)
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = SessionRecorder(Path(directory), chunk=100)
+            frames = input_frames(columns)
+            for i in range(0, len(frames), 30):
+                recorder.add(frames[i : i + 30])
+            recorder.flush()
+            paths = sorted(Path(directory).glob("*.npz"))
+            recordings = [np.load(path) for path in paths]
+            self.assertEqual([len(r["t"]) for r in recordings], [100, 100, 50])
+            recording = {
+                key: np.concatenate([r[key] for r in recordings])
+                for key in ["t", "l0", "l1", "r0", "r1"]
+            }
+        for key, x in recording.items():
+            np.testing.assert_array_equal(x, columns[key])
+        gaze_filter = GazeFilter(Uncalibrated())
+        np.testing.assert_array_equal(
+            gaze_filter.transform_batch(recording)["screen_position"],
+            gaze_filter.transform_batch(columns)["screen_position"],
+        )
@@ -2,6 +2,7 @@ from PySide2.QtCore import QRect, QRectF, Qt, QTimer, Slot, Signal
 from PySide2.QtGui import QFont, QColor, QPainter, QPixmap
 from PySide2.QtWidgets import QWidget
 from command_label import CommandLabel
+from gaze_filter import GazeEvent
 
 from logger import *
 from tiles import *
@@ -59,8 +60,11 @@ class LabelGrid(QWidget):
         self.hide_timer.timeout.connect(lambda: self.activate("empty"))
         self.hide_timer.setSingleShot(True)
 
+        # dwell selection of the label under the current fixation
         self.hover_timer = QTimer(self)
-        self.hover_timer.timeout.connect(self.select_item)
+        self.hover_timer.setSingleShot(True)
+        self.hover_timer.timeout.connect(self.select_dwell_item)
+        self.dwell_item = None
 
         dx = int(geometry.width() / Tiles.x)
         dy = int(geometry.height() / Tiles.y)
@@ -89,6 +93,7 @@ class LabelGrid(QWidget):
             self.set_hovered_item(None)
             self.state.modifiers.clear()
             self.state.hold = False
+            self.dwell_item = None
             self.hover_timer.stop()
             self.hide()
 
@@ -100,7 +105,7 @@ class LabelGrid(QWidget):
         self.state.layer = levelId
         self.update_grid()
 
-    def on_gaze(self, x, y, after_activation=False):
+    def label_at(self, x, y):
         if not QRectF(0, 0, 1, 1).contains(x, y):
             return log_debug("outside")
 
@@ -109,14 +114,36 @@ class LabelGrid(QWidget):
         if xWidget >= Tiles.x or yWidget >= Tiles.y:
             return log_debug("invalid indices: " + str(xWidget) + ", " + str(yWidget))
 
-        widget = self.labels[(xWidget, yWidget)]
-        self.set_hovered_item(widget)
+        return self.labels[(xWidget, yWidget)]
 
-        if not after_activation and self.state.timeout:
-            self.hover_timer.start(int(Times.element_selection * 1000))
-        else:
+    # highlight follows every frame, a fixation from before the activation
+    # doesn't select
+    def on_gaze(self, x, y, after_activation=False):
+        widget = self.label_at(x, y)
+        if widget:
+            self.set_hovered_item(widget)
+        if after_activation:
+            self.dwell_item = None
             self.hover_timer.stop()
 
+    # dwell selection, the timer runs during a fixation on an element
+    def on_fixation(self, event: GazeEvent):
+        if event.kind == "fixation_start":
+            self.dwell_item = self.label_at(event.position[0], event.position[1])
+            if self.dwell_item and self.state.timeout:
+                remaining = max(0.0, Times.element_selection - event.duration)
+                self.hover_timer.start(int(remaining * 1000))
+        elif event.kind == "fixation_end":
+            self.dwell_item = None
+            self.hover_timer.stop()
+
+    # the fixated label, not the one that a jittering frame last hovered
+    @Slot()
+    def select_dwell_item(self):
+        if self.dwell_item:
+            self.set_hovered_item(self.dwell_item)
+            self.select_item()
+
     def set_hovered_item(self, widget):
         if widget != self.hover_item:
             if widget:
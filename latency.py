@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+
+
+# Latency of the gaze pipeline, measured from the moment a frame was received.
+#
+# Every span keeps a ring of the last `window` samples, percentiles are computed on
+# demand. Spans are recorded from the gaze thread and the gui thread, readers may
+# see a slightly outdated ring but never an inconsistent one.
+#
+# blink_wait is the exception, it is the tracker time from the last flip of a
+# blink until it was dispatched, i.e. the wait for the blink latency.
+
+window = 1000
+# seconds since receive, per span
+samples: dict[str, np.ndarray] = {}
+counts: dict[str, int] = {}
+# receive time of the frame that is currently processed
+origin = None
+
+
+def now():
+    return time.perf_counter()
+
+
+def record(span, seconds):
+    # readers look spans up in samples, so its count must exist first
+    if span not in samples:
+        counts[span] = 0
+        samples[span] = np.zeros(window)
+    samples[span][counts[span] % window] = seconds
+    counts[span] += 1
+
+
+# processing of a frame starts
+def begin(received):
+    global origin
+    origin = received
+
+
+# processing of a frame ends
+def end():
+    global origin
+    origin = None
+
+
+# time since the current frame was received, ignored outside of a frame
+def mark(span):
+    if origin is not None:
+        record(span, now() - origin)
+
+
+# span -> (p50, p95, p99, count) in milliseconds
+def percentiles(span=None):
+    if span is not None:
+        if span not in samples or not counts[span]:
+            return None
+        n = min(counts[span], window)
+        p50, p95, p99 = 1000 * np.percentile(samples[span][:n], (50, 95, 99))
+        return (p50, p95, p99, counts[span])
+    return {span: percentiles(span) for span in list(samples)}
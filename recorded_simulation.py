@@ -1,23 +1,25 @@
 #!/usr/bin/env python
 
-import re, time, subprocess
+import argparse, time, subprocess
 
+import numpy as np
+
+from gaze_calibration import screen_size_mm
+from gaze_simulation import l0, r0
+from gaze_thread import FrameFormat, InputFrame, frame_dtype
+from shared_ring import SharedFrameRing
 from unix_socket import UnixSocket
 
 from settings import Sockets
 
 
-sock_gaze = UnixSocket(Sockets.gaze, 100)
-
-p = subprocess.Popen("./main.py", shell=True)
-
-
 def rangef(start, stop, step):
     return [
         _t / 1000 for _t in range(int(start * 1000), int(stop * 1000), int(step * 1000))
     ]
 
 
+# screen position (0=top-left 1=bottom-right) and time
 frames = [
     (0.5, 0.5, 0),
     (0.1, 0.1, 0.5),
@@ -30,20 +32,72 @@ frames = [
     (0.9, 0.9, 7),
 ]
 
-time.sleep(2)
 
-dt = 0.01
-for i in range(len(frames) - 1):
-    frame1 = frames[i]
-    frame2 = frames[i + 1]
+def path(dt):
+    for i in range(len(frames) - 1):
+        frame1 = frames[i]
+        frame2 = frames[i + 1]
+
+        for t in rangef(frame1[2], frame2[2], dt):
+            alpha = (t - frame1[2]) / (frame2[2] - frame1[2])
+            x = (1 - alpha) * frame1[0] + alpha * frame2[0]
+            y = (1 - alpha) * frame1[1] + alpha * frame2[1]
+            yield (t, x, y)
+
+
+# inverse of the uncalibrated projection in EyeCalibration
+def input_frame(t, x, y):
+    destination = np.zeros(3)
+    destination[:2] = (np.array((x, y)) - (0.5, 1.0)) * screen_size_mm
+    return InputFrame(t, l0, r0, destination, destination)
+
+
+# send one padded message, e.g. UnixSocket.try_send
+class SocketProducer:
+    def __init__(self, send):
+        self.send_message = send
+
+    def send(self, frame: InputFrame):
+        self.send_message(frame.to_bytes())
+
+    def close(self):
+        pass
+
+
+class SharedMemoryProducer:
+    def __init__(self, send, capacity=256):
+        self.send_message = send
+        self.ring = SharedFrameRing.create(None, capacity, frame_dtype[0].itemsize)
+        self.send_message(bytes([FrameFormat.shared_memory]) + self.ring.name.encode())
+
+    def send(self, frame: InputFrame):
+        if self.ring.write(frame.to_bytes()):
+            self.send_message(bytes([FrameFormat.wakeup]))
+
+    def close(self):
+        self.ring.close()
+        self.ring.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay a gaze path to eyeput")
+    parser.add_argument("--shm", action="store_true", help="use shared memory")
+    parser.add_argument("--no-app", action="store_true", help="don't start eyeput")
+    args = parser.parse_args()
 
-    for t in rangef(frame1[2], frame2[2], dt):
-        alpha = (t - frame1[2]) / (frame2[2] - frame1[2])
-        x = (1 - alpha) * frame1[0] + alpha * frame2[0]
-        y = (1 - alpha) * frame1[1] + alpha * frame2[1]
-        time.sleep(dt)
+    sock_gaze = UnixSocket(Sockets.gaze, 200)
+    p = None if args.no_app else subprocess.Popen("./main.py", shell=True)
 
-        message = f"{time.time()} {x} {y}"
-        sock_gaze.try_send(message)
+    time.sleep(2)
 
-p.kill()
+    Producer = SharedMemoryProducer if args.shm else SocketProducer
+    producer = Producer(sock_gaze.try_send)
+    dt = 0.01
+    try:
+        for (_t, x, y) in path(dt):
+            time.sleep(dt)
+            producer.send(input_frame(time.time(), x, y))
+    finally:
+        producer.close()
+        if p:
+            p.kill()
@@ -19,6 +19,38 @@ class Sockets:
     eyeput = "/tmp/eyeput.fifo"
 
 
+class Gaze:
+    # drain all queued frames per wakeup and deliver them as one batch
+    batch = True
+    # batches are handed to the gui thread through a bounded queue, all frames
+    # update the filters but only the newest one is rendered
+    coalesce = True
+    queue_capacity = 256
+    # directory that the received frames are recorded to as npz files for
+    # offline replay, e.g. "~/.cache/eyeput/recordings", None to not record
+    record = None
+    # the hover highlight follows the pointer extrapolated by the pipeline
+    # latency, see PredictionFilter; blinks and fixations keep the pointer
+    predict = False
+
+
+class CalibrationSettings:
+    # profiles are kept per tracker and display
+    tracker = "tobii"
+    profile = "default"
+    # 2 x 2 up to 5 x 5 reference points
+    columns = 3
+    rows = 3
+    # "triangles", "polynomial" or "plane", the latter compensates head movement
+    model = "triangles"
+    # lowered if there are too few reference points
+    polynomial_order = 2
+    # accepted samples per reference point
+    samples = 45
+    # a reference point completes once the accepted samples spread less [mm]
+    spread = 6.0
+
+
 class Tiles:
     x = 14
     y = 6
@@ -43,6 +75,7 @@ class Colors:
     eye_left = QColor("lime")
     eye_right = QColor("red")
     eye_center = QColor("cyan")
+    eye_predicted = QColor("magenta")
 
 
 class Times:
@@ -0,0 +1,147 @@
+from multiprocessing import resource_tracker, shared_memory
+import os
+import sys
+
+import numpy as np
+
+
+_header_dtype = np.dtype(
+    [
+        ("magic", "<u4"),
+        ("capacity", "<u4"),
+        ("record_size", "<u4"),
+        ("reader_waiting", "<u4"),
+        # number of records written so far
+        ("write_seq", "<u8"),
+    ]
+)
+_magic = 0x65796570
+_writing = np.iinfo(np.uint64).max
+# segments created by this process, the resource tracker keeps one entry each
+_created = set()
+
+
+# single producer, single consumer ring of fixed size records in shared memory
+#
+# layout: header | sequence number per slot | records
+#
+# the producer publishes a record by invalidating its slot sequence number, writing
+# the record, then the sequence number and finally write_seq; the consumer decodes
+# in place and discards records that were overwritten meanwhile
+#
+# the consumer sets reader_waiting before it sleeps on the gaze socket, the
+# producer only sends a wakeup message when that flag is set
+class SharedFrameRing:
+    def __init__(self, memory, create=False, capacity=0, record_size=0):
+        self.memory = memory
+        self.header = np.ndarray((), _header_dtype, memory.buf, 0)
+        if create:
+            self.header["magic"] = _magic
+            self.header["capacity"] = capacity
+            self.header["record_size"] = record_size
+            self.header["write_seq"] = 0
+            self.header["reader_waiting"] = 0
+        elif self.header["magic"] != _magic:
+            raise ValueError(f"{memory.name} is not a gaze frame ring")
+        self.capacity = int(self.header["capacity"])
+        self.record_size = int(self.header["record_size"])
+        # plain views of the hot header fields are much faster than field access
+        self.write_seq = self.header["write_seq"].reshape(1)
+        self.reader_waiting = self.header["reader_waiting"].reshape(1)
+        offset = _header_dtype.itemsize
+        self.slot_seq = np.ndarray((self.capacity,), "<u8", memory.buf, offset)
+        offset += self.slot_seq.nbytes
+        self.records = np.ndarray(
+            (self.capacity, self.record_size), np.uint8, memory.buf, offset
+        )
+        self.record_view = memory.buf[offset : offset + self.records.nbytes]
+        self.read_seq = int(self.write_seq[0])
+        # records overwritten before they were read
+        self.dropped = 0
+
+    @staticmethod
+    def create(name, capacity, record_size):
+        size = _header_dtype.itemsize + capacity * (8 + record_size)
+        memory = shared_memory.SharedMemory(name, create=True, size=size)
+        _created.add(memory.name)
+        return SharedFrameRing(memory, True, capacity, record_size)
+
+    # the producer owns the segment, the resource tracker of this process would
+    # unlink it on exit
+    @staticmethod
+    def attach(name):
+        if sys.version_info >= (3, 13):
+            return SharedFrameRing(shared_memory.SharedMemory(name, track=False))
+        memory = shared_memory.SharedMemory(name)
+        if os.name == "posix" and memory.name not in _created:
+            resource_tracker.unregister(memory._name, "shared_memory")
+        return SharedFrameRing(memory)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self):
+        # views must be released before the mapping
+        del self.header, self.write_seq, self.reader_waiting
+        del self.slot_seq, self.records
+        self.record_view.release()
+        self.memory.close()
+
+    def unlink(self):
+        _created.discard(self.memory.name)
+        self.memory.unlink()
+
+    # producer
+
+    # returns whether the consumer is sleeping and needs a wakeup
+    def write(self, record):
+        seq = int(self.write_seq[0])
+        i = seq % self.capacity
+        offset = i * self.record_size
+        # invalidate while writing
+        self.slot_seq[i] = _writing
+        self.record_view[offset : offset + len(record)] = record
+        self.slot_seq[i] = seq
+        self.write_seq[0] = seq + 1
+        if self.reader_waiting[0]:
+            self.reader_waiting[0] = 0
+            return True
+        return False
+
+    # consumer
+
+    def available(self):
+        return int(self.write_seq[0]) - self.read_seq
+
+    def set_waiting(self, waiting):
+        self.reader_waiting[0] = waiting
+
+    # decode receives memoryviews of consecutive records and returns a list,
+    # entries of overwritten records are discarded afterwards
+    def read(self, decode):
+        write_seq = int(self.write_seq[0])
+        if write_seq - self.read_seq > self.capacity:
+            self.dropped += write_seq - self.capacity - self.read_seq
+            self.read_seq = write_seq - self.capacity
+        start, end = self.read_seq % self.capacity, write_seq % self.capacity
+        if self.read_seq == write_seq:
+            return []
+        elif start < end:
+            chunks = [(start, end)]
+        else:
+            chunks = [(start, self.capacity), (0, end)]
+        result = []
+        chunks = [(u, v) for (u, v) in chunks if u < v]
+        for (u, v) in chunks:
+            result += decode(memoryview(self.records[u:v]).cast("B"))
+        # a slot that doesn't hold its sequence number anymore was invalidated or
+        # rewritten while decoding, even if write_seq isn't bumped yet
+        slot_seq = [self.slot_seq[u:v] for (u, v) in chunks]
+        expected = np.arange(self.read_seq, write_seq, dtype=np.uint64)
+        kept = np.concatenate(slot_seq) == expected
+        if not kept.all():
+            result = [x for (x, keep) in zip(result, kept) if keep]
+            self.dropped += int(len(kept) - kept.sum())
+        self.read_seq = write_seq
+        return result
@@ -0,0 +1,81 @@
+# python -m unittest shared_ring_test.py
+
+import unittest
+
+from gaze_thread import FrameFormat, InputFrame
+from recorded_simulation import SharedMemoryProducer, input_frame, path
+from shared_ring import SharedFrameRing
+
+
+class TestSharedFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+        self.producer = SharedMemoryProducer(self.messages.append, 16)
+        handshake = self.messages.pop()
+        self.assertEqual(handshake[0], FrameFormat.shared_memory)
+        self.ring = SharedFrameRing.attach(handshake[1:].decode())
+
+    def tearDown(self):
+        self.ring.close()
+        self.producer.close()
+
+    def read(self):
+        decode = lambda records: InputFrame.from_batch(records, self.ring.record_size)
+        return self.ring.read(decode)
+
+    def send(self, n):
+        frames = [input_frame(t, x, y) for (t, x, y) in list(path(0.01))[:n]]
+        for frame in frames:
+            self.producer.send(frame)
+        return frames
+
+    def test_read(self):
+        self.assertEqual(self.read(), [])
+        frames = self.send(10)
+        self.assertEqual([f.t for f in self.read()], [f.t for f in frames])
+        self.assertEqual(self.ring.available(), 0)
+
+    def test_wrap(self):
+        self.send(10)
+        self.read()
+        frames = self.send(10)
+        result = self.read()
+        self.assertEqual([f.t for f in result], [f.t for f in frames])
+        self.assertEqual(result[-1].l1.tolist(), frames[-1].l1.tolist())
+
+    def test_overrun(self):
+        frames = self.send(20)
+        self.assertEqual([f.t for f in self.read()], [f.t for f in frames[4:]])
+        self.assertEqual(self.ring.dropped, 4)
+
+    def test_wakeup(self):
+        self.send(1)
+        self.assertEqual(self.messages, [])
+        self.read()
+        self.ring.set_waiting(1)
+        self.send(2)
+        self.assertEqual(self.messages, [bytes([FrameFormat.wakeup])])
+
+    def test_lapped_while_decoding(self):
+        frames = self.send(10)
+
+        def decode(records):
+            # producer overwrites the two oldest slots meanwhile
+            self.send(8)
+            return InputFrame.from_batch(records, self.ring.record_size)
+
+        result = self.ring.read(decode)
+        self.assertEqual([f.t for f in result], [f.t for f in frames[2:]])
+        self.assertEqual(self.ring.dropped, 2)
+
+    def test_rewritten_before_publishing(self):
+        frames = self.send(10)
+
+        def decode(records):
+            # producer rewrote the oldest slot but hasn't bumped write_seq yet
+            self.ring.slot_seq[0] = 16
+            return InputFrame.from_batch(records, self.ring.record_size)
+
+        result = self.ring.read(decode)
+        self.assertEqual([f.t for f in result], [f.t for f in frames[1:]])
+        self.assertEqual(self.ring.dropped, 1)
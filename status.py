@@ -5,6 +5,7 @@ from PySide2.QtGui import QFont, QColor, QPainter, QPixmap
 from PySide2.QtCore import Qt, QPoint, QRect, QTimer, Slot
 
 from settings import *
+import latency
 
 
 class Status(QWidget):
@@ -14,6 +15,9 @@ class Status(QWidget):
         self.mode = mode
         self.eyes = (0, 0)
         self.stats = ""
+        self.queue = (0, 0, 0)
+        self.queue_stats = ""
+        self.latency_stats = ""
         # https://psutil.readthedocs.io/en/latest/#process-class
         self.current_process = psutil.Process()
 
@@ -29,6 +33,11 @@ class Status(QWidget):
     def update_stats(self):
         self.update()
         self.stats = "{:.0f}%".format(self.current_process.cpu_percent())
+        self.queue_stats = "q{} d{} c{}".format(*self.queue)
+        # processing time of rendered frames
+        done = latency.percentiles("done")
+        if done:
+            self.latency_stats = "{:.0f}/{:.0f}ms".format(done[0], done[1])
 
     def _get_color(self, variance):
         if variance == 0:
@@ -52,6 +61,9 @@ class Status(QWidget):
             self.eyes = (l, r)
             self.update()
 
+    def on_queue_stats(self, depth, dropped, coalesced):
+        self.queue = (depth, dropped, coalesced)
+
     def set_mode(self, mode):
         self.mode = mode
         self.update()
@@ -87,7 +99,7 @@ class Status(QWidget):
         # draw background
         # painter.setPen(Colors.text)
         painter.setBrush(QColor(255, 255, 255, 120))
-        painter.drawRect(QRect(0, 0, 50, 30))
+        painter.drawRect(QRect(0, 0, 50, 50))
 
         # draw text
         fontSize = 8
@@ -108,3 +120,17 @@ class Status(QWidget):
             Qt.AlignCenter,
             self.stats,
         )
+
+        # draw gaze queue
+        painter.drawText(
+            QRect(0, 20, 45, 20),
+            Qt.AlignCenter,
+            self.queue_stats,
+        )
+
+        # draw latency p50/p95
+        painter.drawText(
+            QRect(0, 30, 45, 20),
+            Qt.AlignCenter,
+            self.latency_stats,
+        )
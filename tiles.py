@@ -57,6 +57,14 @@ class GridLayerAction(Action):
     modifiers: set = field(default_factory=set)
 
 
+# actions that can be taken back, such blink actions are dispatched before it is
+# certain that the blink pattern isn't extended
+def is_reversible(action: Action):
+    return type(action) is GridLayerAction or (
+        type(action) is BlinkAction and action.id == "scroll_stop"
+    )
+
+
 tile_groups = {
     "letters": {
         "tiles": {
@@ -244,6 +252,10 @@ tile_groups = {
             "pause_tag": (TagAction("pause", None, "pause"), None),
             "debug_gaze": (TagAction("👁", None, "debug_gaze"), None),
             "follow_tag": (TagAction("follow", None, "follow"), None),
+            "pointer_tag": (
+                TagAction("1€", None, "pointer_one_euro"),
+                TagAction("kalman", None, "pointer_kalman"),
+            ),
         },
         "width": 4,
         "height": 1,
@@ -4,11 +4,23 @@ import os, socket
 class UnixSocket:
     reconnect = False
 
-    def __init__(self, path, msg_length):
+    # receive_batch counters, per wakeup and in total
+    wakeups = 0
+    wakeup_bytes = 0
+    wakeup_messages = 0
+    total_bytes = 0
+    total_messages = 0
+
+    def __init__(self, path, msg_length, batch_capacity=64):
         self.path = path
         self.msg_length = msg_length
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.sock.setblocking(False)
+        # preallocated for receive_batch, a partial message is kept at the front
+        self.batch_buffer = bytearray(msg_length * batch_capacity)
+        self.batch_view = memoryview(self.batch_buffer)
+        self.batch_filled = 0
+        self.batch_consumed = 0
 
     def try_send(self, msg):
         try:
@@ -37,6 +49,8 @@ class UnixSocket:
 
     def close_connection(self):
         self.connection.close()
+        self.batch_filled = 0
+        self.batch_consumed = 0
 
     def listen(self):
         mask = os.umask(~0o662)
@@ -78,5 +92,36 @@ class UnixSocket:
 
         return b"".join(chunks)
 
+    # blocks until at least one message is complete and returns all complete
+    # messages that arrived so far; the returned view is only valid until the
+    # next call
+    def receive_batch(self, timeout=None):
+        view = self.batch_view
+        # move the partial message of the last call to the front
+        rest = self.batch_filled - self.batch_consumed
+        if rest > 0:
+            view[:rest] = view[self.batch_consumed : self.batch_filled]
+        self.batch_filled = rest
+        self.batch_consumed = 0
+
+        received = 0
+        self.connection.settimeout(timeout)
+        while self.batch_filled < self.msg_length:
+            # a single call usually drains everything that is queued
+            n = self.connection.recv_into(view[self.batch_filled :])
+            if n == 0:
+                raise RuntimeError("socket connection broken")
+            self.batch_filled += n
+            received += n
+
+        messages = self.batch_filled // self.msg_length
+        self.batch_consumed = messages * self.msg_length
+        self.wakeups += 1
+        self.wakeup_bytes = received
+        self.wakeup_messages = messages
+        self.total_bytes += received
+        self.total_messages += messages
+        return view[: self.batch_consumed]
+
     def receive_string(self):
         return self.receive().strip(b"\0").decode()
@@ -1,7 +1,9 @@
+import asyncio
+import concurrent.futures
 import timeit
 
 from PySide2.QtWidgets import QWidget
-from PySide2.QtCore import QPoint, QPointF
+from PySide2.QtCore import QObject, QPoint, QPointF, Qt, Signal, Slot
 
 import numpy as np
 
@@ -21,14 +23,65 @@ def qpoint(x):
     return QPoint(int(x[0]), int(x[1]))
 
 
-def slice(buffer, u, v=None):
-    assert v == None
-    assert u < 0
-    return np.fromiter(
-        reversed(buffer),
-        dtype=np.dtype((float, len(buffer[0]))),
-        count=min(-u, len(buffer)),
-    )
+# preallocated history of fixed length, the last n samples are a contiguous view
+# in chronological order, i.e. buffer.last()[-1] is the newest sample
+#
+# every sample is stored twice so that views never wrap around
+class RingBuffer:
+    def __init__(self, length, shape=(), dtype=float):
+        self.length = length
+        self.data = np.zeros((2 * length, *shape), dtype)
+        # newest sample, in [length, 2 * length)
+        self.index = 2 * length - 1
+        # samples since last clear
+        self.count = 0
+
+    def append(self, x):
+        self.index += 1
+        if self.index == 2 * self.length:
+            self.index = self.length
+        self.data[self.index] = x
+        self.data[self.index - self.length] = x
+        self.count += 1
+
+    def last(self, n=None):
+        if n is None:
+            n = self.length
+        elif n > self.length:
+            raise ValueError(f"{n} samples requested, {self.length} kept")
+        return self.data[self.index - n + 1 : self.index + 1]
+
+    def clear(self):
+        self.data.fill(0)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.length)
+
+
+# runs functions in the thread that created it, e.g. for session bus methods
+# that touch state of the gui thread
+#
+#   result = await gui_call(lambda: ...)
+class ThreadCall(QObject):
+    call_signal = Signal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.call_signal.connect(self.on_call, Qt.QueuedConnection)
+
+    @Slot(object, object)
+    def on_call(self, func, future):
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+
+    # awaitable from the asyncio loop of the calling thread
+    def __call__(self, func):
+        future = concurrent.futures.Future()
+        self.call_signal.emit(func, future)
+        return asyncio.wrap_future(future)
 
 
 # is set in QApplication`s constructor